@@ -0,0 +1,383 @@
+"""
+Envrypt local secrets agent.
+
+Runs next to your workloads (sidecar / per-host daemon), authenticates with a service
+token and keeps an encrypted on-disk cache of one or more vaults. Local processes read
+secrets from the agent over a Unix socket or from a rendered file, so a mass redeploy
+turns into one upstream fetch per agent instead of one per process, and workloads can
+keep starting from the cache during short API outages.
+
+Usage:
+    python envrypt_agent.py run  --vault shared --vault api-prod --socket /run/envrypt/agent.sock
+    python envrypt_agent.py once --vault api-prod --render /run/envrypt/.env
+
+See agent/README.md for all options.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import httpx
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+CACHE_FORMAT_VERSION = 1
+
+
+def log(message: str):
+    print(f"[envrypt-agent] {message}", file=sys.stderr, flush=True)
+
+
+# ---------------------------------------------------------------------------
+# Encrypted cache file
+# ---------------------------------------------------------------------------
+
+def _derive_cache_key(service_token: str, salt: bytes) -> bytes:
+    """The cache is only readable with the same service token that filled it."""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=b"envrypt-agent-cache").derive(
+        service_token.encode("utf-8")
+    )
+
+
+class EncryptedCache:
+    def __init__(self, path: str, service_token: str):
+        self.path = path
+        self.service_token = service_token
+
+    def load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "rb") as f:
+                envelope = json.loads(f.read())
+            if envelope.get("v") != CACHE_FORMAT_VERSION:
+                return {}
+            salt = base64.b64decode(envelope["salt"])
+            nonce = base64.b64decode(envelope["nonce"])
+            ciphertext = base64.b64decode(envelope["data"])
+            plaintext = AESGCM(_derive_cache_key(self.service_token, salt)).decrypt(nonce, ciphertext, None)
+            return json.loads(plaintext)
+        except FileNotFoundError:
+            return {}
+        except (InvalidTag, ValueError, KeyError) as e:
+            log(f"Ignoring unreadable cache {self.path} ({type(e).__name__}: {e})")
+            return {}
+
+    def save(self, vaults: Dict[str, dict]):
+        salt = os.urandom(16)
+        nonce = os.urandom(12)
+        plaintext = json.dumps(vaults, separators=(",", ":")).encode("utf-8")
+        ciphertext = AESGCM(_derive_cache_key(self.service_token, salt)).encrypt(nonce, plaintext, None)
+        envelope = {
+            "v": CACHE_FORMAT_VERSION,
+            "salt": base64.b64encode(salt).decode(),
+            "nonce": base64.b64encode(nonce).decode(),
+            "data": base64.b64encode(ciphertext).decode(),
+        }
+        _atomic_write(self.path, json.dumps(envelope).encode("utf-8"))
+
+
+def _atomic_write(path: str, data: bytes):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------------
+# Upstream fetch + state
+# ---------------------------------------------------------------------------
+
+class SecretsAgent:
+    def __init__(self, api_url: str, service_token: str, vaults: List[str], cache_path: str,
+                 refresh_interval: float = 60.0, timeout: float = 10.0,
+                 render_path: Optional[str] = None, render_format: str = "dotenv"):
+        self.api_url = api_url.rstrip("/")
+        self.vaults = vaults
+        self.refresh_interval = refresh_interval
+        self.render_path = render_path
+        self.render_format = render_format
+        self.cache = EncryptedCache(cache_path, service_token)
+        self.http = httpx.Client(
+            headers={"Authorization": f"Bearer {service_token}", "User-Agent": "envrypt-agent/1"},
+            timeout=timeout,
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # vault -> {"etag", "secrets", "fetched_at"}
+        self.state: Dict[str, dict] = {}
+        self.errors: Dict[str, str] = {}
+
+    def load_cache(self) -> bool:
+        cached = self.cache.load()
+        with self._lock:
+            self.state = {v: cached[v] for v in self.vaults if v in cached}
+        if self.state:
+            log(f"Loaded {len(self.state)} vault(s) from cache")
+        return len(self.state) == len(self.vaults)
+
+    def fetch_vault(self, vault: str) -> bool:
+        """Conditional fetch of one vault. Returns True if its contents changed."""
+        current = self.state.get(vault)
+        headers = {}
+        if current and current.get("etag"):
+            headers["If-None-Match"] = current["etag"]
+
+        response = self.http.get(f"{self.api_url}/service/vaults/{quote(vault, safe='')}/secrets", headers=headers)
+        if response.status_code == 304:
+            with self._lock:
+                current["fetched_at"] = time.time()
+                self.errors.pop(vault, None)
+            return False
+        response.raise_for_status()
+
+        entry = {"etag": response.headers.get("etag"), "secrets": response.json(), "fetched_at": time.time()}
+        with self._lock:
+            changed = current is None or current.get("etag") != entry["etag"] or current.get("secrets") != entry["secrets"]
+            self.state[vault] = entry
+            self.errors.pop(vault, None)
+        return changed
+
+    def refresh(self) -> bool:
+        """Refresh every vault; keeps serving cached values for vaults that fail."""
+        changed = False
+        ok = True
+        for vault in self.vaults:
+            try:
+                changed = self.fetch_vault(vault) or changed
+            except Exception as e:
+                ok = False
+                with self._lock:
+                    self.errors[vault] = str(e)
+                log(f"Refresh of vault '{vault}' failed, serving cached copy if any: {e}")
+        if changed:
+            with self._lock:
+                snapshot = dict(self.state)
+            self.cache.save(snapshot)
+            self.render()
+        return ok
+
+    def merged(self) -> Dict[str, str]:
+        """All configured vaults merged; later --vault arguments take precedence."""
+        out = {}
+        with self._lock:
+            for vault in self.vaults:
+                out.update(self.state.get(vault, {}).get("secrets", {}))
+        return out
+
+    def render(self):
+        if not self.render_path:
+            return
+        values = self.merged()
+        if self.render_format == "json":
+            data = json.dumps(values, indent=2, sort_keys=True)
+        else:
+            data = "".join(f"{k}={_dotenv_quote(v)}\n" for k, v in sorted(values.items()))
+        _atomic_write(self.render_path, data.encode("utf-8"))
+
+    def run_refresh_loop(self, healthy: bool = True):
+        backoff = 1.0
+        while not self._stop.is_set():
+            # Jitter spreads agents that started together across the interval
+            if healthy:
+                backoff = 1.0
+                delay = self.refresh_interval * random.uniform(0.8, 1.2)
+            else:
+                backoff = min(backoff * 2, self.refresh_interval)
+                delay = backoff * random.uniform(0.5, 1.0)
+            if self._stop.wait(delay):
+                break
+            healthy = self.refresh()
+
+    def stop(self):
+        self._stop.set()
+        self.http.close()
+
+    def health(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                vault: {
+                    "cached": vault in self.state,
+                    "age_seconds": round(now - self.state[vault]["fetched_at"], 1) if vault in self.state else None,
+                    "last_error": self.errors.get(vault),
+                }
+                for vault in self.vaults
+            }
+
+
+def _dotenv_quote(value) -> str:
+    if value is None:
+        return ""
+    value = str(value)
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+
+# ---------------------------------------------------------------------------
+# Unix socket server (HTTP/1.1)
+#   GET /health               agent and per-vault cache status
+#   GET /v1/secrets           merged key/value map of all vaults
+#   GET /v1/secrets/<KEY>     single value as text/plain
+#   GET /v1/vaults/<vault>    one configured vault
+# e.g. curl --unix-socket /run/envrypt/agent.sock http://agent/v1/secrets
+# ---------------------------------------------------------------------------
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _make_handler(agent: SecretsAgent):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            return "unix"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body, content_type: str = "application/json"):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            if agent.errors:
+                self.send_header("X-Envrypt-Stale", "1")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0].rstrip("/")
+            if path == "/health":
+                return self._send(200, agent.health())
+            if path.startswith("/v1/") and not agent.state:
+                # Started without a cache and the first fetch hasn't succeeded yet
+                return self._send(503, {"detail": "Secrets are not loaded yet"})
+            if path == "/v1/secrets":
+                return self._send(200, agent.merged())
+            if path.startswith("/v1/secrets/"):
+                key = path[len("/v1/secrets/"):]
+                values = agent.merged()
+                if key not in values:
+                    return self._send(404, {"detail": f"Secret '{key}' not found"})
+                return self._send(200, (values[key] or "").encode("utf-8"), "text/plain; charset=utf-8")
+            if path.startswith("/v1/vaults/"):
+                vault = path[len("/v1/vaults/"):]
+                if vault not in agent.state:
+                    return self._send(404, {"detail": f"Vault '{vault}' is not cached by this agent"})
+                return self._send(200, agent.state[vault]["secrets"])
+            return self._send(404, {"detail": "Not found"})
+
+    return Handler
+
+
+def serve_socket(agent: SecretsAgent, path: str) -> _UnixHTTPServer:
+    if os.path.exists(path):
+        # Remove a stale socket from a previous run, but never a live one
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            raise SystemExit(f"Another agent is already listening on {path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+        finally:
+            probe.close()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    old_umask = os.umask(0o177)
+    try:
+        server = _UnixHTTPServer(path, _make_handler(agent))
+    finally:
+        os.umask(old_umask)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Envrypt local caching secrets agent")
+    parser.add_argument("command", choices=["run", "once"], help="run: keep refreshing and serving; once: fetch, render and exit")
+    parser.add_argument("--api-url", default=os.getenv("ENVRYPT_API_URL", "http://localhost:8000/api"))
+    parser.add_argument("--token", default=os.getenv("ENVRYPT_SERVICE_TOKEN"), help="Service token (or ENVRYPT_SERVICE_TOKEN)")
+    parser.add_argument("--vault", action="append", default=None,
+                        help="Vault ID or name; repeat for several vaults (later ones take precedence). Or ENVRYPT_VAULTS=a,b")
+    parser.add_argument("--cache", default=os.getenv("ENVRYPT_AGENT_CACHE", os.path.expanduser("~/.cache/envrypt/agent-cache.json")))
+    parser.add_argument("--socket", default=os.getenv("ENVRYPT_AGENT_SOCKET"), help="Unix socket path to serve secrets on")
+    parser.add_argument("--render", default=os.getenv("ENVRYPT_AGENT_RENDER"), help="File to render merged secrets into")
+    parser.add_argument("--format", choices=["dotenv", "json"], default=os.getenv("ENVRYPT_AGENT_FORMAT", "dotenv"))
+    parser.add_argument("--interval", type=float, default=float(os.getenv("ENVRYPT_AGENT_INTERVAL", "60")), help="Refresh interval in seconds")
+    parser.add_argument("--startup-jitter", type=float, default=float(os.getenv("ENVRYPT_AGENT_STARTUP_JITTER", "5")),
+                        help="Max random delay before the first refresh when a cached copy is available")
+    args = parser.parse_args(argv)
+    if not args.vault:
+        args.vault = [v.strip() for v in os.getenv("ENVRYPT_VAULTS", "").split(",") if v.strip()]
+    if not args.token:
+        parser.error("a service token is required (--token or ENVRYPT_SERVICE_TOKEN)")
+    if not args.vault:
+        parser.error("at least one --vault is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    agent = SecretsAgent(
+        api_url=args.api_url, service_token=args.token, vaults=args.vault, cache_path=args.cache,
+        refresh_interval=args.interval, render_path=args.render, render_format=args.format,
+    )
+    have_cache = agent.load_cache()
+
+    if args.command == "once":
+        ok = agent.refresh()
+        agent.render()
+        agent.stop()
+        # Succeed from cache during an outage; fail only if we have nothing to give
+        return 0 if ok or have_cache else 1
+
+    # Serve whatever the cache holds right away, before the jitter and the first fetch
+    server = serve_socket(agent, args.socket) if args.socket else None
+    if server:
+        log(f"Serving {len(args.vault)} vault(s) on {args.socket}")
+    signal.signal(signal.SIGTERM, lambda *_: agent._stop.set())
+    try:
+        if have_cache:
+            agent.render()
+            # Spread the first upstream fetch of agents started together
+            agent._stop.wait(random.uniform(0, args.startup_jitter))
+        if not agent._stop.is_set():
+            healthy = agent.refresh()
+            if not healthy and not have_cache:
+                log("Initial fetch failed and no cache is available; will keep retrying")
+            agent.render()
+            agent.run_refresh_loop(healthy)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
+        if server:
+            server.shutdown()
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
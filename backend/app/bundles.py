@@ -0,0 +1,103 @@
+import json
+import threading
+from typing import Dict, Optional
+from .config import settings
+from .crypto import encrypt_value, decrypt_value
+from .dependencies import get_supabase, get_supabase_admin
+from .metrics import record_cache
+
+# Precomputed encrypted vault bundles (requires migrations/001_vault_bundles.sql).
+#
+# A bundle is the whole key/value map of a vault encrypted as one envelope, tagged with
+# the vaults.content_version it was built from. The DB bumps content_version on every
+# write to `secrets`, so a bundle is served only while its version still matches; any
+# mismatch falls back to the per-secret rows and rebuilds the bundle.
+#
+# The version must be read *before* the rows a bundle is built from: if a write lands in
+# between, the bundle is tagged with an already-superseded version and is never served.
+
+BUNDLE_SELECT = "*, vault_bundles(content_version, value_encrypted, encrypted_key)"
+
+_lock = threading.Lock()
+_pending: Dict[str, threading.Timer] = {}
+
+
+def _admin_client():
+    return get_supabase_admin() or get_supabase()
+
+
+def read_bundle(vault: dict) -> Optional[Dict[str, str]]:
+    """
+    Returns the decrypted key/value map if the vault row (selected with BUNDLE_SELECT)
+    carries a bundle for its current content_version, else None.
+    """
+    bundle = vault.get("vault_bundles")
+    if isinstance(bundle, list):
+        bundle = bundle[0] if bundle else None
+
+    fresh = bool(bundle) and bundle.get("content_version") == vault.get("content_version")
+    record_cache("vault_bundle", fresh)
+    if not fresh:
+        return None
+    try:
+        return json.loads(decrypt_value(bundle["value_encrypted"], bundle["encrypted_key"]))
+    except Exception as e:
+        print(f"Ignoring unreadable bundle for vault {vault.get('id')}: {e}")
+        return None
+
+
+def store_bundle(vault_id: str, content_version: int, values: Dict[str, str], client=None):
+    """Encrypts and upserts a bundle. An older build overwriting a newer one only costs a rebuild."""
+    client = client or _admin_client()
+    try:
+        enc = encrypt_value(json.dumps(values, separators=(",", ":")))
+        client.table("vault_bundles").upsert({
+            "vault_id": vault_id,
+            "content_version": content_version,
+            "value_encrypted": enc["value"],
+            "encrypted_key": enc["key"],
+        }, on_conflict="vault_id").execute()
+    except Exception as e:
+        print(f"Failed to store bundle for vault {vault_id}: {e}")
+
+
+def rebuild_bundle(vault_id: str):
+    client = _admin_client()
+    if not client:
+        return
+    try:
+        vault_res = client.table("vaults").select("content_version").eq("id", vault_id).execute()
+        if not vault_res.data:
+            return
+        version = vault_res.data[0]["content_version"]
+
+        rows = client.table("secrets").select("key, value_encrypted, encrypted_key").eq("vault_id", vault_id).execute().data
+        values = {row["key"]: decrypt_value(row["value_encrypted"], row.get("encrypted_key")) for row in rows}
+    except Exception as e:
+        # Leave the old (now stale) bundle in place; reads fall back to the rows
+        print(f"Failed to rebuild bundle for vault {vault_id}: {e}")
+        return
+    store_bundle(vault_id, version, values, client=client)
+
+
+def schedule_rebuild(vault_id: str):
+    """
+    Debounced background rebuild after a write, so a burst of edits (e.g. a pasted .env
+    saved key by key) costs one rebuild instead of one per secret.
+    """
+    if not settings.VAULT_BUNDLES:
+        return
+
+    def run():
+        with _lock:
+            _pending.pop(vault_id, None)
+        rebuild_bundle(vault_id)
+
+    with _lock:
+        previous = _pending.pop(vault_id, None)
+        if previous:
+            previous.cancel()
+        timer = threading.Timer(settings.VAULT_BUNDLE_REBUILD_DELAY, run)
+        timer.daemon = True
+        _pending[vault_id] = timer
+        timer.start()
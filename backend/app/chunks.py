@@ -0,0 +1,177 @@
+import uuid
+import zlib
+from typing import AsyncIterator, Iterator
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .crypto import (
+    generate_data_key, wrap_data_key, unwrap_data_key, encrypt_chunk, decrypt_chunk,
+    new_fingerprint, format_fingerprint,
+)
+from .dependencies import get_supabase, get_supabase_admin
+
+# Chunked storage for file-style secrets (requires migrations/003_file_secrets.sql).
+#
+# A file secret is a normal `secrets` row with storage = 'chunked': value_encrypted is NULL,
+# encrypted_key holds the wrapped data key and blob_id points at its rows in secret_chunks.
+# The value is optionally zlib-compressed, then cut into FILE_CHUNK_SIZE pieces that are
+# encrypted one by one (see crypto.encrypt_chunk), so neither upload nor download ever holds
+# more than a batch of chunks in memory.
+#
+# Uploads always write a new blob and then point the secret at it; a DB trigger deletes the
+# old blob's chunks once the row no longer references it. A failed upload removes its own
+# chunks, so readers never see a half-written value.
+
+COMPRESSIONS = ("zlib", "none")
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+def _admin_client():
+    return get_supabase_admin() or get_supabase()
+
+
+def max_batches() -> int:
+    """Upper bound on chunk batches per file, used for the routes' round-trip budgets."""
+    per_batch = settings.FILE_CHUNK_SIZE * settings.FILE_CHUNK_BATCH
+    # zlib can grow incompressible data slightly; one spare batch covers it
+    return -(-settings.FILE_MAX_BYTES // per_batch) + 1
+
+
+class ChunkWriter:
+    """Compresses, chunks, encrypts and stores a value incrementally. Not thread-safe."""
+
+    def __init__(self, compression: str = "zlib", client=None):
+        self.client = client or _admin_client()
+        self.blob_id = str(uuid.uuid4())
+        self.compression = compression
+        self.size = 0
+        self._data_key = generate_data_key()
+        self._compressor = zlib.compressobj(6) if compression == "zlib" else None
+        self._buffer = bytearray()
+        self._rows = []
+        self._index = 0
+        self._fingerprint = new_fingerprint() if settings.VALUE_FINGERPRINTS else None
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > settings.FILE_MAX_BYTES:
+            raise FileTooLarge(f"File secrets are limited to {settings.FILE_MAX_BYTES} bytes")
+        if self._fingerprint:
+            self._fingerprint.update(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        self._seal_full_chunks()
+
+    def close(self) -> dict:
+        """Seals the final chunk and returns the columns to store on the secret row."""
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+            self._seal_full_chunks()
+        self._seal(bytes(self._buffer), last=True)
+        self._buffer = bytearray()
+        self._flush()
+        columns = {
+            "value_encrypted": None,
+            "encrypted_key": wrap_data_key(self._data_key),
+            "storage": "chunked",
+            "blob_id": self.blob_id,
+            "size_bytes": self.size,
+            "chunk_count": self._index,
+            "compression": self.compression,
+        }
+        if self._fingerprint:
+            columns["value_fingerprint"] = format_fingerprint(self._fingerprint)
+        return columns
+
+    def abort(self):
+        delete_blob(self.blob_id, client=self.client)
+
+    def _seal_full_chunks(self):
+        # Keep at least one byte back: the final chunk must be sealed with last=True
+        while len(self._buffer) > settings.FILE_CHUNK_SIZE:
+            self._seal(bytes(self._buffer[:settings.FILE_CHUNK_SIZE]), last=False)
+            del self._buffer[:settings.FILE_CHUNK_SIZE]
+
+    def _seal(self, data: bytes, last: bool):
+        self._rows.append({
+            "blob_id": self.blob_id,
+            "idx": self._index,
+            "data": encrypt_chunk(self._data_key, self.blob_id, self._index, last, data),
+        })
+        self._index += 1
+        if len(self._rows) >= settings.FILE_CHUNK_BATCH:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self.client.table("secret_chunks").insert(self._rows).execute()
+            self._rows = []
+
+
+async def write_stream(writer: ChunkWriter, stream: AsyncIterator[bytes]) -> dict:
+    """
+    Feeds a request body into the writer. Encryption and inserts run in the threadpool one
+    chunk's worth at a time so the event loop is never blocked by a large upload.
+    """
+    pending = bytearray()
+    try:
+        async for piece in stream:
+            pending += piece
+            if len(pending) >= settings.FILE_CHUNK_SIZE:
+                data, pending = bytes(pending), bytearray()
+                await run_in_threadpool(writer.write, data)
+        if pending:
+            await run_in_threadpool(writer.write, bytes(pending))
+        return await run_in_threadpool(writer.close)
+    except BaseException:
+        await run_in_threadpool(writer.abort)
+        raise
+
+
+def iter_plaintext(secret: dict, client=None) -> Iterator[bytes]:
+    """
+    Yields the decrypted (and decompressed) value of a chunked secret, fetching chunks in
+    batches. Meant for StreamingResponse, which iterates sync generators in the threadpool.
+    A missing or tampered chunk raises mid-stream; the response is then cut short of its
+    Content-Length, which clients treat as a failed download.
+    """
+    client = client or _admin_client()
+    blob_id = secret["blob_id"]
+    count = secret["chunk_count"]
+    data_key = unwrap_data_key(secret["encrypted_key"])
+    decompressor = zlib.decompressobj() if secret.get("compression") == "zlib" else None
+
+    for start in range(0, count, settings.FILE_CHUNK_BATCH):
+        rows = client.table("secret_chunks").select("idx, data")\
+            .eq("blob_id", blob_id)\
+            .gte("idx", start)\
+            .lt("idx", start + settings.FILE_CHUNK_BATCH)\
+            .order("idx")\
+            .execute().data
+        expected = min(settings.FILE_CHUNK_BATCH, count - start)
+        if len(rows) != expected:
+            raise ValueError(f"Blob {blob_id} is missing chunks {start}..{start + expected - 1}")
+        for offset, row in enumerate(rows):
+            index = start + offset
+            if row["idx"] != index:
+                raise ValueError(f"Blob {blob_id} is missing chunk {index}")
+            data = decrypt_chunk(data_key, blob_id, index, index == count - 1, row["data"])
+            if decompressor:
+                data = decompressor.decompress(data)
+            if data:
+                yield data
+
+    if decompressor:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def delete_blob(blob_id: str, client=None):
+    try:
+        (client or _admin_client()).table("secret_chunks").delete().eq("blob_id", blob_id).execute()
+    except Exception as e:
+        print(f"Failed to delete chunks of blob {blob_id}: {e}")
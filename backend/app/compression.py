@@ -0,0 +1,96 @@
+import gzip
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - Brotli is in requirements.txt; gzip still works without it
+    brotli = None
+
+# Negotiated response compression (br > gzip) for bodies above a size threshold.
+# Pure ASGI so small responses pay only a header check. Streaming responses (more_body)
+# are passed through untouched so their memory use stays bounded.
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def _accepted_encoding(headers) -> str:
+    for name, value in headers:
+        if name == b"accept-encoding":
+            accepted = {part.split(";")[0].strip() for part in value.decode("latin-1").lower().split(",")}
+            if brotli is not None and "br" in accepted:
+                return "br"
+            if "gzip" in accepted:
+                return "gzip"
+            return ""
+    return ""
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = settings.COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = _accepted_encoding(scope["headers"])
+        if not encoding:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = start_message.get("headers", [])
+            content_type = b""
+            already_encoded = False
+            for name, value in headers:
+                if name == b"content-type":
+                    content_type = value
+                elif name == b"content-encoding":
+                    already_encoded = True
+
+            if (
+                message.get("more_body", False)
+                or already_encoded
+                or len(body) < self.minimum_size
+                or not content_type.decode("latin-1").startswith(_COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers = [(n, v) for n, v in headers if n != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            start_message["headers"] = headers
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,93 @@
+import functools
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+from .config import settings
+from .responses import FastJSONResponse
+from .utils import make_etag, etag_matches
+from .metrics import conditional_requests_total
+
+# Conditional GETs for dashboard lists (CONDITIONAL_GETS, migration 010).
+#
+# The dashboard refetches vault, secret, member, token and audit lists on every navigation
+# and nearly always gets the same payload back. Routes marked @conditional("<kind>", "<param>")
+# first read the resource's counter from resource_versions (kept current by triggers on
+# every write, see the migration) with the caller's own client, so RLS also checks access.
+# The ETag covers that version, the caller and the query string; a request whose
+# If-None-Match (or, without one, If-Modified-Since) still matches gets 304 without the
+# list query, the enrichment or serialization. Otherwise the route runs and its response
+# carries ETag and Last-Modified.
+#
+# The counter is read before the list, so a write landing in between makes the ETag older
+# than the body, never newer. Data that is not in the tables (token usage this worker
+# hasn't flushed, member emails from the auth service) doesn't move the version.
+
+
+def _lookup(client, kind: str, resource_id) -> Optional[Tuple[int, str]]:
+    rows = client.table("resource_versions").select("version, updated_at") \
+        .eq("kind", kind).eq("resource_id", resource_id).limit(1).execute().data
+    return (rows[0]["version"], rows[0]["updated_at"]) if rows else None
+
+
+def _http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _not_modified_since(request, last_modified: Optional[datetime]) -> bool:
+    header = request.headers.get("if-modified-since")
+    if not header or last_modified is None or request.headers.get("if-none-match"):
+        return False
+    try:
+        # HTTP dates have whole seconds, so a write later in the second a response was
+        # stamped with looks unmodified; only a change strictly before that second counts
+        return last_modified < parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional(kind: str, param: str):
+    """Answers If-None-Match / If-Modified-Since for a sync list route (see above). Mark it innermost."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request, client = kwargs.get("request"), kwargs.get("client")
+            if not settings.CONDITIONAL_GETS or request is None or not client or not kwargs.get(param):
+                return func(*args, **kwargs)
+            try:
+                validator = _lookup(client, kind, kwargs[param])
+            except Exception as e:
+                # The route reports bad ids and upstream failures itself
+                print(f"Warning: version lookup for {kind} failed: {e}")
+                validator = None
+            if validator is None:
+                conditional_requests_total.inc(kind, "unversioned")
+                return func(*args, **kwargs)
+
+            version, updated_at = validator
+            user = kwargs.get("user")
+            etag = make_etag(kind, request.url.path, request.url.query, getattr(user, "id", None), version)
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            last_modified = _http_date(updated_at)
+            if last_modified is not None:
+                headers["Last-Modified"] = format_datetime(last_modified.replace(microsecond=0), usegmt=True)
+            if etag_matches(request, etag) or _not_modified_since(request, last_modified):
+                conditional_requests_total.inc(kind, "not_modified")
+                return Response(status_code=304, headers=headers)
+
+            conditional_requests_total.inc(kind, "modified")
+            result = func(*args, **kwargs)
+            if not isinstance(result, Response):
+                result = FastJSONResponse(jsonable_encoder(result))
+            result.headers.update(headers)
+            return result
+        return wrapper
+    return decorator
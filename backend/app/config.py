@@ -1,12 +1,146 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+def _load_env_file():
+    # Read backend/.env only if it exists. Deployed instances get their variables from the
+    # platform, so they skip python-dotenv (and its directory walk) entirely.
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env")
+    if os.path.exists(path):
+        from dotenv import load_dotenv
+        load_dotenv(path)
+
+_load_env_file()
 
 class Settings:
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
     SUPABASE_SERVICE_ROLE_KEY: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
     MASTER_ENCRYPTION_KEY: str = os.getenv("MASTER_ENCRYPTION_KEY", "")
+    # Comma separated retired master keys, still accepted when opening v2 envelopes
+    PREVIOUS_MASTER_ENCRYPTION_KEYS: str = os.getenv("PREVIOUS_MASTER_ENCRYPTION_KEYS", "")
+    # Envelope format for new writes: 1 = legacy two-column, 2 = compact single field
+    # (v2 needs migrations/002_envelope_v2.sql). Both formats are always readable.
+    ENVELOPE_VERSION: int = int(os.getenv("ENVELOPE_VERSION", "1"))
+    DEBUG: bool = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+
+    # Create clients, load the master key and open an upstream connection at startup
+    # instead of on the first request.
+    WARMUP_ON_STARTUP: bool = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+    # Serve service fetches from precomputed vault bundles (needs migrations/001_vault_bundles.sql)
+    VAULT_BUNDLES: bool = os.getenv("VAULT_BUNDLES", "false").lower() in ("1", "true", "yes")
+    VAULT_BUNDLE_REBUILD_DELAY: float = float(os.getenv("VAULT_BUNDLE_REBUILD_DELAY", "2"))
+
+    # Supabase call resilience (see resilience.py). Timeouts in seconds; reads are GET/HEAD
+    UPSTREAM_TIMEOUT: float = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+    UPSTREAM_WRITE_TIMEOUT: float = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", "30"))
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3"))
+    UPSTREAM_RETRIES: int = int(os.getenv("UPSTREAM_RETRIES", "2"))
+    UPSTREAM_RETRY_BASE_DELAY: float = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.05"))
+    UPSTREAM_RETRY_MAX_DELAY: float = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "1"))
+    # Send a second copy of a read that hasn't answered after this many seconds (0 = off)
+    UPSTREAM_HEDGE_AFTER: float = float(os.getenv("UPSTREAM_HEDGE_AFTER", "0"))
+    UPSTREAM_HEDGE_MAX_IN_FLIGHT: int = int(os.getenv("UPSTREAM_HEDGE_MAX_IN_FLIGHT", "8"))
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RESET_TIMEOUT: float = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+    # Coalesce identical concurrent service fetches into one upstream read (see singleflight.py)
+    SINGLE_FLIGHT: bool = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+    # Longest a waiter blocks on the leader (seconds) before doing the work itself
+    SINGLE_FLIGHT_WAIT: float = float(os.getenv("SINGLE_FLIGHT_WAIT", "15"))
+    # Service-token audit events are buffered and bulk inserted at this interval (seconds);
+    # 0 writes each event inline
+    AUDIT_BATCH_INTERVAL: float = float(os.getenv("AUDIT_BATCH_INTERVAL", "1"))
+    AUDIT_BATCH_MAX: int = int(os.getenv("AUDIT_BATCH_MAX", "500"))
+
+    # Comma separated read-replica API URLs (see replicas.py; needs migrations/008_replica_lag.sql)
+    SUPABASE_READ_REPLICA_URLS: str = os.getenv("SUPABASE_READ_REPLICA_URLS", "")
+    # Reads go to the primary for this long after the caller's own write
+    REPLICA_STICKY_SECONDS: float = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+    REPLICA_MAX_LAG: float = float(os.getenv("REPLICA_MAX_LAG", "2"))
+    REPLICA_HEALTH_INTERVAL: float = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+
+    # Cross-worker cache invalidation (see invalidation.py): off | postgres | local
+    INVALIDATION_BUS: str = os.getenv("INVALIDATION_BUS", "off").lower()
+    # Direct Postgres connection string for INVALIDATION_BUS=postgres (session mode, not the transaction pooler)
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    INVALIDATION_SOCKET_DIR: str = os.getenv("INVALIDATION_SOCKET_DIR", "/tmp/envrypt-invalidation")
+    INVALIDATION_HEARTBEAT: float = float(os.getenv("INVALIDATION_HEARTBEAT", "1"))
+    INVALIDATION_MAX_LAG: float = float(os.getenv("INVALIDATION_MAX_LAG", "5"))
+    # Seconds a validated service token is cached in-process (0 = off); revocations go over the bus
+    TOKEN_CACHE_TTL: float = float(os.getenv("TOKEN_CACHE_TTL", "0"))
+
+    # Track service-token usage in memory and write it every TOKEN_USAGE_FLUSH_INTERVAL
+    # seconds (see token_usage.py; needs migrations/007_service_token_usage.sql)
+    TOKEN_USAGE: bool = os.getenv("TOKEN_USAGE", "false").lower() in ("1", "true", "yes")
+    TOKEN_USAGE_FLUSH_INTERVAL: float = float(os.getenv("TOKEN_USAGE_FLUSH_INTERVAL", "60"))
+
+    # GET /api/vaults lists only the vaults the caller can open, with counts, in one RPC
+    # (needs migrations/009_vault_listing.sql)
+    VAULT_ACCESS_LISTING: bool = os.getenv("VAULT_ACCESS_LISTING", "false").lower() in ("1", "true", "yes")
+
+    # Store HMAC fingerprints of values for zero-decrypt vault diffs (needs migrations/004_value_fingerprints.sql)
+    VALUE_FINGERPRINTS: bool = os.getenv("VALUE_FINGERPRINTS", "false").lower() in ("1", "true", "yes")
+
+    # Streamed, chunk-encrypted file secrets (needs migrations/003_file_secrets.sql)
+    FILE_SECRETS: bool = os.getenv("FILE_SECRETS", "false").lower() in ("1", "true", "yes")
+    FILE_CHUNK_SIZE: int = int(os.getenv("FILE_CHUNK_SIZE", str(64 * 1024)))
+    FILE_CHUNK_BATCH: int = int(os.getenv("FILE_CHUNK_BATCH", "16"))
+    FILE_MAX_BYTES: int = int(os.getenv("FILE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Waitlist signups (see waitlist_intake.py). WAITLIST_UPSERT and the queue need
+    # migrations/006_waitlist_unique_email.sql
+    WAITLIST_UPSERT: bool = os.getenv("WAITLIST_UPSERT", "false").lower() in ("1", "true", "yes")
+    # Load known waitlist emails at startup so repeat signups are answered without a DB call
+    WAITLIST_PRELOAD: bool = os.getenv("WAITLIST_PRELOAD", "true").lower() in ("1", "true", "yes")
+    WAITLIST_KNOWN_MAX: int = int(os.getenv("WAITLIST_KNOWN_MAX", "1000000"))
+    # > 0 accepts signups into a bounded queue that is bulk upserted in the background
+    WAITLIST_QUEUE_SIZE: int = int(os.getenv("WAITLIST_QUEUE_SIZE", "0"))
+    WAITLIST_BATCH_INTERVAL: float = float(os.getenv("WAITLIST_BATCH_INTERVAL", "0.5"))
+    WAITLIST_BATCH_MAX: int = int(os.getenv("WAITLIST_BATCH_MAX", "500"))
+
+    # Responses at least this large are gzip/brotli compressed when the client accepts it
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+    GZIP_LEVEL: int = int(os.getenv("GZIP_LEVEL", "6"))
+    BROTLI_QUALITY: int = int(os.getenv("BROTLI_QUALITY", "4"))
+
+    # Enables the operator routes under /api/admin (profiling); sent as a Bearer token
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "/tmp/envrypt-profiles")
+    PROFILE_SAMPLE_INTERVAL: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+    PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    PROFILE_TRACEMALLOC_FRAMES: int = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+    PROFILE_MAX_SNAPSHOTS: int = int(os.getenv("PROFILE_MAX_SNAPSHOTS", "4"))
+
+    # Route class thread pools (see executors.py): workers, and requests allowed to wait
+    # for one before the class answers 503. "light" is Starlette's shared pool.
+    EXECUTOR_CRYPTO_WORKERS: int = int(os.getenv("EXECUTOR_CRYPTO_WORKERS", "8"))
+    EXECUTOR_CRYPTO_QUEUE: int = int(os.getenv("EXECUTOR_CRYPTO_QUEUE", "64"))
+    EXECUTOR_ADMIN_WORKERS: int = int(os.getenv("EXECUTOR_ADMIN_WORKERS", "2"))
+    EXECUTOR_ADMIN_QUEUE: int = int(os.getenv("EXECUTOR_ADMIN_QUEUE", "4"))
+    EXECUTOR_LIGHT_WORKERS: int = int(os.getenv("EXECUTOR_LIGHT_WORKERS", "40"))
+
+    # Per-team fair scheduling of expensive routes (see fairness.py). Weights are
+    # "<team_id>=<weight>,..."; teams not listed weigh 1.
+    FAIR_SCHEDULING: bool = os.getenv("FAIR_SCHEDULING", "false").lower() in ("1", "true", "yes")
+    FAIR_CONCURRENCY: int = int(os.getenv("FAIR_CONCURRENCY", os.getenv("EXECUTOR_CRYPTO_WORKERS", "8")))
+    FAIR_TEAM_MAX_CONCURRENCY: int = int(os.getenv("FAIR_TEAM_MAX_CONCURRENCY", "4"))
+    FAIR_TEAM_QUEUE: int = int(os.getenv("FAIR_TEAM_QUEUE", "32"))
+    FAIR_TEAM_WEIGHTS: str = os.getenv("FAIR_TEAM_WEIGHTS", "")
+
+    # Conditional GETs (304) for dashboard lists; needs migrations/010_resource_versions.sql
+    CONDITIONAL_GETS: bool = os.getenv("CONDITIONAL_GETS", "false").lower() in ("1", "true", "yes")
+
+    # Idempotency-Key replay for create routes (see idempotency.py); TTL 0 disables it
+    IDEMPOTENCY_TTL: float = float(os.getenv("IDEMPOTENCY_TTL", "900"))
+    IDEMPOTENCY_MAX_ENTRIES: int = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    IDEMPOTENCY_MAX_BODY: int = int(os.getenv("IDEMPOTENCY_MAX_BODY", "16384"))
+    IDEMPOTENCY_WAIT: float = float(os.getenv("IDEMPOTENCY_WAIT", "5"))
+    # Claims shared by all workers in a table; needs migrations/011_idempotency_keys.sql
+    IDEMPOTENCY_SHARED: bool = os.getenv("IDEMPOTENCY_SHARED", "false").lower() in ("1", "true", "yes")
+    IDEMPOTENCY_LEASE: float = float(os.getenv("IDEMPOTENCY_LEASE", "60"))
+
+    # Round-trip budget checks: off | log | raise (see roundtrips.py)
+    ROUNDTRIP_MODE: str = os.getenv("ROUNDTRIP_MODE", "off").lower()
+    ROUNDTRIP_BUDGET: int = int(os.getenv("ROUNDTRIP_BUDGET", "10"))
 
 settings = Settings()
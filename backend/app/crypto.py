@@ -1,16 +1,28 @@
 import os
 import base64
 import hashlib
+import hmac
+import struct
+from functools import lru_cache
+from typing import Dict, Optional
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap, InvalidUnwrap
 from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from fastapi import HTTPException
 from .config import settings
+from .metrics import crypto_duration, timed
 
 def get_master_key() -> bytes:
     key_str = settings.MASTER_ENCRYPTION_KEY
     if not key_str:
         raise ValueError("MASTER_ENCRYPTION_KEY is not set")
-    
+    return _parse_master_key(key_str)
+
+@lru_cache(maxsize=4)
+def _parse_master_key(key_str: str) -> bytes:
+    # Parsed once per key value instead of on every encrypt/decrypt
     # Strict key handling: Expect valid Base64 encoded 32-byte key (AES-256)
     try:
         if len(key_str) == 32:
@@ -28,10 +40,88 @@ def get_master_key() -> bytes:
         print(f"Warning: MASTER_ENCRYPTION_KEY is not a valid 32-byte base64 string. Falling back to SHA-256 hash. Error: {e}")
         return hashlib.sha256(key_str.encode()).digest()
 
+def key_id(key: bytes) -> bytes:
+    """4-byte fingerprint identifying a master key inside v2 envelopes."""
+    return hashlib.sha256(b"envrypt-key-id:" + key).digest()[:4]
+
+@lru_cache(maxsize=4)
+def _keyring(current: str, previous: str) -> Dict[bytes, bytes]:
+    keys = [current] + [k.strip() for k in previous.split(",") if k.strip()]
+    return {key_id(k): k for k in (_parse_master_key(s) for s in keys)}
+
+def get_keyring() -> Dict[bytes, bytes]:
+    """Current master key plus PREVIOUS_MASTER_ENCRYPTION_KEYS, by key ID (for rotation)."""
+    get_master_key()
+    return _keyring(settings.MASTER_ENCRYPTION_KEY, settings.PREVIOUS_MASTER_ENCRYPTION_KEYS)
+
 def generate_data_key() -> bytes:
     """Generates a fresh 32-byte AES key."""
     return AESGCM.generate_key(bit_length=256)
 
+
+# --- Envelope format v2 -----------------------------------------------------------------
+# Legacy (v1) rows store two base64 columns:
+#   value_encrypted = b64(nonce(12) + AES-GCM(data_key, plaintext))
+#   encrypted_key   = b64(nonce(12) + AES-GCM(master_key, data_key))      -> 80 chars
+# v2 stores a single binary envelope in value_encrypted (encrypted_key is NULL):
+#   version(1) | alg(1) | key_id(4) | wrapped_key(40, RFC 3394 AES-KW) | nonce(12) | ciphertext+tag
+# The header lets us rotate master keys (key_id) and change algorithms later. AES-KW is
+# deterministic and authenticated, so the wrapped key needs no nonce or GCM tag.
+# The blob is base64'd once for the text column: PostgREST sends bytea as hex in JSON,
+# which would double the wire size instead of saving a third.
+
+ENVELOPE_V2 = 2
+ALG_AES256GCM_AESKW = 1
+_V2_HEADER = struct.Struct(">BB4s")
+_V2_PREFIX_LEN = _V2_HEADER.size + 40 + 12
+
+def _seal_v2(plaintext: bytes) -> bytes:
+    master_key = get_master_key()
+    data_key = generate_data_key()
+    nonce = os.urandom(12)
+    ciphertext = AESGCM(data_key).encrypt(nonce, plaintext, None)
+    header = _V2_HEADER.pack(ENVELOPE_V2, ALG_AES256GCM_AESKW, key_id(master_key))
+    return header + aes_key_wrap(master_key, data_key) + nonce + ciphertext
+
+def _open_v2(blob: bytes) -> bytes:
+    if len(blob) < _V2_PREFIX_LEN + 16:
+        raise ValueError("Truncated envelope")
+    version, alg, kid = _V2_HEADER.unpack_from(blob)
+    if version != ENVELOPE_V2 or alg != ALG_AES256GCM_AESKW:
+        raise ValueError(f"Unsupported envelope version/algorithm: {version}/{alg}")
+    master_key = get_keyring().get(kid)
+    if master_key is None:
+        raise ValueError(f"Unknown master key id {kid.hex()}")
+    offset = _V2_HEADER.size
+    data_key = aes_key_unwrap(master_key, blob[offset:offset + 40])
+    nonce = blob[offset + 40:offset + 52]
+    return AESGCM(data_key).decrypt(nonce, blob[offset + 52:], None)
+
+def _open_v1(encrypted_value: str, encrypted_key: str) -> bytes:
+    raw_enc_key = base64.b64decode(encrypted_key)
+    data_key = AESGCM(get_master_key()).decrypt(raw_enc_key[:12], raw_enc_key[12:], None)
+    raw_enc_val = base64.b64decode(encrypted_value)
+    return AESGCM(data_key).decrypt(raw_enc_val[:12], raw_enc_val[12:], None)
+
+def envelope_version(encrypted_value: Optional[str], encrypted_key: Optional[str]) -> Optional[int]:
+    if not encrypted_value:
+        return None
+    return 1 if encrypted_key else ENVELOPE_V2
+
+def rewrap_v1_to_v2(encrypted_value: str, encrypted_key: str) -> str:
+    """
+    Converts a legacy row to v2 without decrypting the secret itself: only the data key is
+    unwrapped and re-wrapped; nonce and ciphertext are carried over unchanged.
+    """
+    master_key = get_master_key()
+    raw_enc_key = base64.b64decode(encrypted_key)
+    data_key = AESGCM(master_key).decrypt(raw_enc_key[:12], raw_enc_key[12:], None)
+    raw_enc_val = base64.b64decode(encrypted_value)
+    header = _V2_HEADER.pack(ENVELOPE_V2, ALG_AES256GCM_AESKW, key_id(master_key))
+    blob = header + aes_key_wrap(master_key, data_key) + raw_enc_val
+    return base64.b64encode(blob).decode('ascii')
+
+@timed(crypto_duration, "encrypt")
 def encrypt_value(plaintext: str) -> dict:
     """
     Envelope Encryption:
@@ -39,10 +129,15 @@ def encrypt_value(plaintext: str) -> dict:
     2. Encrypt the plaintext with the Data Key.
     3. Encrypt the Data Key with the Master Key.
     Returns: {"value": str (b64), "key": str (b64)}
+    With ENVELOPE_VERSION=2 the whole envelope is in "value" and "key" is None.
     """
     if not plaintext:
         return {"value": None, "key": None}
 
+    if settings.ENVELOPE_VERSION == ENVELOPE_V2:
+        blob = _seal_v2(plaintext.encode('utf-8'))
+        return {"value": base64.b64encode(blob).decode('ascii'), "key": None}
+
     MASTER_KEY = get_master_key()
 
     # 1. Generate unique Data Key for this secret
@@ -69,41 +164,86 @@ def encrypt_value(plaintext: str) -> dict:
         "key": encrypted_key       # The locked key (goes to encrypted_key)
     }
 
+@timed(crypto_duration, "decrypt")
 def decrypt_value(encrypted_value: str, encrypted_key: str) -> str:
     """
-    Envelope Decryption:
+    Envelope Decryption (accepts legacy two-column rows and v2 envelopes):
     1. Decrypt the Data Key using the Master Key.
     2. Decrypt the secret using the decrypted Data Key.
     """
-    if not encrypted_value or not encrypted_key:
+    if not encrypted_value:
         return None
 
-    MASTER_KEY = get_master_key()
-
     try:
-        # 1. Decrypt the Data Key
-        raw_enc_key = base64.b64decode(encrypted_key)
-        nonce_master = raw_enc_key[:12]
-        ciphertext_key_body = raw_enc_key[12:]
-        
-        aesgcm_master = AESGCM(MASTER_KEY)
-        data_key = aesgcm_master.decrypt(nonce_master, ciphertext_key_body, None)
-
-        # 2. Decrypt the actual secret using the decrypted Data Key
-        raw_enc_val = base64.b64decode(encrypted_value)
-        nonce_data = raw_enc_val[:12]
-        ciphertext_data_body = raw_enc_val[12:]
-
-        aesgcm_data = AESGCM(data_key)
-        plaintext = aesgcm_data.decrypt(nonce_data, ciphertext_data_body, None)
-        
+        if encrypted_key:
+            plaintext = _open_v1(encrypted_value, encrypted_key)
+        else:
+            plaintext = _open_v2(base64.b64decode(encrypted_value))
         return plaintext.decode('utf-8')
-    except (InvalidTag, ValueError):
+    except (InvalidTag, InvalidUnwrap, ValueError):
         raise HTTPException(status_code=500, detail="Decryption failed. Integrity check failed.")
     except Exception as e:
         print(f"Decryption error: {e}")
         raise HTTPException(status_code=500, detail="Internal decryption error")
 
+# --- Chunked values (file secrets, see chunks.py) --------------------------------------
+# Large values are split into chunks sealed separately with one data key, so they can be
+# encrypted and decrypted as a stream. The AAD binds each chunk to its blob, position and
+# "final" flag: chunks cannot be reordered, moved between values or truncated unnoticed.
+
+def wrap_data_key(data_key: bytes) -> str:
+    """v2-style wrapped key (header + AES-KW) so rotated master keys stay usable."""
+    master_key = get_master_key()
+    header = _V2_HEADER.pack(ENVELOPE_V2, ALG_AES256GCM_AESKW, key_id(master_key))
+    return base64.b64encode(header + aes_key_wrap(master_key, data_key)).decode('ascii')
+
+def unwrap_data_key(wrapped: str) -> bytes:
+    blob = base64.b64decode(wrapped)
+    version, alg, kid = _V2_HEADER.unpack_from(blob)
+    if version != ENVELOPE_V2 or alg != ALG_AES256GCM_AESKW:
+        raise ValueError(f"Unsupported key wrap version/algorithm: {version}/{alg}")
+    master_key = get_keyring().get(kid)
+    if master_key is None:
+        raise ValueError(f"Unknown master key id {kid.hex()}")
+    return aes_key_unwrap(master_key, blob[_V2_HEADER.size:])
+
+def _chunk_aad(blob_id: str, index: int, last: bool) -> bytes:
+    return blob_id.encode('ascii') + struct.pack(">I?", index, last)
+
+def encrypt_chunk(data_key: bytes, blob_id: str, index: int, last: bool, data: bytes) -> str:
+    nonce = os.urandom(12)
+    ciphertext = AESGCM(data_key).encrypt(nonce, data, _chunk_aad(blob_id, index, last))
+    return base64.b64encode(nonce + ciphertext).decode('ascii')
+
+def decrypt_chunk(data_key: bytes, blob_id: str, index: int, last: bool, sealed: str) -> bytes:
+    raw = base64.b64decode(sealed)
+    try:
+        return AESGCM(data_key).decrypt(raw[:12], raw[12:], _chunk_aad(blob_id, index, last))
+    except InvalidTag:
+        raise ValueError(f"Chunk {index} of blob {blob_id} failed integrity check")
+
+# --- Value fingerprints ------------------------------------------------------------------
+# Keyed HMAC of a secret's plaintext, stored next to it so vaults can be compared without
+# decrypting anything. The key is derived from the master key (never stored), so the
+# fingerprints are useless for guessing values without it. The master key's ID is part of
+# the fingerprint: values fingerprinted under different master keys are never compared.
+
+@lru_cache(maxsize=4)
+def _fingerprint_key(master_key: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"envrypt value fingerprint v1").derive(master_key)
+
+def new_fingerprint():
+    """Incremental fingerprint (hmac object); finish with format_fingerprint()."""
+    return hmac.new(_fingerprint_key(get_master_key()), digestmod=hashlib.sha256)
+
+def format_fingerprint(h) -> str:
+    return f"{key_id(get_master_key()).hex()}:{h.hexdigest()}"
+
+def fingerprint_value(plaintext: str) -> str:
+    h = new_fingerprint()
+    h.update((plaintext or "").encode('utf-8'))
+    return format_fingerprint(h)
+
 def hash_token(token: str) -> str:
     """SHA-256 hash for service tokens"""
     return hashlib.sha256(token.encode('utf-8')).hexdigest()
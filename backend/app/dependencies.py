@@ -1,27 +1,88 @@
-from fastapi import Header, HTTPException, Depends
-from supabase import create_client, Client
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+from fastapi import Header, HTTPException, Depends, Request
+from starlette.concurrency import run_in_threadpool
 from .config import settings
 from .crypto import hash_token
+from .resilience import api_error, is_upstream_error
+from .token_usage import token_usage
+from .invalidation import LocalCache
+from .replicas import router as replica_router, sticky_key
 
-# Initialize Supabase Client
-# We use the anon public key for basic operations, but for backend admin tasks we might need SERVICE_ROLE_KEY if we want to bypass RLS.
+if TYPE_CHECKING:
+    import httpx
+    from supabase import Client
+
+# Supabase clients are created lazily (on first use, or eagerly by the lifespan warm-up in main.py)
+# so importing the app stays cheap: the supabase package alone is a large share of cold-start time.
+# We use the anon public key for basic operations, and the SERVICE_ROLE_KEY client to bypass RLS for backend admin tasks.
 # However, for `verify_user`, standard key is fine as we pass the JWT.
-if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
-    print("Warning: Supabase credentials not set in environment.")
-
-try:
-    supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-except:
-    supabase = None
-
-# Admin client with Service Role Key (Bypasses RLS)
-try:
-    if settings.SUPABASE_SERVICE_ROLE_KEY:
-        supabase_admin: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
-    else:
-        supabase_admin = None
-except:
-    supabase_admin = None
+
+# Reentrant: _get_client holds it while _create_client builds the shared pool on first use
+_lock = threading.RLock()
+_http_client: Optional["httpx.Client"] = None
+_clients: Dict[str, Optional["Client"]] = {}
+# Last initialization error per client, reported by /ready instead of being swallowed
+init_errors: Dict[str, str] = {}
+
+def get_http_client() -> "httpx.Client":
+    """Shared, instrumented connection pool for every Supabase client (see upstream.py)"""
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                from .upstream import build_http_client
+                _http_client = build_http_client()
+    return _http_client
+
+def create_client_for(url: str, key: str) -> "Client":
+    from supabase import create_client, ClientOptions
+    return create_client(url, key, options=ClientOptions(httpx_client=get_http_client()))
+
+def _create_client(key: str) -> "Client":
+    return create_client_for(settings.SUPABASE_URL, key)
+
+def _get_client(name: str, key: str) -> Optional["Client"]:
+    if name in _clients:
+        return _clients[name]
+    with _lock:
+        if name not in _clients:
+            client = None
+            if not settings.SUPABASE_URL or not key:
+                init_errors[name] = "credentials not set"
+            else:
+                try:
+                    client = _create_client(key)
+                    init_errors.pop(name, None)
+                except Exception as e:
+                    print(f"Warning: Failed to initialize Supabase client '{name}': {e}")
+                    init_errors[name] = str(e)
+            _clients[name] = client
+    return _clients[name]
+
+def get_supabase() -> Optional["Client"]:
+    """Anon-key client (or None if Supabase is not configured)."""
+    return _get_client("supabase", settings.SUPABASE_KEY)
+
+def get_supabase_admin() -> Optional["Client"]:
+    """Admin client with Service Role Key (Bypasses RLS), or None if not configured."""
+    return _get_client("supabase_admin", settings.SUPABASE_SERVICE_ROLE_KEY)
+
+def init_clients():
+    """Eagerly create the clients and connection pool (used by the lifespan warm-up)."""
+    if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
+        print("Warning: Supabase credentials not set in environment.")
+    get_http_client()
+    get_supabase()
+    get_supabase_admin()
+
+def close_clients():
+    global _http_client
+    with _lock:
+        _clients.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
 
 class MockUser:
     def __init__(self, id, email):
@@ -37,17 +98,22 @@ async def get_current_user(authorization: str = Header(None)):
         
     token = authorization.split(" ")[1]
     
+    supabase = get_supabase()
     if not supabase:
         # Mock for dev if no creds
         return MockUser(id="mock_user_id", email="mock@example.com")
 
     try:
-        # Supabase client 'get_user' verifies the JWT
-        response = supabase.auth.get_user(token)
+        # Supabase client 'get_user' verifies the JWT. It is a blocking call (with retry
+        # backoff sleeps), so it runs in the threadpool rather than on the event loop.
+        response = await run_in_threadpool(supabase.auth.get_user, token)
         if not response or not response.user:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
         return response.user
     except Exception as e:
+        # An unreachable auth service is not a bad token: don't make clients log out
+        if is_upstream_error(e):
+            raise api_error(e)
         print(f"Auth Error: {e}")
         raise HTTPException(status_code=401, detail="Authentication failed")
 
@@ -58,21 +124,33 @@ async def get_service_token_header(authorization: str = Header(None)):
          raise HTTPException(status_code=401, detail="Invalid token format")
     return authorization.split(" ")[1]
 
-async def get_valid_service_token(token: str = Depends(get_service_token_header)):
+# Active tokens by hash; revoke_token publishes the hash on the invalidation bus
+token_cache = LocalCache("service_token", settings.TOKEN_CACHE_TTL)
+
+async def get_valid_service_token(request: Request, token: str = Depends(get_service_token_header)):
     """
     Validates a service token and returns the token record.
     Checks: Format, Existence, isActive status.
     """
+    supabase = get_supabase()
     if not supabase:
         raise HTTPException(status_code=503, detail="DB unavailable")
 
     hashed = hash_token(token)
-    
+    client_ip = request.client.host if request.client else None
+
+    cached = token_cache.get(hashed)
+    if cached is not None:
+        token_usage.record(cached['id'], client_ip)
+        return dict(cached)
+
     try:
         # Use admin client to bypass RLS and find the token
-        target_client = supabase_admin if supabase_admin else supabase
-        
-        response = target_client.table("service_tokens").select("*").eq("token_hash", hashed).limit(1).execute()
+        target_client = get_supabase_admin() or supabase
+
+        generation = token_cache.generation
+        query = target_client.table("service_tokens").select("*").eq("token_hash", hashed).limit(1)
+        response = await run_in_threadpool(query.execute)
         
         if not response.data:
             raise HTTPException(status_code=401, detail="Invalid Service Token")
@@ -81,16 +159,21 @@ async def get_valid_service_token(token: str = Depends(get_service_token_header)
         
         if not token_record.get('is_active'):
              raise HTTPException(status_code=401, detail="Service Token has been revoked")
-             
+
+        token_cache.set(hashed, dict(token_record), generation)
+        # In-memory only; written in bulk by token_usage's flusher
+        token_usage.record(token_record['id'], client_ip)
         return token_record
 
     except HTTPException:
         raise
     except Exception as e:
+        if is_upstream_error(e):
+            raise api_error(e)
         print(f"Token validation error: {e}")
         raise HTTPException(status_code=401, detail="Authentication failed")
 
-def get_scoped_client(authorization: str = Header(None)) -> Client:
+def get_scoped_client(authorization: str = Header(None)) -> "Client":
     """
     Creates a Supabase client scoped to the authenticated user's token.
     This ensures all queries respect RLS policies for that user.
@@ -101,8 +184,8 @@ def get_scoped_client(authorization: str = Header(None)) -> Client:
         
     token = authorization.split(" ")[1]
     
-    # Create standard client
-    client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    # Create standard client (reuses the shared connection pool)
+    client = _create_client(settings.SUPABASE_KEY)
     
     # Inject token into Postgrest headers for RLS
     # This allows Supabase to see the request as coming from the user (auth.uid())
@@ -113,3 +196,23 @@ def get_scoped_client(authorization: str = Header(None)) -> Client:
     # print(f"Scoped Client Headers before: {client.postgrest.headers}")
     
     return client
+
+def get_read_client(authorization: str = Header(None)) -> "Client":
+    """
+    Like get_scoped_client, but for read-only routes: served by a healthy read replica
+    unless the caller wrote something moments ago (see replicas.py).
+    """
+    key = sticky_key(authorization)
+    replica = replica_router.pick(key) if key else None
+    if replica is None:
+        return get_scoped_client(authorization)
+    client = create_client_for(replica.url, settings.SUPABASE_KEY)
+    client.postgrest.auth(authorization.split(" ")[1])
+    return client
+
+def read_admin_client(sticky: Optional[str] = None) -> Optional["Client"]:
+    """Admin client on a healthy read replica, or None to use the primary."""
+    replica = replica_router.pick(sticky)
+    if replica is None:
+        return None
+    return replica.client(settings.SUPABASE_SERVICE_ROLE_KEY or settings.SUPABASE_KEY)
@@ -0,0 +1,121 @@
+import math
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from fastapi import HTTPException
+from .config import settings
+from .metrics import executor_in_flight, executor_capacity, executor_queue_seconds, executor_rejections_total
+
+# Route classes with their own thread pools.
+#
+# Sync routes normally share Starlette's threadpool, so a burst of decrypt-heavy service
+# fetches can hold every thread while cheap calls queue behind them. Routes marked with
+# @route_class(name) run on that class's pool instead:
+#
+#   crypto  decrypts / encrypts whole vaults or copies them in bulk (service fetches,
+#           reveals, changesets, clone/promote) - EXECUTOR_CRYPTO_WORKERS
+#   admin   operator routes (profiling, memory snapshots) - EXECUTOR_ADMIN_WORKERS
+#   light   everything else stays on Starlette's pool, sized by EXECUTOR_LIGHT_WORKERS
+#
+# Each pool admits at most workers + queue requests (EXECUTOR_*_QUEUE); beyond that the
+# request is refused right away with 503 and a Retry-After estimated from recent run times,
+# instead of waiting in an unbounded queue. Mark the route innermost, directly above `def`.
+
+
+class Overloaded(HTTPException):
+    def __init__(self, pool: str, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail=f"Server busy ({pool} requests), please retry",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class RouteExecutor:
+    def __init__(self, name: str, workers: int, queue: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.limit = self.workers + max(0, queue)
+        # Only touched from the event loop thread
+        self.in_flight = 0
+        self.avg_run = 0.05
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        executor_capacity.set(name, value=self.limit)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"route-{self.name}")
+        return self._pool
+
+    def retry_after(self) -> int:
+        waves = (self.in_flight - self.workers + 1) / self.workers
+        return min(30, max(1, math.ceil(self.avg_run * max(1, waves))))
+
+    async def run(self, func, *args, **kwargs):
+        if self.in_flight >= self.limit:
+            executor_rejections_total.inc(self.name)
+            raise Overloaded(self.name, self.retry_after())
+        self.in_flight += 1
+        executor_in_flight.set(self.name, value=self.in_flight)
+        submitted = time.perf_counter()
+        # Same as Starlette's threadpool: the route sees the request's context (roundtrip tracker...)
+        context = contextvars.copy_context()
+
+        def call():
+            started = time.perf_counter()
+            executor_queue_seconds.observe(self.name, value=started - submitted)
+            try:
+                return context.run(func, *args, **kwargs)
+            finally:
+                self.avg_run = 0.9 * self.avg_run + 0.1 * (time.perf_counter() - started)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), call)
+        finally:
+            self.in_flight -= 1
+            executor_in_flight.set(self.name, value=self.in_flight)
+
+    def describe(self) -> str:
+        return f"{self.in_flight}/{self.limit} in flight ({self.workers} workers)"
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+executors: Dict[str, RouteExecutor] = {
+    "crypto": RouteExecutor("crypto", settings.EXECUTOR_CRYPTO_WORKERS, settings.EXECUTOR_CRYPTO_QUEUE),
+    "admin": RouteExecutor("admin", settings.EXECUTOR_ADMIN_WORKERS, settings.EXECUTOR_ADMIN_QUEUE),
+}
+
+
+def route_class(name: str):
+    """Runs a sync route on the named pool (see above)."""
+    executor = executors[name]
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await executor.run(func, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def configure_light_pool():
+    """Sizes Starlette's threadpool (the light class). Call from the event loop."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.EXECUTOR_LIGHT_WORKERS
+    executor_capacity.set("light", value=settings.EXECUTOR_LIGHT_WORKERS)
+
+
+def shutdown():
+    for executor in executors.values():
+        executor.shutdown()
@@ -0,0 +1,178 @@
+import math
+import time
+import asyncio
+import functools
+from collections import deque
+from typing import Dict, Optional
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from .config import settings
+from .metrics import fair_queue_seconds, fair_rejections_total, fair_running
+
+# Per-team fair scheduling of expensive operations (FAIR_SCHEDULING).
+#
+# Routes marked @fair_share (service fetches, reveals, changesets, clone/promote, audit
+# log reads) share FAIR_CONCURRENCY slots per worker. When they are all taken, requests
+# wait in a queue per tenant and free slots go to tenants by weighted fair queuing: each
+# queued request gets a virtual finish time of max(now, tenant's last) + 1 / weight, and
+# the earliest one runs next. A team firing hundreds of parallel CI fetches therefore only
+# delays its own requests; a team with weight 2 (FAIR_TEAM_WEIGHTS="<team_id>=2,...") gets
+# twice the share of one with weight 1 when both are busy.
+#
+# A tenant never runs more than FAIR_TEAM_MAX_CONCURRENCY requests at once, and never has
+# more than FAIR_TEAM_QUEUE waiting; beyond that it gets 429 with Retry-After.
+#
+# The tenant is the team for service token calls (the token's own team). Routes a user
+# calls are keyed by the user: the team is only known after the route's membership check,
+# and a team_id parameter taken on trust would let anyone fill another team's queue.
+#
+# Runs on the event loop only, so the state needs no locks. Mark routes above
+# @route_class, so waiting here doesn't hold an executor slot.
+
+
+class _Tenant:
+    __slots__ = ("name", "weight", "running", "waiters", "last_finish")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.running = 0
+        # [finish tag, future, enqueued at]
+        self.waiters: deque = deque()
+        self.last_finish = 0.0
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() and weight.strip():
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+class FairScheduler:
+    def __init__(self, slots: int, tenant_cap: int, tenant_queue: int, weights: Optional[Dict[str, float]] = None):
+        self.slots = max(1, slots)
+        self.tenant_cap = max(1, min(tenant_cap, self.slots))
+        self.tenant_queue = max(0, tenant_queue)
+        self.weights = weights or {}
+        self.running = 0
+        self.virtual_time = 0.0
+        self.tenants: Dict[str, _Tenant] = {}
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            tenant = self.tenants[name] = _Tenant(name, self.weights.get(name, 1.0))
+        return tenant
+
+    def _tag(self, tenant: _Tenant) -> float:
+        tenant.last_finish = max(self.virtual_time, tenant.last_finish) + 1.0 / tenant.weight
+        return tenant.last_finish
+
+    def _start(self, tenant: _Tenant):
+        tenant.running += 1
+        self.running += 1
+        fair_running.set(tenant.name, value=tenant.running)
+
+    async def acquire(self, name: str):
+        tenant = self._tenant(name)
+        # Anyone still waiting while a slot is free is held back by their own tenant cap.
+        # Uncontended requests aren't tagged: virtual time only moves while tenants queue.
+        if self.running < self.slots and tenant.running < self.tenant_cap and not tenant.waiters:
+            self._start(tenant)
+            return
+        if len(tenant.waiters) >= self.tenant_queue:
+            fair_rejections_total.inc(name)
+            retry_after = max(1, math.ceil(len(tenant.waiters) / self.tenant_cap))
+            raise HTTPException(
+                status_code=429,
+                detail="Too many concurrent requests for this team, please retry",
+                headers={"Retry-After": str(retry_after)},
+            )
+        future = asyncio.get_running_loop().create_future()
+        entry = [self._tag(tenant), future, time.perf_counter()]
+        tenant.waiters.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the client went away: hand the slot on
+                self.release(name)
+            elif entry in tenant.waiters:
+                tenant.waiters.remove(entry)
+                self._forget(tenant)
+            raise
+        fair_queue_seconds.observe(name, value=time.perf_counter() - entry[2])
+
+    def release(self, name: str):
+        tenant = self.tenants[name]
+        tenant.running -= 1
+        self.running -= 1
+        fair_running.set(name, value=tenant.running)
+        self._dispatch()
+        self._forget(tenant)
+
+    def _dispatch(self):
+        while self.running < self.slots:
+            best = None
+            for tenant in self.tenants.values():
+                if tenant.waiters and tenant.running < self.tenant_cap and (
+                        best is None or tenant.waiters[0][0] < best.waiters[0][0]):
+                    best = tenant
+            if best is None:
+                return
+            tag, future, _ = best.waiters.popleft()
+            if future.done():
+                continue
+            self.virtual_time = max(self.virtual_time, tag)
+            self._start(best)
+            future.set_result(None)
+
+    def _forget(self, tenant: _Tenant):
+        # An idle tenant's finish time is clamped to virtual time (as in WFQ, a tenant coming
+        # back starts from now, not from the credit or debt of its last burst), so there is
+        # nothing left to keep: it is dropped and the table only holds active tenants.
+        if not tenant.running and not tenant.waiters:
+            self.tenants.pop(tenant.name, None)
+            fair_running.remove(tenant.name)
+
+    def describe(self) -> str:
+        waiting = sum(len(t.waiters) for t in self.tenants.values())
+        return f"{self.running}/{self.slots} running, {waiting} waiting across {len(self.tenants)} tenants"
+
+
+scheduler = FairScheduler(
+    settings.FAIR_CONCURRENCY,
+    settings.FAIR_TEAM_MAX_CONCURRENCY,
+    settings.FAIR_TEAM_QUEUE,
+    parse_weights(settings.FAIR_TEAM_WEIGHTS),
+)
+
+
+def tenant_of(kwargs: dict) -> str:
+    token = kwargs.get("service_token")
+    if token and token.get("team_id"):
+        return str(token["team_id"])
+    # Not the team_id parameter: it isn't checked against membership yet at this point
+    user = kwargs.get("user")
+    return f"user:{user.id}" if user is not None else "anonymous"
+
+
+def fair_share(func):
+    """Queues the route per tenant when the expensive-operation slots are busy (see above)."""
+    is_async = asyncio.iscoroutinefunction(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        call = (lambda: func(*args, **kwargs)) if is_async else (lambda: run_in_threadpool(func, *args, **kwargs))
+        if not settings.FAIR_SCHEDULING:
+            return await call()
+        tenant = tenant_of(kwargs)
+        await scheduler.acquire(tenant)
+        try:
+            return await call()
+        finally:
+            scheduler.release(tenant)
+    return wrapper
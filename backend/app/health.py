@@ -0,0 +1,137 @@
+from typing import Callable, Dict, Tuple
+from .config import settings
+from .crypto import get_master_key
+from .resilience import breaker
+from .invalidation import bus
+from .dependencies import get_http_client, get_supabase, get_supabase_admin, init_clients, init_errors
+
+# Readiness checks for /ready.
+# Each check returns (ok, detail). Checks marked required decide the overall status;
+# optional ones are reported but don't take the instance out of rotation.
+
+_checks: Dict[str, Tuple[Callable[[], Tuple[bool, str]], bool]] = {}
+
+
+def readiness_check(name: str, required: bool = True):
+    def decorator(func):
+        _checks[name] = (func, required)
+        return func
+    return decorator
+
+
+@readiness_check("config")
+def _check_config():
+    missing = [k for k in ("SUPABASE_URL", "SUPABASE_KEY", "MASTER_ENCRYPTION_KEY") if not getattr(settings, k)]
+    if missing:
+        return False, f"missing: {', '.join(missing)}"
+    return True, "ok"
+
+
+@readiness_check("keyring")
+def _check_keyring():
+    try:
+        get_master_key()
+        return True, "ok"
+    except ValueError as e:
+        return False, str(e)
+
+
+@readiness_check("supabase")
+def _check_supabase():
+    if get_supabase() is None:
+        return False, init_errors.get("supabase", "not initialized")
+    return True, "ok"
+
+
+@readiness_check("supabase_admin", required=False)
+def _check_supabase_admin():
+    if get_supabase_admin() is None:
+        return False, init_errors.get("supabase_admin", "not initialized")
+    return True, "ok"
+
+
+@readiness_check("upstream", required=False)
+def _check_upstream():
+    # Reported, not required, for the same reason as the circuit below: the ping goes
+    # through the shared client and its breaker, and an upstream blip hits every instance
+    try:
+        ping_upstream(timeout=2.0)
+        return True, "ok"
+    except Exception as e:
+        return False, str(e)
+
+
+@readiness_check("circuit", required=False)
+def _check_circuit():
+    # Reported, not required: every instance shares the upstream, so failing readiness on
+    # an open circuit would pull the whole fleet out of rotation at once
+    return breaker.state != breaker.OPEN, breaker.describe()
+
+
+@readiness_check("invalidation", required=False)
+def _check_invalidation():
+    # A silent bus only disables the in-process caches, so it is reported, not required
+    return bus.healthy(), bus.describe()
+
+
+@readiness_check("replicas", required=False)
+def _check_replicas():
+    from .replicas import router
+    if not router.enabled:
+        return True, "none configured"
+    # Reads fall back to the primary, so replicas never decide readiness
+    return any(r.available() for r in router.replicas), "; ".join(
+        f"{r.host}: {r.describe()}" for r in router.replicas)
+
+
+@readiness_check("executors", required=False)
+def _check_executors():
+    from .executors import executors
+    # A full pool sheds its own route class with 503s; the rest of the API keeps working
+    return all(e.in_flight < e.limit for e in executors.values()), "; ".join(
+        f"{name}: {e.describe()}" for name, e in executors.items())
+
+
+@readiness_check("fair_scheduler", required=False)
+def _check_fair_scheduler():
+    from .fairness import scheduler
+    return scheduler.running < scheduler.slots, scheduler.describe()
+
+
+def ping_upstream(timeout: float = 5.0):
+    """Cheap request to the Supabase auth service; also opens a pooled connection."""
+    response = get_http_client().get(
+        f"{settings.SUPABASE_URL}/auth/v1/health",
+        headers={"apikey": settings.SUPABASE_KEY},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+
+
+def run_checks() -> Tuple[bool, Dict[str, dict]]:
+    ready = True
+    report = {}
+    for name, (check, required) in _checks.items():
+        ok, detail = check()
+        report[name] = {"ok": ok, "required": required, "detail": detail}
+        if required and not ok:
+            ready = False
+    return ready, report
+
+
+def warm_up():
+    """
+    Startup warm-up: create the clients and connection pool, parse the master key
+    and make a first upstream request so the first real request doesn't pay for it.
+    Failures are logged, not raised; /ready reports them.
+    """
+    init_clients()
+    try:
+        get_master_key()
+    except ValueError as e:
+        print(f"Warning: master key not loaded during warm-up: {e}")
+    if settings.SUPABASE_URL:
+        try:
+            ping_upstream()
+        except Exception as e:
+            print(f"Warning: upstream warm-up request failed: {e}")
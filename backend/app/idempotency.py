@@ -0,0 +1,285 @@
+import time
+import asyncio
+import hashlib
+import functools
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from .config import settings
+from .crypto import encrypt_value, decrypt_value
+from .responses import FastJSONResponse
+from .metrics import idempotency_requests_total
+
+# Idempotency-Key support for create routes (POST /secrets, /vaults, /tokens).
+#
+# A client that retries a create after a timeout sends the same Idempotency-Key header.
+# The first request with a (user, key) pair runs normally and its response (status, body)
+# is recorded for IDEMPOTENCY_TTL seconds; a retry gets the recorded response back, marked
+# with "Idempotent-Replayed: true", without touching the database. A duplicate that arrives
+# while the original is still running waits for it (up to IDEMPOTENCY_WAIT seconds, then
+# 409) and is answered the same way. The wait is on the event loop, not a threadpool thread.
+#
+# Successes and 4xx errors are recorded; 5xx and unexpected errors are not, so the next
+# retry runs again. Reusing a key with a different body or path is refused with 422.
+#
+# Records live in this worker's memory (at most IDEMPOTENCY_MAX_ENTRIES, bodies over
+# IDEMPOTENCY_MAX_BODY bytes are not kept). With IDEMPOTENCY_SHARED the key is also claimed
+# in the idempotency_keys table (migrations/011_idempotency_keys.sql), so a retry routed to
+# another worker is replayed from there, or gets 409 while the original still runs there;
+# the memory map stays as the fast path for repeats on the same worker. Records may hold a
+# created secret's value or a new token, which is why the TTL is short (and the stored copy
+# is encrypted).
+
+MAX_KEY_LENGTH = 255
+
+
+class _Record:
+    __slots__ = ("fingerprint", "done", "expires", "status", "body", "media_type")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.expires = 0.0
+        self.status: Optional[int] = None
+        self.body: Optional[bytes] = None
+        self.media_type: Optional[str] = None
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float, maxsize: int, max_body: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        # (actor, key) -> _Record, oldest first; in-flight records have status None
+        self._records: "OrderedDict[tuple, _Record]" = OrderedDict()
+
+    def _prune(self, now: float):
+        # Finished records are in expiry order; in-flight ones (few) are skipped, never dropped
+        stale = []
+        over = len(self._records) - self.maxsize
+        for key, record in self._records.items():
+            if record.status is None:
+                continue
+            if over <= 0 and record.expires > now:
+                break
+            stale.append(key)
+            over -= 1
+        for key in stale:
+            del self._records[key]
+
+    def begin(self, key: tuple, fingerprint: str):
+        """
+        Returns (record, is_owner). The owner runs the request; others wait on record.done.
+        Called on the event loop only (record.done is an asyncio.Event).
+        """
+        with self._lock:
+            now = time.monotonic()
+            record = self._records.get(key)
+            if record is not None and record.status is not None and record.expires <= now:
+                del self._records[key]
+                record = None
+            if record is None:
+                record = self._records[key] = _Record(fingerprint)
+                self._prune(now)
+                return record, True
+        if record.fingerprint != fingerprint:
+            idempotency_requests_total.inc("mismatch")
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        return record, False
+
+    def finish(self, key: tuple, record: _Record, status: Optional[int], body: Optional[bytes] = None,
+               media_type: Optional[str] = None):
+        """Records the response, or releases the key when status is None (not replayable)."""
+        with self._lock:
+            if status is None or body is None or len(body) > self.max_body:
+                if self._records.get(key) is record:
+                    del self._records[key]
+            else:
+                record.status, record.body, record.media_type = status, body, media_type
+                record.expires = time.monotonic() + self.ttl
+                self._records.move_to_end(key)
+        record.done.set()
+
+    def __len__(self):
+        return len(self._records)
+
+
+store = IdempotencyStore(settings.IDEMPOTENCY_TTL, settings.IDEMPOTENCY_MAX_ENTRIES, settings.IDEMPOTENCY_MAX_BODY)
+
+
+class SharedKeys:
+    """Claims in the idempotency_keys table (IDEMPOTENCY_SHARED), seen by every worker. Blocking."""
+
+    table = "idempotency_keys"
+
+    def __init__(self, client_factory):
+        self._client_factory = client_factory
+
+    def claim(self, scope: tuple, fingerprint: str) -> Optional[dict]:
+        """None if this request now holds the key, else the row another request holds it with."""
+        client = self._client_factory()
+        if client is None:
+            return None
+        row = client.rpc("claim_idempotency_key", {
+            "p_actor": str(scope[0]),
+            "p_key": scope[1],
+            "p_fingerprint": fingerprint,
+            "p_lease_seconds": settings.IDEMPOTENCY_LEASE,
+        }).execute().data
+        return None if row.get("owner") else row
+
+    def finish(self, scope: tuple, status: Optional[int], body: Optional[bytes] = None,
+               media_type: Optional[str] = None):
+        """Records the response for the TTL, or deletes the claim when there is none to replay."""
+        client = self._client_factory()
+        if client is None:
+            return
+        query = client.table(self.table)
+        if status is None or body is None or len(body) > store.max_body:
+            query = query.delete()
+        else:
+            enc = encrypt_value(body.decode("utf-8"))
+            expires = datetime.now(timezone.utc) + timedelta(seconds=store.ttl)
+            query = query.update({
+                "status": status,
+                "body_encrypted": enc["value"],
+                "body_key": enc["key"],
+                "media_type": media_type,
+                "expires_at": expires.isoformat(),
+            })
+        query.eq("actor", str(scope[0])).eq("key", scope[1]).execute()
+
+    @staticmethod
+    def response_of(row: dict) -> Optional[tuple]:
+        """(status, body, media_type) of a finished row, None while it is in flight."""
+        if row.get("status") is None or not row.get("body_encrypted"):
+            return None
+        body = decrypt_value(row["body_encrypted"], row.get("body_key")).encode("utf-8")
+        return row["status"], body, row.get("media_type")
+
+
+def _admin_client():
+    from .dependencies import get_supabase_admin
+    return get_supabase_admin()
+
+
+shared = SharedKeys(_admin_client)
+
+
+def _fingerprint(request, kwargs) -> str:
+    digest = hashlib.sha256(f"{request.method} {request.url.path}".encode("utf-8"))
+    # The request body models; the user (also a model with Supabase) is already in the key
+    for name in sorted(kwargs):
+        if name != "user" and isinstance(kwargs[name], BaseModel):
+            digest.update(kwargs[name].model_dump_json().encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _replay(record: _Record) -> Response:
+    return Response(content=record.body, status_code=record.status, media_type=record.media_type,
+                    headers={"Idempotent-Replayed": "true"})
+
+
+def _in_progress() -> HTTPException:
+    return HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                         headers={"Retry-After": "1"})
+
+
+async def _claim_shared(scope: tuple, fingerprint: str, record: _Record) -> Optional[bool]:
+    """
+    Claims the key in the table: True when this request now holds it, None when the table
+    can't be reached (the local claim still holds). False when another request holds it;
+    the local record is then settled from the row (its response, or released).
+    """
+    try:
+        row = await run_in_threadpool(shared.claim, scope, fingerprint)
+    except Exception as e:
+        print(f"Warning: shared Idempotency-Key claim failed, continuing on this worker only: {e}")
+        return None
+    if row is None:
+        return True
+    if row.get("fingerprint") not in (None, fingerprint):
+        store.finish(scope, record, None)
+        idempotency_requests_total.inc("mismatch")
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    response = SharedKeys.response_of(row)
+    store.finish(scope, record, *(response or (None,)))
+    return False
+
+
+async def _finish(scope: tuple, record: _Record, claimed: Optional[bool], status: Optional[int],
+                  body: Optional[bytes] = None, media_type: Optional[str] = None):
+    store.finish(scope, record, status, body, media_type)
+    if claimed:
+        try:
+            await run_in_threadpool(shared.finish, scope, status, body, media_type)
+        except Exception as e:
+            # The row then stays in flight until IDEMPOTENCY_LEASE and the key can run again
+            print(f"Warning: could not record Idempotency-Key response: {e}")
+
+
+def idempotent(func):
+    """Honours the Idempotency-Key header on a sync create route (see above). Mark it innermost."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        request = kwargs.get("request")
+        key = request.headers.get("idempotency-key") if request is not None else None
+        if not key or store.ttl <= 0:
+            return await run_in_threadpool(func, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+        user = kwargs.get("user")
+        scope = (getattr(user, "id", None), key)
+        fingerprint = _fingerprint(request, kwargs)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+
+        while True:
+            record, owner = store.begin(scope, fingerprint)
+            if owner:
+                claimed = await _claim_shared(scope, fingerprint, record) if settings.IDEMPOTENCY_SHARED else None
+                if claimed is not False:
+                    break
+                # Held elsewhere: the local record now says what the table said
+                if record.status is not None:
+                    idempotency_requests_total.inc("replayed")
+                    return _replay(record)
+                idempotency_requests_total.inc("in_progress")
+                raise _in_progress()
+            if not record.done.is_set():
+                idempotency_requests_total.inc("waited")
+                try:
+                    await asyncio.wait_for(record.done.wait(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise _in_progress()
+            if record.status is not None:
+                idempotency_requests_total.inc("replayed")
+                return _replay(record)
+            # The original failed without a recordable response: run it ourselves
+
+        idempotency_requests_total.inc("new")
+        try:
+            result = await run_in_threadpool(func, *args, **kwargs)
+        except HTTPException as e:
+            if e.status_code < 500 and e.status_code != 429 and not e.headers:
+                body = FastJSONResponse({"detail": e.detail}).body
+                await _finish(scope, record, claimed, e.status_code, body, "application/json")
+            else:
+                await _finish(scope, record, claimed, None)
+            raise
+        except BaseException:
+            await _finish(scope, record, claimed, None)
+            raise
+        if isinstance(result, Response):
+            await _finish(scope, record, claimed, result.status_code, getattr(result, "body", None), result.media_type)
+        else:
+            await _finish(scope, record, claimed, 200, FastJSONResponse(jsonable_encoder(result)).body, "application/json")
+        return result
+    return wrapper
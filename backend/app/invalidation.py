@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import uuid
+import queue
+import socket
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+from .config import settings
+from .metrics import record_cache, invalidations_total, invalidation_flushes_total
+
+# Cross-worker cache invalidation.
+#
+# An in-process cache (LocalCache) is only safe with several workers if every worker hears
+# about every write. Mutating routes call bus.publish(topic, key) after a successful write:
+# the entry is dropped locally right away and the message goes to every other worker.
+#
+#   INVALIDATION_BUS=postgres  NOTIFY/LISTEN on one channel over direct Postgres connections
+#                              (DATABASE_URL, a session connection - not the transaction
+#                              pooler, which drops LISTEN). Needs psycopg.
+#   INVALIDATION_BUS=local     one Unix datagram socket per worker in INVALIDATION_SOCKET_DIR;
+#                              single host only (and tests)
+#   INVALIDATION_BUS=off       default; the caches are then disabled, since nothing would
+#                              tell them about writes made on other workers
+#
+# Delivery lag is bounded: every worker sends a heartbeat each INVALIDATION_HEARTBEAT
+# seconds and numbers its messages. A gap in a sender's sequence (a dropped message) or a
+# lost connection flushes every cache, and if nothing at all arrives for
+# INVALIDATION_MAX_LAG seconds the caches are flushed and bypassed until the bus is heard
+# again. A cached entry is therefore never more than INVALIDATION_MAX_LAG seconds behind a
+# write made on another worker.
+
+CHANNEL = "envrypt_invalidate"
+
+
+class LocalCache:
+    """TTL cache for one topic, invalidated through the bus. ttl <= 0 or no running bus disables it."""
+
+    def __init__(self, topic: str, ttl: float, maxsize: int = 10000):
+        self.topic = topic
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.generation = 0
+        self._entries: Dict[Any, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        bus.register(self)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and bus.delivering()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        hit = entry is not None and entry[0] > time.monotonic()
+        record_cache(self.topic, hit)
+        return entry[1] if hit else None
+
+    def set(self, key, value, generation: int):
+        """
+        Stores a value read from the DB. Pass the generation taken before the read: if an
+        invalidation arrived in between, the value may predate it and is not stored.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if len(self._entries) >= self.maxsize:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self.generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class PostgresTransport:
+    def __init__(self, dsn: str):
+        import psycopg  # optional dependency, only needed for this transport
+        self._psycopg = psycopg
+        self._dsn = dsn
+        self._listener = None
+        self._notifier = None
+
+    def send(self, payload: str):
+        try:
+            if self._notifier is None or self._notifier.closed:
+                self._notifier = self._psycopg.connect(self._dsn, autocommit=True)
+            self._notifier.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+        except Exception:
+            self._close("_notifier")
+            raise
+
+    def receive(self, timeout: float) -> List[str]:
+        try:
+            if self._listener is None or self._listener.closed:
+                self._listener = self._psycopg.connect(self._dsn, autocommit=True)
+                self._listener.execute(f"LISTEN {CHANNEL}")
+            return [n.payload for n in self._listener.notifies(timeout=timeout)]
+        except Exception:
+            self._close("_listener")
+            raise
+
+    def _close(self, name: str):
+        conn = getattr(self, name)
+        setattr(self, name, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        self._close("_listener")
+        self._close("_notifier")
+
+
+class LocalSocketTransport:
+    def __init__(self, directory: str, origin: str):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._path = os.path.join(directory, f"{origin}.sock")
+        self._inbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._inbox.bind(self._path)
+        self._outbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._outbox.setblocking(False)
+
+    def send(self, payload: str):
+        data = payload.encode("utf-8")
+        for name in os.listdir(self._directory):
+            if not name.endswith(".sock"):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                self._outbox.sendto(data, path)
+            except ConnectionRefusedError:
+                # Left behind by a worker that died without cleaning up
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except (BlockingIOError, FileNotFoundError):
+                # A peer's buffer is full (it will see a gap and flush) or it just exited
+                pass
+
+    def receive(self, timeout: float) -> List[str]:
+        self._inbox.settimeout(timeout)
+        try:
+            return [self._inbox.recv(65536).decode("utf-8")]
+        except socket.timeout:
+            return []
+
+    def close(self):
+        self._inbox.close()
+        self._outbox.close()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+class InvalidationBus:
+    def __init__(self):
+        self.origin = uuid.uuid4().hex[:12]
+        self.last_heard = 0.0
+        self._caches: Dict[str, List[LocalCache]] = {}
+        self._listeners: Dict[str, List[Callable[[Any], None]]] = {}
+        self._transport = None
+        self._degraded = False
+        self._seq = 0
+        self._seen: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._outbox: "queue.Queue[str]" = queue.Queue(maxsize=10000)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def register(self, cache: LocalCache):
+        self._caches.setdefault(cache.topic, []).append(cache)
+
+    def subscribe(self, topic: str, listener: Callable[[Any], None]):
+        """Calls listener(key) for every message on topic, local or from another worker."""
+        self._listeners.setdefault(topic, []).append(listener)
+
+    def healthy(self) -> bool:
+        return not self._degraded
+
+    def delivering(self) -> bool:
+        """True while invalidations from other workers arrive, the condition for caching."""
+        return self._transport is not None and not self._degraded
+
+    def describe(self) -> str:
+        if self._transport is None:
+            return "off"
+        if self._degraded:
+            return f"degraded: nothing heard for {time.monotonic() - self.last_heard:.0f}s, caches bypassed"
+        return f"{settings.INVALIDATION_BUS}, {len(self._seen)} workers heard"
+
+    def start(self):
+        mode = settings.INVALIDATION_BUS
+        if self._transport is not None:
+            return
+        if mode == "off":
+            if any(cache.ttl > 0 for caches in self._caches.values() for cache in caches):
+                print("Warning: INVALIDATION_BUS=off, in-process caches (e.g. TOKEN_CACHE_TTL) are disabled")
+            return
+        try:
+            if mode == "postgres":
+                if not settings.DATABASE_URL:
+                    raise ValueError("DATABASE_URL is not set")
+                self._transport = PostgresTransport(settings.DATABASE_URL)
+            elif mode == "local":
+                self._transport = LocalSocketTransport(settings.INVALIDATION_SOCKET_DIR, self.origin)
+            else:
+                raise ValueError(f"unknown INVALIDATION_BUS '{mode}'")
+        except Exception as e:
+            # Caches stay off rather than serving entries nobody can invalidate
+            print(f"Warning: invalidation bus not started, in-process caches disabled: {e}")
+            self._degraded = True
+            return
+        self._stop.clear()
+        self.last_heard = time.monotonic()
+        self._threads = [
+            threading.Thread(target=self._send_loop, name="invalidation-send", daemon=True),
+            threading.Thread(target=self._receive_loop, name="invalidation-receive", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        if self._transport is None:
+            return
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._transport.close()
+        self._transport = None
+
+    def publish(self, topic: str, key=None):
+        """Drops `key` (or the whole topic) from every worker's caches. Call after the write succeeded."""
+        invalidations_total.inc(topic, "sent")
+        self._invalidate(topic, key)
+        if self._transport is not None:
+            self._enqueue({"t": topic, "k": key})
+
+    def flush_all(self, reason: str):
+        invalidation_flushes_total.inc(reason)
+        for caches in self._caches.values():
+            for cache in caches:
+                cache.invalidate()
+
+    def _invalidate(self, topic: str, key):
+        for cache in self._caches.get(topic, ()):
+            cache.invalidate(key)
+        for listener in self._listeners.get(topic, ()):
+            listener(key)
+
+    def _enqueue(self, message: dict):
+        with self._lock:
+            self._seq += 1
+            message.update(o=self.origin, s=self._seq)
+        try:
+            self._outbox.put_nowait(json.dumps(message))
+        except queue.Full:
+            # The skipped sequence number makes every receiver flush
+            print("Invalidation outbox full, dropping a message")
+
+    def _send_loop(self):
+        while not self._stop.is_set():
+            try:
+                payload = self._outbox.get(timeout=settings.INVALIDATION_HEARTBEAT)
+            except queue.Empty:
+                self._enqueue({"t": None})
+                continue
+            try:
+                self._transport.send(payload)
+            except Exception as e:
+                # Lost; receivers see the gap in our sequence
+                print(f"Invalidation send failed: {e}")
+                self._stop.wait(1)
+
+    def _receive_loop(self):
+        while not self._stop.is_set():
+            try:
+                payloads = self._transport.receive(timeout=settings.INVALIDATION_HEARTBEAT)
+            except Exception as e:
+                print(f"Invalidation listener failed, reconnecting: {e}")
+                self._seen.clear()
+                self.flush_all("disconnect")
+                self._stop.wait(1)
+                payloads = []
+            for payload in payloads:
+                self._deliver(payload)
+            self._check_lag()
+
+    def _deliver(self, payload: str):
+        try:
+            message = json.loads(payload)
+            origin, seq = message["o"], message["s"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self.last_heard = time.monotonic()
+        if self._degraded:
+            print("Invalidation bus recovered, caches re-enabled")
+            self._degraded = False
+        previous = self._seen.get(origin)
+        self._seen[origin] = seq
+        if previous is not None and seq != previous + 1:
+            self.flush_all("gap")
+        if origin == self.origin or message.get("t") is None:
+            return
+        invalidations_total.inc(message["t"], "received")
+        self._invalidate(message["t"], message.get("k"))
+
+    def _check_lag(self):
+        if not self._degraded and time.monotonic() - self.last_heard > settings.INVALIDATION_MAX_LAG:
+            print(f"Invalidation bus silent for over {settings.INVALIDATION_MAX_LAG}s, bypassing caches")
+            self._degraded = True
+            self.flush_all("lag")
+
+
+bus = InvalidationBus()
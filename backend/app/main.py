@@ -1,13 +1,53 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from .routers import auth, secrets, tokens, audit, waitlist # Added waitlist
+from .routers import auth, secrets, tokens, audit, waitlist, admin # Added waitlist
 from .limiter import limiter
+from .metrics import MetricsMiddleware, registry, rate_limit_rejections_total, route_label
+from .roundtrips import RoundtripMiddleware
+from .compression import CompressionMiddleware
+from .responses import FastJSONResponse
+from .config import settings
+from .dependencies import close_clients
+from .utils import audit_batcher
+from .token_usage import token_usage
+from .invalidation import bus
+from .replicas import ReadYourWritesMiddleware, router as replica_router
+from .profiling import ProfileMiddleware
+from . import executors
+from .waitlist_intake import known_emails, waitlist_queue
+from . import health
 
-app = FastAPI(title="Envrypt API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executors.configure_light_pool()
+    if settings.WARMUP_ON_STARTUP:
+        await run_in_threadpool(health.warm_up)
+    if settings.WAITLIST_PRELOAD:
+        known_emails.load_in_background()
+    bus.start()
+    replica_router.start()
+    yield
+    replica_router.stop()
+    bus.stop()
+    audit_batcher.flush()
+    waitlist_queue.flush()
+    token_usage.flush()
+    close_clients()
+    executors.shutdown()
+
+app = FastAPI(title="Envrypt API", lifespan=lifespan, default_response_class=FastJSONResponse)
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    rate_limit_rejections_total.inc(route_label(request.scope))
+    return _rate_limit_exceeded_handler(request, exc)
+
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 
 # Configure CORS
 origins = [
@@ -25,14 +65,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RoundtripMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+# Only with ADMIN_TOKEN set, so requests pay nothing for profiling otherwise
+if settings.ADMIN_TOKEN:
+    app.add_middleware(ProfileMiddleware)
+
+# Outermost so latency includes CORS and exception handling
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "Envrypt Backend"}
 
+@app.get("/ready", include_in_schema=False)
+def readiness():
+    ready, checks = health.run_checks()
+    return JSONResponse({"ready": ready, "checks": checks}, status_code=200 if ready else 503)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(secrets.router, prefix="/api", tags=["secrets"])
 app.include_router(tokens.router, prefix="/api", tags=["tokens"])
 app.include_router(audit.router, prefix="/api", tags=["audit"]) 
 app.include_router(waitlist.router, prefix="/api", tags=["waitlist"]) # Added waitlist router
+app.include_router(admin.router, prefix="/api/admin", include_in_schema=False)
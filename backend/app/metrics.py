@@ -0,0 +1,297 @@
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, Tuple
+
+# Minimal Prometheus-compatible metrics registry.
+# We keep this in-process and dependency free: every observation is a dict lookup,
+# a bisect over a short bucket list and a few additions under a lock, which is cheap
+# enough to leave on for every request in production.
+
+_INF_LABEL = 'le="+Inf"'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def snapshot(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def remove(self, *labels):
+        with self._lock:
+            self._values.pop(labels, None)
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels, value: float):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[labels] = series
+            series[idx] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def count(self, *labels) -> int:
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._values.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            cumulative += series[len(self.buckets)]
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, _INF_LABEL)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("_metric", "_labels", "_start")
+
+    def __init__(self, metric: Histogram, labels: Tuple):
+        self._metric = metric
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metric.observe(*self._labels, value=time.perf_counter() - self._start)
+        return False
+
+
+def timed(metric: Histogram, *labels):
+    """Decorator form of Histogram.time() for whole functions."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(*labels, value=time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP layer
+http_requests_total = registry.register(Counter(
+    "envrypt_http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram(
+    "envrypt_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route")))
+http_requests_in_progress = registry.register(Gauge(
+    "envrypt_http_requests_in_progress", "HTTP requests currently being served."))
+
+# Supabase / PostgREST calls
+upstream_requests_total = registry.register(Counter(
+    "envrypt_upstream_requests_total", "Supabase calls by table, operation and outcome.", ("service", "table", "operation", "status")))
+upstream_request_duration = registry.register(Histogram(
+    "envrypt_upstream_request_duration_seconds", "Supabase call latency by table and operation.", ("service", "table", "operation")))
+upstream_retries_total = registry.register(Counter(
+    "envrypt_upstream_retries_total", "Supabase read retries by reason (exception type or HTTP status).", ("reason",)))
+upstream_hedges_total = registry.register(Counter(
+    "envrypt_upstream_hedges_total", "Hedged Supabase reads by which request answered first.", ("winner",)))
+circuit_state = registry.register(Gauge(
+    "envrypt_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).", ("circuit",)))
+circuit_rejections_total = registry.register(Counter(
+    "envrypt_circuit_rejections_total", "Calls failed fast because the circuit was open.", ("circuit",)))
+
+# Crypto, audit, rate limiting, caches
+crypto_duration = registry.register(Histogram(
+    "envrypt_crypto_duration_seconds", "Time spent in envelope encryption and decryption.", ("operation",),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)))
+audit_write_duration = registry.register(Histogram(
+    "envrypt_audit_write_duration_seconds", "Audit log write latency.", ("outcome",)))
+rate_limit_rejections_total = registry.register(Counter(
+    "envrypt_rate_limit_rejections_total", "Requests rejected by the rate limiter.", ("route",)))
+cache_requests_total = registry.register(Counter(
+    "envrypt_cache_requests_total", "Cache lookups by cache name and result (hit/miss).", ("cache", "result")))
+singleflight_requests_total = registry.register(Counter(
+    "envrypt_singleflight_requests_total", "Coalesced reads by flight and role (leader ran the work, waiter shared it, timeout gave up waiting and ran it too).", ("flight", "role")))
+audit_batch_size = registry.register(Histogram(
+    "envrypt_audit_batch_size", "Audit events written per batched insert.", (),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)))
+invalidations_total = registry.register(Counter(
+    "envrypt_invalidations_total", "Cache invalidation messages by topic and direction (sent/received).", ("topic", "direction")))
+invalidation_flushes_total = registry.register(Counter(
+    "envrypt_invalidation_flushes_total", "Full cache flushes by reason (gap, disconnect, lag).", ("reason",)))
+waitlist_signups_total = registry.register(Counter(
+    "envrypt_waitlist_signups_total", "Waitlist signups by outcome (known, created, duplicate, queued, rejected, dropped).", ("outcome",)))
+waitlist_batch_size = registry.register(Histogram(
+    "envrypt_waitlist_batch_size", "Waitlist signups written per bulk upsert.", (),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)))
+
+
+# Route executors (see executors.py)
+executor_in_flight = registry.register(Gauge(
+    "envrypt_executor_in_flight", "Requests running or queued on a route class's thread pool.", ("pool",)))
+executor_capacity = registry.register(Gauge(
+    "envrypt_executor_capacity", "Requests a route class admits at once (workers + queue) before shedding.", ("pool",)))
+executor_queue_seconds = registry.register(Histogram(
+    "envrypt_executor_queue_seconds", "Time requests waited for a thread in a route class's pool.", ("pool",)))
+executor_rejections_total = registry.register(Counter(
+    "envrypt_executor_rejections_total", "Requests shed with 503 because a route class's pool was full.", ("pool",)))
+
+# Per-team fair scheduling (see fairness.py); team is the tenant key (team id, or user:<id>)
+fair_running = registry.register(Gauge(
+    "envrypt_fair_running", "Expensive requests a team is running.", ("team",)))
+fair_queue_seconds = registry.register(Histogram(
+    "envrypt_fair_queue_seconds", "Time a team's expensive requests waited for their fair share.", ("team",)))
+fair_rejections_total = registry.register(Counter(
+    "envrypt_fair_rejections_total", "Requests refused with 429 because a team's fair queue was full.", ("team",)))
+
+idempotency_requests_total = registry.register(Counter(
+    "envrypt_idempotency_requests_total", "Requests with an Idempotency-Key by outcome (new, replayed, waited, in_progress, mismatch).", ("outcome",)))
+
+conditional_requests_total = registry.register(Counter(
+    "envrypt_conditional_requests_total", "Versioned list reads by resource and outcome (not_modified, modified, unversioned).", ("resource", "outcome")))
+
+
+def record_cache(cache: str, hit: bool):
+    cache_requests_total.inc(cache, "hit" if hit else "miss")
+
+
+def route_label(scope) -> str:
+    """Route template (e.g. /api/vaults/{vault_id}) so path params don't explode cardinality."""
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency and status codes.
+    Avoids BaseHTTPMiddleware so we don't pay for an extra task + body streaming per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_progress.dec()
+            route = route_label(scope)
+            method = scope["method"]
+            http_request_duration.observe(method, route, value=elapsed)
+            http_requests_total.inc(method, route, str(status_holder[0]))
@@ -0,0 +1,246 @@
+import os
+import sys
+import time
+import uuid
+import hmac
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from .config import settings
+from .invalidation import bus
+
+# On-demand profiling (admin routes in routers/admin.py, enabled by ADMIN_TOKEN).
+#
+# CPU: a sampling profiler. A background thread reads every thread's current stack each
+# PROFILE_SAMPLE_INTERVAL seconds (sys._current_frames) and counts identical stacks. Nothing
+# is hooked into the interpreter, so the app runs at full speed between samples and there is
+# no cost at all when no profile is running. Output is written to PROFILE_DIR in the folded
+# format ("thread;file:func;file:func count") read by flamegraph.pl, inferno and speedscope.
+#
+#   - POST /api/admin/profile/cpu starts a run on every worker (sent over the invalidation
+#     bus); each writes cpu-<run>-<pid>.folded
+#   - a request carrying `X-Profile: <ADMIN_TOKEN>` is sampled while it runs and written to
+#     req-<id>-<pid>.folded. Samples cover all threads of the worker, rooted at the thread
+#     name, so concurrent requests show up next to it.
+#
+# Memory: tracemalloc snapshots of this worker, kept in memory and dumped to PROFILE_DIR,
+# with top allocation sites and diffs between two snapshots. tracemalloc slows allocations
+# down noticeably while it is tracing, so it only runs between /memory/start and /memory/stop.
+
+_IDLE = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("socket.py", "accept"), ("connection.py", "wait"),
+}
+_profile_lock = threading.Lock()
+
+
+def is_admin_token(value: Optional[str]) -> bool:
+    return bool(settings.ADMIN_TOKEN) and bool(value) and hmac.compare_digest(value, settings.ADMIN_TOKEN)
+
+
+def _output_path(name: str) -> str:
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    return os.path.join(settings.PROFILE_DIR, f"{name}-{os.getpid()}.folded")
+
+
+class Sampler:
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or settings.PROFILE_SAMPLE_INTERVAL
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        # Threads left out of the samples (e.g. the one waiting out a timed run)
+        self.ignore = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.is_set():
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me or ident in self.ignore:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit: int = 15) -> List[Tuple[str, int]]:
+        """Functions by samples where they were on top of the stack (self time)."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+
+def run_cpu_profile(run_id: str, seconds: float) -> Optional[Sampler]:
+    """Samples this worker for `seconds` and writes cpu-<run_id>-<pid>.folded. One run at a time."""
+    if not _profile_lock.acquire(blocking=False):
+        print(f"CPU profile {run_id} skipped: another profile is running in this worker")
+        return None
+    try:
+        sampler = Sampler()
+        sampler.ignore.add(threading.get_ident())
+        sampler.start()
+        time.sleep(min(seconds, settings.PROFILE_MAX_SECONDS))
+        sampler.stop()
+        path = _output_path(f"cpu-{run_id}")
+        sampler.write(path)
+        print(f"CPU profile {run_id}: {sampler.samples} samples written to {path}")
+        return sampler
+    finally:
+        _profile_lock.release()
+
+
+def start_cpu_profile(seconds: float) -> str:
+    """Starts a profile run on every worker; returns its id."""
+    run_id = uuid.uuid4().hex[:8]
+    bus.publish("profile", f"{run_id}:{seconds}")
+    return run_id
+
+
+def _on_profile(key):
+    if not key:
+        return
+    run_id, _, seconds = str(key).partition(":")
+    threading.Thread(target=run_cpu_profile, args=(run_id, float(seconds)), name="profile-run", daemon=True).start()
+
+
+bus.subscribe("profile", _on_profile)
+
+
+def profile_files(run_id: str) -> List[str]:
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    return sorted(
+        os.path.join(settings.PROFILE_DIR, name) for name in os.listdir(settings.PROFILE_DIR)
+        if name.startswith(f"cpu-{run_id}-") or name.startswith(f"req-{run_id}-")
+    )
+
+
+class ProfileMiddleware:
+    """Samples requests sent with `X-Profile: <ADMIN_TOKEN>`. Only installed when ADMIN_TOKEN is set."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = dict(scope["headers"]).get(b"x-profile")
+        if header is None or not is_admin_token(header.decode("latin-1")):
+            return await self.app(scope, receive, send)
+        if not _profile_lock.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        path = _output_path(f"req-{uuid.uuid4().hex[:8]}")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-file", path.encode())]
+            await send(message)
+
+        sampler = Sampler()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            _profile_lock.release()
+            sampler.write(path)
+
+
+# --- Memory ---------------------------------------------------------------------------------
+
+_snapshots: Dict[str, tracemalloc.Snapshot] = {}
+_snapshot_order: List[str] = []
+
+
+def start_tracing():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(settings.PROFILE_TRACEMALLOC_FRAMES)
+
+
+def stop_tracing():
+    tracemalloc.stop()
+    _snapshots.clear()
+    _snapshot_order.clear()
+
+
+def take_snapshot() -> Tuple[str, tracemalloc.Snapshot]:
+    if not tracemalloc.is_tracing():
+        raise ValueError("tracemalloc is not running; POST /api/admin/memory/start first")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    snapshot_id = uuid.uuid4().hex[:8]
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    snapshot.dump(os.path.join(settings.PROFILE_DIR, f"mem-{snapshot_id}-{os.getpid()}.snapshot"))
+    _snapshots[snapshot_id] = snapshot
+    _snapshot_order.append(snapshot_id)
+    # Snapshots are large; keep the last few in memory (older ones remain on disk)
+    while len(_snapshot_order) > settings.PROFILE_MAX_SNAPSHOTS:
+        _snapshots.pop(_snapshot_order.pop(0), None)
+    return snapshot_id, snapshot
+
+
+def format_stats(stats, limit: int) -> List[dict]:
+    out = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        item = {"location": f"{frame.filename}:{frame.lineno}", "size_kib": round(stat.size / 1024, 1), "count": stat.count}
+        if hasattr(stat, "size_diff"):
+            item["size_diff_kib"] = round(stat.size_diff / 1024, 1)
+            item["count_diff"] = stat.count_diff
+        out.append(item)
+    return out
+
+
+def diff_snapshots(old_id: Optional[str], new_id: Optional[str], limit: int) -> dict:
+    if old_id is None and new_id is None:
+        if len(_snapshot_order) < 2:
+            raise ValueError("Need two snapshots to diff")
+        old_id, new_id = _snapshot_order[-2], _snapshot_order[-1]
+    missing = [s for s in (old_id, new_id) if s not in _snapshots]
+    if missing:
+        raise KeyError(f"Unknown snapshot(s) in this worker: {', '.join(map(str, missing))}")
+    stats = _snapshots[new_id].compare_to(_snapshots[old_id], "lineno")
+    return {"from": old_id, "to": new_id, "top": format_stats(stats, limit)}
+
+
+def memory_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    return {
+        "pid": os.getpid(),
+        "tracing": tracemalloc.is_tracing(),
+        "traced_kib": round(current / 1024, 1),
+        "peak_kib": round(peak / 1024, 1),
+        "snapshots": list(_snapshot_order),
+    }
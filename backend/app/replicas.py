@@ -0,0 +1,155 @@
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from .config import settings
+from .invalidation import bus
+from .resilience import CircuitBreaker, host_breakers
+
+# Read-replica routing (SUPABASE_READ_REPLICA_URLS; lag check needs migrations/008_replica_lag.sql).
+#
+# Read-heavy routes ask for a read client (get_read_client / read_admin_client). It points at a
+# healthy replica, round-robin, and at the primary when:
+#   - no replica is configured or healthy: a background check polls each replica's
+#     replication lag every REPLICA_HEALTH_INTERVAL seconds and takes it out of rotation
+#     above REPLICA_MAX_LAG seconds or on error; each replica also has its own circuit
+#     breaker, so failing calls remove it before the next check
+#   - the caller wrote something in the last REPLICA_STICKY_SECONDS (read-your-writes).
+#     ReadYourWritesMiddleware marks the caller's bearer token after any successful write,
+#     and vault writes mark the vault; both go over the invalidation bus so every worker
+#     knows, not just the one that handled the write.
+#
+# Writes always go to the primary.
+
+_STICKY_TOPIC = "replica_sticky"
+
+
+def sticky_key(authorization: Optional[str]) -> Optional[str]:
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    return hashlib.sha256(authorization[7:].encode("utf-8")).hexdigest()[:24]
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.host = urlparse(self.url).hostname or self.url
+        self.breaker = CircuitBreaker(f"replica:{self.host}", settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_TIMEOUT)
+        host_breakers[self.host] = self.breaker
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.last_error = "not checked yet"
+        self._clients: Dict[str, object] = {}
+
+    def available(self) -> bool:
+        return self.healthy and self.breaker.state != CircuitBreaker.OPEN
+
+    def client(self, key: str):
+        """Replica client for an API key, sharing the primary's connection pool."""
+        client = self._clients.get(key)
+        if client is None:
+            from .dependencies import create_client_for
+            client = self._clients[key] = create_client_for(self.url, key)
+        return client
+
+    def describe(self) -> str:
+        if self.healthy:
+            return f"lag {self.lag:.1f}s, circuit {self.breaker.describe()}"
+        return f"out of rotation: {self.last_error}"
+
+
+class ReplicaRouter:
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(url) for url in urls if url.strip()]
+        self._next = 0
+        self._sticky: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        bus.subscribe(_STICKY_TOPIC, self._mark)
+        bus.subscribe("vault", self._mark)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def pick(self, key: Optional[str] = None) -> Optional[Replica]:
+        """A healthy replica for this caller, or None to use the primary."""
+        if not self.replicas or (key and self.is_sticky(key)):
+            return None
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.available():
+                    return replica
+        return None
+
+    def mark_write(self, key: str):
+        bus.publish(_STICKY_TOPIC, key)
+
+    def is_sticky(self, key: str) -> bool:
+        until = self._sticky.get(key)
+        return until is not None and until > time.monotonic()
+
+    def _mark(self, key):
+        if not self.replicas or key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky) > 10000:
+                self._sticky = {k: t for k, t in self._sticky.items() if t > now}
+            self._sticky[key] = now + settings.REPLICA_STICKY_SECONDS
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                lag = replica.client(settings.SUPABASE_SERVICE_ROLE_KEY or settings.SUPABASE_KEY)\
+                    .rpc("replica_lag_seconds").execute().data
+                replica.lag = float(lag or 0)
+                replica.healthy = replica.lag <= settings.REPLICA_MAX_LAG
+                replica.last_error = f"lag {replica.lag:.1f}s over {settings.REPLICA_MAX_LAG}s"
+            except Exception as e:
+                replica.healthy = False
+                replica.last_error = str(e)
+
+    def start(self):
+        if not self.replicas or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(settings.REPLICA_HEALTH_INTERVAL)
+
+
+router = ReplicaRouter(settings.SUPABASE_READ_REPLICA_URLS.split(","))
+
+
+class ReadYourWritesMiddleware:
+    """Marks the caller sticky to the primary after any successful write request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not router.enabled or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+                key = sticky_key(authorization)
+                if key:
+                    router.mark_write(key)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
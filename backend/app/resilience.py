@@ -0,0 +1,256 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional
+import httpx
+from fastapi import HTTPException
+from .config import settings
+from .metrics import (
+    upstream_retries_total, upstream_hedges_total, circuit_state, circuit_rejections_total,
+)
+
+# Resilience layer for Supabase calls, applied in the shared transport (see upstream.py):
+#
+#   - per-call timeouts (reads are short, writes get longer) instead of httpx's 120s default,
+#     so a slow upstream can't pin every threadpool worker
+#   - bounded retries with full-jitter backoff, for idempotent reads only (GET/HEAD),
+#     on connection errors, timeouts and 502/503/504. The backoff sleeps, so callers on the
+#     event loop run the call in the threadpool.
+#   - a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failed calls (a call
+#     and its retries count once) calls fail
+#     fast with a 503 for CIRCUIT_RESET_TIMEOUT seconds, then one trial call decides
+#     whether to close it again. The state is reported by /ready.
+#   - optional hedged reads: if a read hasn't answered after UPSTREAM_HEDGE_AFTER seconds a
+#     second identical request is sent and whichever answers first wins
+#
+# Writes are never retried or hedged: PostgREST inserts/RPCs are not idempotent.
+
+_IDEMPOTENT_METHODS = ("GET", "HEAD")
+_RETRY_STATUSES = (502, 503, 504)
+
+
+class UpstreamUnavailable(HTTPException):
+    """503 raised when Supabase can't be reached (circuit open, timeouts, connection errors)."""
+
+    def __init__(self, detail: str = "Database temporarily unavailable, please retry", retry_after: Optional[float] = None):
+        headers = {"Retry-After": str(max(1, int(retry_after or 1)))}
+        super().__init__(status_code=503, detail=detail, headers=headers)
+
+
+def api_error(e: Exception) -> HTTPException:
+    """
+    Maps an exception caught in a route to the HTTP error to raise: HTTPExceptions pass
+    through unchanged, upstream outages become a 503, anything else stays a 400.
+    """
+    if isinstance(e, HTTPException):
+        return e
+    if is_upstream_error(e):
+        return UpstreamUnavailable()
+    return HTTPException(status_code=400, detail=str(e))
+
+
+def is_upstream_error(e: Exception) -> bool:
+    """True for failures to reach Supabase, as opposed to errors Supabase answered with."""
+    if isinstance(e, (httpx.TransportError, UpstreamUnavailable)):
+        return True
+    # gotrue wraps 502/503/504 answers in AuthRetryableError
+    from supabase_auth.errors import AuthRetryableError
+    return isinstance(e, AuthRetryableError)
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = ""
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        circuit_state.set(name, value=0)
+
+    def _set_state(self, state: str):
+        self.state = state
+        circuit_state.set(self.name, value=self._GAUGE[state])
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """Raises UpstreamUnavailable if the call must not go out."""
+        if self.state == self.CLOSED:
+            return
+        with self._lock:
+            if self.state == self.OPEN and self.retry_after() <= 0:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            if self.state == self.CLOSED:
+                return
+        circuit_rejections_total.inc(self.name)
+        raise UpstreamUnavailable(retry_after=self.retry_after() or 1)
+
+    def record_success(self):
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                print(f"Circuit '{self.name}' closed")
+                self._set_state(self.CLOSED)
+
+    def record_failure(self, error: str):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                print(f"Circuit '{self.name}' opened after {self.failures} failures: {error}")
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def describe(self) -> str:
+        if self.state == self.OPEN:
+            return f"open ({self.retry_after():.0f}s left): {self.last_error}"
+        if self.failures:
+            return f"{self.state}, {self.failures} recent failures: {self.last_error}"
+        return self.state
+
+
+breaker = CircuitBreaker("supabase", settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_TIMEOUT)
+# Hosts with their own breaker (read replicas), so a failing replica doesn't trip the primary's
+host_breakers: Dict[str, CircuitBreaker] = {}
+
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+_hedge_slots = threading.BoundedSemaphore(max(1, settings.UPSTREAM_HEDGE_MAX_IN_FLIGHT))
+_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(
+                    max_workers=2 * max(1, settings.UPSTREAM_HEDGE_MAX_IN_FLIGHT), thread_name_prefix="upstream-hedge")
+    return _hedge_pool
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: spreads retries from many workers instead of synchronizing them
+    return random.uniform(0, min(settings.UPSTREAM_RETRY_MAX_DELAY, settings.UPSTREAM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def _discard(future):
+    # Loser of a hedged read: close its response so the connection goes back to the pool
+    try:
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+    finally:
+        _hedge_slots.release()
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """Wraps the real transport with timeouts, retries, hedging and the circuit breaker."""
+
+    def __init__(self, transport: httpx.BaseTransport, breaker: CircuitBreaker = breaker):
+        self._transport = transport
+        self._breaker = breaker
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        idempotent = request.method in _IDEMPOTENT_METHODS
+        _apply_timeout(request, idempotent)
+        attempts = 1 + (settings.UPSTREAM_RETRIES if idempotent else 0)
+        breaker = host_breakers.get(request.url.host, self._breaker)
+
+        # One logical call is one success or failure for the breaker, however many attempts it took
+        breaker.before_call()
+        recorded = False
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(_backoff(attempt - 1))
+                # Stop retrying once other calls have opened the circuit
+                last = attempt + 1 >= attempts or breaker.state == breaker.OPEN
+                try:
+                    if idempotent and settings.UPSTREAM_HEDGE_AFTER > 0:
+                        response = self._send_hedged(request)
+                    else:
+                        response = self._transport.handle_request(request)
+                except httpx.TransportError as e:
+                    if last:
+                        recorded = True
+                        breaker.record_failure(f"{type(e).__name__}: {e}")
+                        raise
+                    upstream_retries_total.inc(type(e).__name__)
+                    continue
+                if response.status_code not in _RETRY_STATUSES:
+                    recorded = True
+                    breaker.record_success()
+                    return response
+                if last:
+                    recorded = True
+                    breaker.record_failure(f"HTTP {response.status_code}")
+                    return response
+                upstream_retries_total.inc(str(response.status_code))
+                response.close()
+        finally:
+            if not recorded:
+                # Any other exception: hand the half-open trial to the next call
+                breaker.release_trial()
+
+    def _send_hedged(self, request: httpx.Request) -> httpx.Response:
+        # A slot covers both copies, so the pool never queues; without one, send directly
+        if not _hedge_slots.acquire(blocking=False):
+            return self._transport.handle_request(request)
+        release = True
+        try:
+            pool = _get_hedge_pool()
+            primary = pool.submit(self._transport.handle_request, request)
+            done, _ = wait([primary], timeout=settings.UPSTREAM_HEDGE_AFTER)
+            if done:
+                return primary.result()
+
+            hedge = pool.submit(self._transport.handle_request, request)
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        upstream_hedges_total.inc("primary" if future is primary else "hedge")
+                        for other in pending:
+                            # The slot is held until the loser finishes too
+                            release = False
+                            other.add_done_callback(_discard)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            if release:
+                _hedge_slots.release()
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def _apply_timeout(request: httpx.Request, idempotent: bool):
+    """Caps the request's timeouts; a shorter timeout passed by the caller is kept."""
+    total = settings.UPSTREAM_TIMEOUT if idempotent else settings.UPSTREAM_WRITE_TIMEOUT
+    caps = httpx.Timeout(total, connect=min(total, settings.UPSTREAM_CONNECT_TIMEOUT)).as_dict()
+    current = request.extensions.get("timeout") or {}
+    request.extensions["timeout"] = {
+        key: cap if current.get(key) is None else min(current[key], cap) for key, cap in caps.items()
+    }
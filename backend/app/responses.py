@@ -0,0 +1,22 @@
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt, stdlib is the fallback
+    orjson = None
+
+# Default response class for the API.
+# orjson serializes dicts/lists of plain values several times faster than stdlib json
+# and natively handles datetime/UUID. Routes that build their payload from DB rows can
+# return FastJSONResponse(...) directly to skip FastAPI's jsonable_encoder pass as well.
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,140 @@
+import os
+import traceback
+import contextvars
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from .config import settings
+
+# Per-request Supabase round-trip accounting.
+# Every call that goes through the shared transport (see upstream.py) is recorded on the
+# tracker bound to the current request. Sync routes run in the threadpool with a copy of
+# the request context, so the tracker object itself is shared and counts add up.
+#
+# ROUNDTRIP_MODE:
+#   off   - no tracking (default)
+#   log   - print a report with call sites when a route exceeds its budget
+#   raise - raise RoundtripBudgetExceeded after the response (for tests / CI)
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.join(_APP_DIR, f) for f in ("upstream.py", "roundtrips.py", "metrics.py")}
+
+_current: contextvars.ContextVar[Optional["RoundtripTracker"]] = contextvars.ContextVar("roundtrip_tracker", default=None)
+
+
+class RoundtripBudgetExceeded(Exception):
+    def __init__(self, tracker: "RoundtripTracker"):
+        self.tracker = tracker
+        super().__init__(tracker.report())
+
+
+class RoundtripTracker:
+    def __init__(self, label: str = "", budget: Optional[int] = None, capture_stacks: bool = True):
+        self.label = label
+        self.budget = budget
+        self.capture_stacks = capture_stacks
+        # (service, table, operation, call site frames)
+        self.calls: List[Tuple[str, str, str, list]] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.calls)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.count > self.budget
+
+    def record(self, service: str, table: str, operation: str):
+        stack = _call_site() if self.capture_stacks else []
+        self.calls.append((service, table, operation, stack))
+
+    def report(self) -> str:
+        lines = [f"{self.label or 'block'} made {self.count} Supabase round trips (budget {self.budget})"]
+        for service, table, operation, stack in self.calls:
+            site = " <- ".join(f"{os.path.relpath(f.filename, _APP_DIR)}:{f.lineno} {f.name}" for f in stack)
+            lines.append(f"  {service} {operation} {table}" + (f"  [{site}]" if site else ""))
+        return "\n".join(lines)
+
+
+def _call_site(limit: int = 3) -> list:
+    """Innermost app frames (outside the HTTP plumbing) that issued the call."""
+    frames = [
+        f for f in traceback.extract_stack()
+        if f.filename.startswith(_APP_DIR) and f.filename not in _SKIP_FILES
+    ]
+    return list(reversed(frames[-limit:]))
+
+
+def record(service: str, table: str, operation: str):
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.record(service, table, operation)
+
+
+@contextmanager
+def track_roundtrips(budget: Optional[int] = None, label: str = ""):
+    """
+    Count Supabase round trips made inside the block, e.g. in tests:
+
+        with track_roundtrips(budget=3) as t:
+            client.get("/api/vaults", params={"team_id": team_id}, headers=auth)
+        assert not t.over_budget, t.report()
+    """
+    tracker = RoundtripTracker(label=label, budget=budget)
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+def roundtrip_budget(limit: int):
+    """Per-route budget override, applied under the router decorator."""
+    def decorator(func):
+        func.__roundtrip_budget__ = limit
+        return func
+    return decorator
+
+
+def _route_budget(scope) -> int:
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__roundtrip_budget__", settings.ROUNDTRIP_BUDGET)
+
+
+class RoundtripMiddleware:
+    """
+    Binds a tracker to each HTTP request and enforces the route's budget.
+    In DEBUG the count is also returned in the X-DB-Roundtrips response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.mode = settings.ROUNDTRIP_MODE
+        self.debug = settings.DEBUG
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.mode == "off" and not self.debug):
+            return await self.app(scope, receive, send)
+
+        tracker = RoundtripTracker(capture_stacks=self.mode != "off")
+        token = _current.set(tracker)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.debug:
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-db-roundtrips", str(tracker.count).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+
+        if self.mode == "off":
+            return
+        route = scope.get("route")
+        tracker.label = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+        tracker.budget = _route_budget(scope)
+        if tracker.over_budget:
+            if self.mode == "raise":
+                raise RoundtripBudgetExceeded(tracker)
+            print(f"Round-trip budget exceeded: {tracker.report()}")
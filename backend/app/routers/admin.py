@@ -0,0 +1,111 @@
+import os
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from ..config import settings
+from ..limiter import limiter
+from .. import profiling
+from ..executors import route_class
+
+router = APIRouter()
+
+# Operator-only routes, authenticated with `Authorization: Bearer <ADMIN_TOKEN>`.
+# Without ADMIN_TOKEN they don't exist (404).
+
+def require_admin(authorization: str = Header(None)):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = authorization.split(" ", 1)[1] if authorization and authorization.startswith("Bearer ") else None
+    if not profiling.is_admin_token(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@router.post("/profile/cpu")
+@limiter.limit("6/minute")
+async def profile_cpu(
+    request: Request,
+    seconds: float = Query(10, gt=0),
+    wait: bool = False,
+    _ = Depends(require_admin)
+):
+    """
+    Samples every worker for `seconds` and writes folded stacks to PROFILE_DIR.
+    With wait=true the response comes after the run, listing the files written on this host.
+    """
+    seconds = min(seconds, settings.PROFILE_MAX_SECONDS)
+    run_id = profiling.start_cpu_profile(seconds)
+    result = {"run_id": run_id, "seconds": seconds, "dir": settings.PROFILE_DIR}
+    if wait:
+        await asyncio.sleep(seconds + 1)
+        result["files"] = profiling.profile_files(run_id)
+    return result
+
+@router.get("/profile/{run_id}")
+@limiter.limit("30/minute")
+@route_class("admin")
+def get_profile(run_id: str, request: Request, limit: int = Query(15, ge=1, le=200), _ = Depends(require_admin)):
+    """Top functions (self samples) per file written for a run on this host."""
+    files = profiling.profile_files(run_id)
+    if not files:
+        raise HTTPException(status_code=404, detail="No profile output for this run on this host")
+    report = {}
+    for path in files:
+        sampler = profiling.Sampler()
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                sampler.stacks[stack] += int(count)
+        report[os.path.basename(path)] = sampler.top(limit)
+    return report
+
+@router.post("/memory/start")
+@limiter.limit("6/minute")
+@route_class("admin")
+def memory_start(request: Request, _ = Depends(require_admin)):
+    profiling.start_tracing()
+    return profiling.memory_status()
+
+@router.post("/memory/stop")
+@limiter.limit("6/minute")
+@route_class("admin")
+def memory_stop(request: Request, _ = Depends(require_admin)):
+    profiling.stop_tracing()
+    return profiling.memory_status()
+
+@router.get("/memory")
+@limiter.limit("30/minute")
+@route_class("admin")
+def memory_status(request: Request, _ = Depends(require_admin)):
+    return profiling.memory_status()
+
+@router.post("/memory/snapshot")
+@limiter.limit("6/minute")
+@route_class("admin")
+def memory_snapshot(request: Request, limit: int = Query(20, ge=1, le=200), _ = Depends(require_admin)):
+    """Takes a tracemalloc snapshot of this worker and returns its top allocation sites."""
+    try:
+        snapshot_id, snapshot = profiling.take_snapshot()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {
+        **profiling.memory_status(),
+        "snapshot_id": snapshot_id,
+        "top": profiling.format_stats(snapshot.statistics("lineno"), limit),
+    }
+
+@router.get("/memory/diff")
+@limiter.limit("30/minute")
+@route_class("admin")
+def memory_diff(
+    request: Request,
+    from_id: Optional[str] = Query(None, alias="from"),
+    to_id: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(20, ge=1, le=200),
+    _ = Depends(require_admin)
+):
+    """Growth between two snapshots of this worker (default: the last two)."""
+    try:
+        return profiling.diff_snapshots(from_id, to_id, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
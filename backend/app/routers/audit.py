@@ -1,17 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import BaseModel
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime, timedelta
-from ..dependencies import get_current_user, get_scoped_client
+from ..dependencies import get_current_user, get_read_client
+from ..roundtrips import roundtrip_budget
+from ..fairness import fair_share
+from ..conditional import conditional
+from ..responses import FastJSONResponse
+from ..resilience import api_error
 
 router = APIRouter()
 
-@router.get("/audit-logs")
+# Documents the response shape; the route returns FastJSONResponse directly so large
+# pages skip validation and jsonable_encoder.
+class AuditLogEntry(BaseModel):
+    id: Union[int, str]
+    created_at: str
+    action: str
+    team_id: str
+    actor_id: Optional[str] = None
+    actor_name: str
+    actor_type: str
+    description: str
+    ip_address: Optional[str] = None
+    user_agent: Optional[str] = None
+    metadata: Dict[str, Any]
+
+@router.get("/audit-logs", response_model=List[AuditLogEntry])
+@roundtrip_budget(3)
+@fair_share
+@conditional("audit", "team_id")
 def get_audit_logs(
     team_id: str, 
+    request: Request,
     action: Optional[str] = None,
     limit: int = 100,
     user = Depends(get_current_user), 
-    client = Depends(get_scoped_client)
+    client = Depends(get_read_client)
 ):
     try:
         # Fetch logs for the team
@@ -44,6 +69,6 @@ def get_audit_logs(
                 "metadata": meta
             })
 
-        return logs
+        return FastJSONResponse(logs)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
@@ -2,8 +2,12 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Optional
 import uuid
-from ..dependencies import get_current_user, get_scoped_client, supabase, supabase_admin
+from ..dependencies import get_current_user, get_scoped_client, get_read_client, get_supabase, get_supabase_admin
 from ..utils import log_audit_event
+from ..roundtrips import roundtrip_budget
+from ..resilience import api_error
+from ..invalidation import bus
+from ..conditional import conditional
 
 router = APIRouter()
 
@@ -26,6 +30,7 @@ class TeamMember(BaseModel):
     name: Optional[str] = None
 
 @router.post("/teams")
+@roundtrip_budget(3)
 def create_team(team: TeamCreate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     """
     Create a new team.
@@ -41,6 +46,7 @@ def create_team(team: TeamCreate, request: Request, user = Depends(get_current_u
         
         if len(response.data) > 0:
             new_team = response.data[0]
+            bus.publish("team", new_team['id'])
             # Log Audit
             log_audit_event(
                 client=client,
@@ -62,9 +68,10 @@ def create_team(team: TeamCreate, request: Request, user = Depends(get_current_u
         print(f"Error creating team: {e}")
         if "duplicate key" in str(e):
              raise HTTPException(status_code=409, detail="Team URL already exists")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.post("/teams/join")
+@roundtrip_budget(4)
 def join_team(invite: TeamJoin, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     """
     Join a team by invite code or ID.
@@ -82,7 +89,7 @@ def join_team(invite: TeamJoin, request: Request, user = Depends(get_current_use
         # Security: User can join if they know the UUID.
         # Use global supabase client to bypass RLS if configured with Service Key, 
         # or at least avoid specificity of the user's empty membership list.
-        team_res = supabase.table("teams").select("id, name").eq("id", invite.code).execute()
+        team_res = get_supabase().table("teams").select("id, name").eq("id", invite.code).execute()
         
         if not team_res.data:
              raise HTTPException(status_code=404, detail="Invalid invite code")
@@ -108,7 +115,8 @@ def join_team(invite: TeamJoin, request: Request, user = Depends(get_current_use
             "user_id": user.id,
             "role": "MEMBER"
         }).execute()
-        
+        bus.publish("team_members", team['id'])
+
         # Log Audit
         log_audit_event(
             client=client,
@@ -129,9 +137,10 @@ def join_team(invite: TeamJoin, request: Request, user = Depends(get_current_use
     except Exception as e:
         if "duplicate key" in str(e):
             raise HTTPException(status_code=409, detail="Already a member")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.get("/teams")
+@roundtrip_budget(2)
 def get_my_teams(user = Depends(get_current_user), client = Depends(get_scoped_client)):
     """
     Fetch teams the current user is a member of.
@@ -152,11 +161,12 @@ def get_my_teams(user = Depends(get_current_user), client = Depends(get_scoped_c
         return teams
     except Exception as e:
         print(f"Error fetching teams: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 
 @router.get("/teams/{team_id}/stats")
-def get_team_stats(team_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@roundtrip_budget(3)
+def get_team_stats(team_id: str, user = Depends(get_current_user), client = Depends(get_read_client)):
     """
     Get statistics for a specific team.
     """
@@ -194,7 +204,8 @@ def get_team_stats(team_id: str, user = Depends(get_current_user), client = Depe
         return {"active_variables": 0, "active_members": 0}
 
 @router.get("/teams/{team_id}/members")
-def get_team_members_details(team_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@conditional("members", "team_id")
+def get_team_members_details(team_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     """
     Get all members of a specific team with details.
     """
@@ -213,6 +224,7 @@ def get_team_members_details(team_id: str, user = Depends(get_current_user), cli
         
         # 2. Enrich with Email (Requires Admin usually)
         # We will use supabase_admin to fetch user emails by ID.
+        supabase_admin = get_supabase_admin()
         enriched_members = []
         for m in members:
             email = "hidden@user.com"
@@ -237,9 +249,10 @@ def get_team_members_details(team_id: str, user = Depends(get_current_user), cli
 
     except Exception as e:
         print(f"Error fetching members: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.put("/teams/{team_id}")
+@roundtrip_budget(2)
 def update_team(team_id: str, update: TeamUpdate, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # RLS should handle permission check (Owner only?)
@@ -252,18 +265,22 @@ def update_team(team_id: str, update: TeamUpdate, user = Depends(get_current_use
             return {"status": "no change"}
             
         response = client.table("teams").update(data).eq("id", team_id).execute()
+        if response.data:
+            bus.publish("team", team_id)
         return response.data
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.get("/teams/{team_id}/members")
-def get_team_members(team_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@conditional("members", "team_id")
+def get_team_members(team_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # Check membership first (RLS handles this for table queries, but we are enriching)
         response = client.table("team_members").select("*").eq("team_id", team_id).execute()
         members = response.data
         
         # Enrich with user details if admin client is available
+        supabase_admin = get_supabase_admin()
         enriched_members = []
         for m in members:
             email = "hidden@example.com"
@@ -305,15 +322,18 @@ def get_team_members(team_id: str, user = Depends(get_current_user), client = De
         return enriched_members
     except Exception as e:
         print(f"Error fetching members: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.delete("/teams/{team_id}/members/{user_id}")
+@roundtrip_budget(2)
 def remove_member(team_id: str, user_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # Only owners/admins should do this. RLS policy needed.
         # Assuming RLS: "Admins can delete team_members"
         
         response = client.table("team_members").delete().eq("team_id", team_id).eq("user_id", user_id).execute()
+        if response.data:
+            bus.publish("team_members", team_id)
         return {"status": "removed"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
@@ -1,10 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-from ..dependencies import get_current_user, get_scoped_client, get_service_token_header, get_valid_service_token, supabase, supabase_admin
-from ..crypto import encrypt_value, decrypt_value, hash_token
-from ..utils import log_audit_event
+import re
+import base64
+import fnmatch
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Literal, Optional
+from ..dependencies import get_current_user, get_scoped_client, get_read_client, read_admin_client, get_service_token_header, get_valid_service_token, get_supabase, get_supabase_admin
+from ..crypto import encrypt_value, decrypt_value, hash_token, fingerprint_value
+from ..utils import log_audit_event, make_etag, etag_matches
+from ..roundtrips import roundtrip_budget
 from ..limiter import limiter
+from ..responses import FastJSONResponse
+from ..config import settings
+from ..singleflight import SingleFlight
+from .. import bundles, chunks
+from ..resilience import api_error
+from ..token_usage import token_usage
+from ..invalidation import bus
+from ..replicas import router as replica_router
+from ..executors import route_class
+from ..fairness import fair_share
+from ..idempotency import idempotent
+from ..conditional import conditional
 
 router = APIRouter()
 
@@ -21,13 +39,61 @@ class VaultCreate(BaseModel):
     icon: str = None
     member_ids: List[str] = []
 
+def _encode_cursor(created_at: str, vault_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{vault_id}".encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, vault_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|", 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Both end up in a PostgREST filter
+    if not re.fullmatch(r"[0-9T:. +Z-]+", created_at) or not re.fullmatch(r"[0-9a-fA-F-]+", vault_id):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, vault_id
+
 @router.get("/vaults")
-def list_vaults(team_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@roundtrip_budget(3)
+@conditional("vaults", "team_id")
+def list_vaults(
+    team_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    user = Depends(get_current_user),
+    client = Depends(get_read_client)
+):
+    """
+    Vaults of a team, newest first, with `secrets_count`.
+    `limit` + `after` page through them (the next cursor is in X-Next-Cursor), `fields` picks columns.
+    """
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    cursor = _decode_cursor(after) if after else None
     try:
+        if settings.VAULT_ACCESS_LISTING:
+            # Only vaults the caller can open, counted in the same query (migrations/009_vault_listing.sql)
+            rows = client.rpc("list_accessible_vaults", {
+                "p_team_id": team_id,
+                "p_limit": limit,
+                "p_after_created_at": cursor[0] if cursor else None,
+                "p_after_id": cursor[1] if cursor else None,
+                "p_fields": projection,
+            }).execute().data
+            headers = {}
+            if limit and len(rows) == limit:
+                headers["X-Next-Cursor"] = _encode_cursor(rows[-1]['cursor_created_at'], rows[-1]['cursor_id'])
+            return FastJSONResponse([row['vault'] for row in rows], headers=headers)
+
         # Fetch vaults with secret count
-        response = client.table("vaults").select("*, secrets(count)").order('created_at', desc=True).eq("team_id", team_id).execute()
+        query = client.table("vaults").select("*, secrets(count)").order('created_at', desc=True).order('id', desc=True).eq("team_id", team_id)
+        if cursor:
+            query = query.or_(f"created_at.lt.{cursor[0]},and(created_at.eq.{cursor[0]},id.lt.{cursor[1]})")
+        if limit:
+            query = query.limit(limit)
+        response = query.execute()
         
         data = response.data
         # Flatten the structure
@@ -40,12 +106,19 @@ def list_vaults(team_id: str, user = Depends(get_current_user), client = Depends
             # Clean up
             if 'secrets' in vault:
                 del vault['secrets']
-                
-        return data
+
+        headers = {}
+        if limit and len(data) == limit:
+            headers["X-Next-Cursor"] = _encode_cursor(data[-1]['created_at'], data[-1]['id'])
+        if projection:
+            data = [{k: v for k, v in vault.items() if k in projection} for vault in data]
+        return FastJSONResponse(data, headers=headers)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.post("/vaults")
+@roundtrip_budget(7)  # +2 for a shared Idempotency-Key claim and record
+@idempotent
 def create_vault(vault: VaultCreate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -80,11 +153,12 @@ def create_vault(vault: VaultCreate, request: Request, user = Depends(get_curren
                 try:
                     access_entries = [{"vault_id": new_vault['id'], "user_id": uid} for uid in access_uids]
                     # Use admin client to bypass RLS for permissions setup
-                    target_client = supabase_admin if supabase_admin else client
+                    target_client = get_supabase_admin() or client
                     target_client.table("vault_access").insert(access_entries).execute()
                 except Exception as acc_e:
                     print(f"Warning: Failed to update vault_access table. Ensure table exists. {acc_e}")
                     # Validate if 'vault_access' table exists in your Supabase project
+            bus.publish("vault", new_vault['id'])
 
             # Log Audit
             log_audit_event(
@@ -103,12 +177,13 @@ def create_vault(vault: VaultCreate, request: Request, user = Depends(get_curren
             return new_vault
         raise HTTPException(status_code=400, detail="Failed to create vault")
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 class VaultAccessUpdate(BaseModel):
     member_ids: List[str]
 
 @router.get("/vaults/{vault_id}")
+@roundtrip_budget(4)
 def get_vault(vault_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -164,12 +239,13 @@ def get_vault(vault_id: str, request: Request, user = Depends(get_current_user),
     except HTTPException as he:
         raise he
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.get("/vaults/{vault_id}/access")
+@roundtrip_budget(5)
 def get_vault_access(vault_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
-        target_client = supabase_admin if supabase_admin else client
+        target_client = get_supabase_admin() or client
         
         # Security: Check if user is in the access list for this vault
         user_access = target_client.table("vault_access").select("user_id").eq("vault_id", vault_id).eq("user_id", user.id).execute()
@@ -196,12 +272,13 @@ def get_vault_access(vault_id: str, user = Depends(get_current_user), client = D
     except HTTPException as he:
         raise he
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.put("/vaults/{vault_id}/access")
+@roundtrip_budget(6)
 def update_vault_access(vault_id: str, update: VaultAccessUpdate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
-        target_client = supabase_admin if supabase_admin else client
+        target_client = get_supabase_admin() or client
         
         # Security: Verify permission. Only Team Admins/Owners
         vault_res = target_client.table("vaults").select("team_id").eq("id", vault_id).execute()
@@ -232,12 +309,14 @@ def update_vault_access(vault_id: str, update: VaultAccessUpdate, request: Reque
         if to_add:
             entries = [{"vault_id": vault_id, "user_id": uid} for uid in to_add]
             target_client.table("vault_access").insert(entries).execute()
-            
+
+        if to_add or to_remove:
+            bus.publish("vault_access", vault_id)
         return {"status": "success"}
     except HTTPException as he:
         raise he
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 
 class VaultUpdate(BaseModel):
@@ -247,6 +326,7 @@ class VaultUpdate(BaseModel):
     icon: Optional[str] = None
 
 @router.patch("/vaults/{vault_id}")
+@roundtrip_budget(3)
 def update_vault(vault_id: str, vault_update: VaultUpdate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -263,7 +343,8 @@ def update_vault(vault_id: str, vault_update: VaultUpdate, request: Request, use
         if not response.data:
             # If RLS prevented update or id not found
              raise HTTPException(status_code=404, detail="Vault not found or permission denied")
-             
+        bus.publish("vault", vault_id)
+
         # Log Audit
         if response.data:
             updated_vault = response.data[0]
@@ -283,9 +364,10 @@ def update_vault(vault_id: str, vault_update: VaultUpdate, request: Request, use
             
         return response.data[0]
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.delete("/vaults/{vault_id}")
+@roundtrip_budget(5)
 def delete_vault(vault_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -309,7 +391,7 @@ def delete_vault(vault_id: str, request: Request, user = Depends(get_current_use
         # If not CASCADE, we should manually delete secrets and access first.
         # Let's try to delete access first using admin just in case
         
-        target_client = supabase_admin if supabase_admin else client
+        target_client = get_supabase_admin() or client
         try:
              target_client.table("vault_access").delete().eq("vault_id", vault_id).execute()
         except:
@@ -319,6 +401,8 @@ def delete_vault(vault_id: str, request: Request, user = Depends(get_current_use
         
         if not del_res.data:
              raise HTTPException(status_code=403, detail="Failed to delete vault. Permission denied.")
+        bus.publish("vault", vault_id)
+        bus.publish("vault_access", vault_id)
 
         # 4. Audit
         log_audit_event(
@@ -339,9 +423,201 @@ def delete_vault(vault_id: str, request: Request, user = Depends(get_current_use
     except HTTPException as he:
         raise he
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
+
+# --- Clone / promote ----------------------------------------------------------------------
+# Both operations copy the stored envelopes (value_encrypted + encrypted_key) as they are:
+# the data keys are wrapped by the deployment-wide master key, not per vault, so a copied
+# envelope decrypts in any vault and no plaintext is ever produced. Reads and writes go
+# through the user's scoped client, so RLS applies on both sides.
+
+class VaultClone(BaseModel):
+    name: str
+    description: Optional[str] = None
+    color: Optional[str] = None
+    icon: Optional[str] = None
+    member_ids: List[str] = []
+    include: Optional[List[str]] = None  # key names or glob patterns (e.g. "STRIPE_*")
+    exclude: List[str] = []
+
+class VaultPromote(BaseModel):
+    include: Optional[List[str]] = None
+    exclude: List[str] = []
+    overwrite: bool = True  # replace values of keys that already exist in the target
+    dry_run: bool = False
+
+def _key_selected(key: str, include: Optional[List[str]], exclude: List[str]) -> bool:
+    if include is not None and not any(fnmatch.fnmatchcase(key, p) for p in include):
+        return False
+    return not any(fnmatch.fnmatchcase(key, p) for p in exclude)
+
+def _copyable_secrets(client, vault_id: str, include: Optional[List[str]], exclude: List[str]):
+    """Selected source rows, plus the keys of file secrets (their chunks are not copied)."""
+    columns = "key, value_encrypted, encrypted_key"
+    if settings.VALUE_FINGERPRINTS:
+        columns += ", value_fingerprint"
+    if settings.FILE_SECRETS:
+        columns += ", storage"
+    rows = client.table("secrets").select(columns).eq("vault_id", vault_id).execute().data
+
+    selected, files = [], []
+    for row in rows:
+        if not _key_selected(row['key'], include, exclude):
+            continue
+        if row.pop('storage', None) == 'chunked':
+            files.append(row['key'])
+            continue
+        selected.append(row)
+    return selected, files
+
+@router.post("/vaults/{vault_id}/clone")
+@roundtrip_budget(8)
+@fair_share
+@route_class("crypto")
+def clone_vault(vault_id: str, clone: VaultClone, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+    if not client:
+         raise HTTPException(status_code=503, detail="DB unavailable")
+    try:
+        src_res = client.table("vaults").select("id, team_id, name, description, color, icon").eq("id", vault_id).execute()
+        if not src_res.data:
+            raise HTTPException(status_code=404, detail="Vault not found")
+        source = src_res.data[0]
+
+        existing = client.table("vaults").select("id").eq("team_id", source['team_id']).eq("name", clone.name).execute()
+        if existing.data:
+            raise HTTPException(status_code=400, detail="A vault with this name already exists in the team.")
+
+        rows, files = _copyable_secrets(client, vault_id, clone.include, clone.exclude)
+
+        payload = {"team_id": source['team_id'], "name": clone.name}
+        for field in ("description", "color", "icon"):
+            value = getattr(clone, field) or source.get(field)
+            if value:
+                payload[field] = value
+        new_vault = client.table("vaults").insert(payload).execute().data[0]
+
+        access_uids = set(clone.member_ids)
+        access_uids.add(user.id)
+        try:
+            target_client = get_supabase_admin() or client
+            target_client.table("vault_access").insert([{"vault_id": new_vault['id'], "user_id": uid} for uid in access_uids]).execute()
+        except Exception as acc_e:
+            print(f"Warning: Failed to update vault_access table. Ensure table exists. {acc_e}")
+
+        if rows:
+            try:
+                client.table("secrets").insert([
+                    {**row, "vault_id": new_vault['id'], "created_by": user.id} for row in rows
+                ]).execute()
+            except Exception:
+                # Don't leave a half-cloned vault behind
+                client.table("vaults").delete().eq("id", new_vault['id']).execute()
+                raise
+            bundles.schedule_rebuild(new_vault['id'])
+        bus.publish("vault", new_vault['id'])
+
+        log_audit_event(
+            client=client,
+            action="CREATED",
+            description=f"Cloned vault {source['name']} into {clone.name} ({len(rows)} secrets)",
+            team_id=source['team_id'],
+            resource_id=new_vault['id'],
+            resource_type="vault",
+            actor_id=user.id,
+            actor_name=user.email.split('@')[0],
+            actor_type="user",
+            ip_address=request.client.host,
+            user_agent=request.headers.get("user-agent"),
+            metadata={"source_vault_id": vault_id, "keys": [row['key'] for row in rows]}
+        )
+        return {"vault": new_vault, "copied": len(rows), "skipped_files": files}
+    except Exception as e:
+        raise api_error(e)
+
+@router.post("/vaults/{vault_id}/promote/{target_vault_id}")
+@roundtrip_budget(7)
+@fair_share
+@route_class("crypto")
+def promote_vault(vault_id: str, target_vault_id: str, promote: VaultPromote, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+    """
+    Copies the selected secrets of vault_id into target_vault_id (e.g. staging -> prod).
+    Keys missing from the target are created; existing ones are overwritten unless
+    overwrite=false. With dry_run nothing is written and the plan is returned.
+    """
+    if not client:
+         raise HTTPException(status_code=503, detail="DB unavailable")
+    if vault_id == target_vault_id:
+        raise HTTPException(status_code=400, detail="Source and target vault are the same")
+    try:
+        vaults_res = client.table("vaults").select("id, team_id, name").in_("id", [vault_id, target_vault_id]).execute()
+        vaults = {v['id']: v for v in vaults_res.data}
+        if vault_id not in vaults or target_vault_id not in vaults:
+            raise HTTPException(status_code=404, detail="Vault not found")
+        source, target = vaults[vault_id], vaults[target_vault_id]
+        if source['team_id'] != target['team_id']:
+            raise HTTPException(status_code=400, detail="Vaults belong to different teams")
+
+        rows, files = _copyable_secrets(client, vault_id, promote.include, promote.exclude)
+        target_columns = "id, key, version, created_by" + (", value_fingerprint" if settings.VALUE_FINGERPRINTS else "")
+        if settings.FILE_SECRETS:
+            target_columns += ", storage"
+        current = {r['key']: r for r in client.table("secrets").select(target_columns).eq("vault_id", target_vault_id).execute().data}
+
+        inserts, updates = [], []
+        plan = {"created": [], "updated": [], "unchanged": [], "skipped": [], "skipped_files": files}
+        for row in rows:
+            existing = current.get(row['key'])
+            if existing is None:
+                inserts.append({**row, "vault_id": target_vault_id, "created_by": user.id})
+                plan["created"].append(row['key'])
+            elif existing.get('storage') == 'chunked':
+                # Writing an envelope over a file secret would leave its blob reference behind
+                plan["skipped_files"].append(row['key'])
+            elif not promote.overwrite:
+                plan["skipped"].append(row['key'])
+            elif row.get('value_fingerprint') and row.get('value_fingerprint') == existing.get('value_fingerprint'):
+                plan["unchanged"].append(row['key'])
+            else:
+                # Full rows (created_by included): an upsert's insert half must satisfy NOT NULL
+                updates.append({
+                    **row, "id": existing['id'], "vault_id": target_vault_id,
+                    "created_by": existing.get('created_by'), "version": existing['version'] + 1,
+                })
+                plan["updated"].append(row['key'])
+
+        if promote.dry_run:
+            return {**plan, "dry_run": True}
+
+        if inserts:
+            client.table("secrets").insert(inserts).execute()
+        if updates:
+            # Every row carries its id, so this is a bulk update in one request
+            client.table("secrets").upsert(updates, on_conflict="id").execute()
+        if inserts or updates:
+            bundles.schedule_rebuild(target_vault_id)
+            bus.publish("vault", target_vault_id)
+
+        log_audit_event(
+            client=client,
+            action="UPDATED",
+            description=f"Promoted {len(inserts) + len(updates)} secrets from vault {source['name']} to {target['name']}",
+            team_id=target['team_id'],
+            resource_id=target_vault_id,
+            resource_type="vault",
+            actor_id=user.id,
+            actor_name=user.email.split('@')[0],
+            actor_type="user",
+            ip_address=request.client.host,
+            user_agent=request.headers.get("user-agent"),
+            metadata={"source_vault_id": vault_id, "created": plan["created"], "updated": plan["updated"]}
+        )
+        return {**plan, "dry_run": False}
+    except Exception as e:
+        raise api_error(e)
 
 @router.post("/secrets")
+@roundtrip_budget(6)  # +2 for a shared Idempotency-Key claim and record
+@idempotent
 def create_secret(secret: SecretCreate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -356,15 +632,20 @@ def create_secret(secret: SecretCreate, request: Request, user = Depends(get_cur
     try:
         # RLS: "Admins/Writers can manage secrets"
         # Since we use scoped client, RLS handles verification.
-        data = client.table("secrets").insert({
+        row = {
             "vault_id": secret.vault_id,
             "key": secret.key,
             "value_encrypted": encryption_result['value'],
             "encrypted_key": encryption_result['key'],
             "created_by": user.id
-        }).execute()
+        }
+        if settings.VALUE_FINGERPRINTS:
+            row['value_fingerprint'] = fingerprint_value(secret.value)
+        data = client.table("secrets").insert(row).execute()
         
         created = data.data[0]
+        bundles.schedule_rebuild(secret.vault_id)
+        bus.publish("vault", secret.vault_id)
         
         # Log Audit
         # We need team_id. Fetch vault to get team_id? 
@@ -395,31 +676,174 @@ def create_secret(secret: SecretCreate, request: Request, user = Depends(get_cur
             "version": created['version']
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.get("/vaults/{vault_id}/secrets")
-def get_secrets(vault_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@roundtrip_budget(3)
+@conditional("secrets", "vault_id")
+def get_secrets(vault_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_read_client)):
     try:
         # RLS: "Members can view secrets"
-        response = client.table("secrets").select("id, key, version, updated_at").eq("vault_id", vault_id).execute()
+        columns = "id, key, version, updated_at"
+        if settings.FILE_SECRETS:
+            columns += ", storage, size_bytes"
+        response = client.table("secrets").select(columns).eq("vault_id", vault_id).execute()
         
         # We don't return values here anymore for security
         results = []
         for row in response.data:
-            results.append({
+            item = {
                 "id": row['id'],
                 "key": row['key'],
                 "value": None, # Masked by default
                 "version": row['version'],
                 "updated_at": row.get('updated_at')
-            })
+            }
+            if settings.FILE_SECRETS:
+                item['storage'] = row.get('storage') or 'inline'
+                item['size_bytes'] = row.get('size_bytes')
+            results.append(item)
         
         return results
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
+
+@router.get("/vaults/{vault_id}/diff/{other_vault_id}")
+@roundtrip_budget(2)
+def diff_vaults(vault_id: str, other_vault_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+    """
+    Compares two vaults by value fingerprint, without decrypting anything.
+    added/removed are relative to vault_id (added = only in other_vault_id). Keys that
+    have no comparable fingerprint on either side (not backfilled yet, or written under
+    another master key) are listed as unknown.
+    """
+    if not settings.VALUE_FINGERPRINTS:
+        raise HTTPException(status_code=404, detail="Value fingerprints are not enabled")
+    try:
+        # RLS: "Members can view secrets" applies to both sides
+        base = client.table("secrets").select("key, value_fingerprint").eq("vault_id", vault_id).execute().data
+        other = client.table("secrets").select("key, value_fingerprint").eq("vault_id", other_vault_id).execute().data
+    except Exception as e:
+        raise api_error(e)
+
+    base_fp = {row['key']: row.get('value_fingerprint') for row in base}
+    other_fp = {row['key']: row.get('value_fingerprint') for row in other}
+
+    result = {"added": [], "removed": [], "changed": [], "identical": [], "unknown": []}
+    for key in sorted(base_fp.keys() | other_fp.keys()):
+        if key not in base_fp:
+            result["added"].append(key)
+        elif key not in other_fp:
+            result["removed"].append(key)
+        else:
+            a, b = base_fp[key], other_fp[key]
+            # Fingerprints start with the master key ID, so different keys never compare equal
+            if not a or not b or a.split(":", 1)[0] != b.split(":", 1)[0]:
+                result["unknown"].append(key)
+            elif a == b:
+                result["identical"].append(key)
+            else:
+                result["changed"].append(key)
+    return result
+
+# --- Changesets -----------------------------------------------------------------------------
+# Several set/rename/delete operations applied in one DB transaction by the
+# apply_secret_changes RPC (migrations/005_secret_changesets.sql): one round trip, one
+# content_version bump, one audit record, and readers never see half an edit.
+
+class SecretChange(BaseModel):
+    op: Literal["set", "rename", "delete"]
+    key: str
+    value: Optional[str] = None     # set
+    new_key: Optional[str] = None   # rename
+
+class SecretChangeset(BaseModel):
+    changes: List[SecretChange] = Field(..., min_length=1, max_length=500)
+    # Optional optimistic check against vaults.content_version (409 if the vault moved on)
+    expected_version: Optional[int] = None
+
+# Postgres error codes raised by apply_secret_changes -> HTTP status
+_CHANGESET_ERRORS = {"P0002": 404, "42501": 403, "23505": 409, "40001": 409, "22023": 400}
+
+@router.post("/vaults/{vault_id}/changes")
+@roundtrip_budget(3)
+@fair_share
+@route_class("crypto")
+def apply_changes(vault_id: str, changeset: SecretChangeset, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+    if not client:
+         raise HTTPException(status_code=503, detail="DB unavailable")
+
+    payload = []
+    try:
+        for change in changeset.changes:
+            if change.op == "set":
+                if change.value is None:
+                    raise HTTPException(status_code=400, detail=f"set {change.key}: value is required")
+                enc = encrypt_value(change.value)
+                payload.append({
+                    "op": "set",
+                    "key": change.key,
+                    "value_encrypted": enc['value'],
+                    "encrypted_key": enc['key'],
+                    "value_fingerprint": fingerprint_value(change.value) if settings.VALUE_FINGERPRINTS else None,
+                })
+            elif change.op == "rename":
+                if not change.new_key:
+                    raise HTTPException(status_code=400, detail=f"rename {change.key}: new_key is required")
+                payload.append({"op": "rename", "key": change.key, "new_key": change.new_key})
+            else:
+                payload.append({"op": "delete", "key": change.key})
+    except ValueError:
+        raise HTTPException(status_code=500, detail="Encryption configuration error")
+
+    try:
+        result = client.rpc("apply_secret_changes", {
+            "p_vault_id": vault_id,
+            "p_changes": payload,
+            "p_actor": user.id,
+            "p_expected_version": changeset.expected_version,
+        }).execute().data
+    except Exception as e:
+        code = getattr(e, "code", None)
+        if code == "PGRST202":
+            raise HTTPException(status_code=501, detail="Changesets need migrations/005_secret_changesets.sql")
+        if code in _CHANGESET_ERRORS:
+            raise HTTPException(status_code=_CHANGESET_ERRORS[code], detail=getattr(e, "message", str(e)))
+        raise api_error(e)
+
+    bundles.schedule_rebuild(vault_id)
+    bus.publish("vault", vault_id)
+
+    summary = ", ".join(
+        f"{len(result[k])} {k}" for k in ("created", "updated", "renamed", "deleted") if result.get(k)
+    )
+    log_audit_event(
+        client=client,
+        action="UPDATED",
+        description=f"Applied changeset to vault {result['vault_name']}: {summary or 'no changes'}",
+        team_id=result['team_id'],
+        resource_id=vault_id,
+        resource_type="vault",
+        actor_id=user.id,
+        actor_name=user.email.split('@')[0],
+        actor_type="user",
+        ip_address=request.client.host,
+        user_agent=request.headers.get("user-agent"),
+        metadata={k: result.get(k, []) for k in ("created", "updated", "renamed", "deleted")}
+    )
+    return {
+        "content_version": result['content_version'],
+        "created": result['created'],
+        "updated": result['updated'],
+        "renamed": result['renamed'],
+        "deleted": result['deleted'],
+    }
 
 @router.get("/secrets/{secret_id}/reveal")
+@roundtrip_budget(4)
 @limiter.limit("10/minute")
+@fair_share
+@route_class("crypto")
 def reveal_secret(secret_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -430,6 +854,8 @@ def reveal_secret(secret_id: str, request: Request, user = Depends(get_current_u
             raise HTTPException(status_code=404, detail="Secret not found")
             
         secret = response.data[0]
+        if secret.get('storage') == 'chunked':
+            raise HTTPException(status_code=400, detail=f"This is a file secret; download it from /api/secrets/{secret_id}/file")
         
         try:
             decrypted = decrypt_value(secret['value_encrypted'], secret['encrypted_key'])
@@ -460,9 +886,10 @@ def reveal_secret(secret_id: str, request: Request, user = Depends(get_current_u
             "value": decrypted
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.delete("/secrets/{secret_id}")
+@roundtrip_budget(5)
 def delete_secret(secret_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -475,6 +902,8 @@ def delete_secret(secret_id: str, request: Request, user = Depends(get_current_u
         
         # Delete
         client.table("secrets").delete().eq("id", secret_id).execute()
+        bundles.schedule_rebuild(secret_info['vault_id'])
+        bus.publish("vault", secret_info['vault_id'])
         
         # Audit
         vault_res = client.table("vaults").select("team_id, name").eq("id", secret_info['vault_id']).execute()
@@ -496,13 +925,14 @@ def delete_secret(secret_id: str, request: Request, user = Depends(get_current_u
             
         return {"success": True}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 class SecretUpdate(BaseModel):
     key: str | None = None
     value: str | None = None
 
 @router.patch("/secrets/{secret_id}")
+@roundtrip_budget(5)
 def update_secret(secret_id: str, update: SecretUpdate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     if not client:
          raise HTTPException(status_code=503, detail="DB unavailable")
@@ -515,6 +945,8 @@ def update_secret(secret_id: str, update: SecretUpdate, request: Request, user =
             enc_res = encrypt_value(update.value)
             updates['value_encrypted'] = enc_res['value']
             updates['encrypted_key'] = enc_res['key']
+            if settings.VALUE_FINGERPRINTS:
+                updates['value_fingerprint'] = fingerprint_value(update.value)
         except Exception:
              raise HTTPException(status_code=500, detail="Encryption failed")
 
@@ -540,6 +972,8 @@ def update_secret(secret_id: str, update: SecretUpdate, request: Request, user =
              raise HTTPException(status_code=403, detail="Update failed: Secret not found or permission denied")
 
         updated_row = response.data[0]
+        bundles.schedule_rebuild(current_data['vault_id'])
+        bus.publish("vault", current_data['vault_id'])
         
         # Audit
         vault_res = client.table("vaults").select("team_id, name").eq("id", current_data['vault_id']).execute()
@@ -570,13 +1004,56 @@ def update_secret(secret_id: str, update: SecretUpdate, request: Request, user =
             "version": updated_row['version']
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
+
+def _decrypt_rows(rows):
+    """Decrypts secret rows into a key/value map. Returns (values, all_ok)."""
+    out = {}
+    all_ok = True
+    for row in rows:
+        try:
+            val = decrypt_value(row['value_encrypted'], row.get('encrypted_key'))
+            out[row['key']] = val
+        except Exception as e:
+             all_ok = False
+             out[row['key']] = f"ERROR: Decryption failed - {str(e)}"
+    return out, all_ok
+
+def _fetch_and_decrypt(client, vault_id: str):
+    secrets_res = client.table("secrets").select("key, value_encrypted, encrypted_key").eq("vault_id", vault_id).execute()
+    return _decrypt_rows(secrets_res.data)
+
+_fetch_flights = SingleFlight("service_fetch")
+
+def _find_token_vault(client, vault_identifier: str, team_id: str, select: str = "*"):
+    """Resolves a service token's vault by ID, falling back to a partial name match."""
+    # Try ID first
+    try:
+        vault_res = client.table("vaults").select(select).eq("id", vault_identifier).eq("team_id", team_id).execute()
+    except:
+        vault_res = None
+        
+    if not vault_res or not vault_res.data:
+        # Try Name search
+        vault_res = client.table("vaults")\
+            .select(select)\
+            .eq("team_id", team_id)\
+            .ilike("name", f"%{vault_identifier}%")\
+            .execute()
+            
+    if not vault_res.data:
+        raise HTTPException(status_code=404, detail=f"Vault '{vault_identifier}' not found in your team")
+    return vault_res.data[0]
 
-@router.get("/service/vaults/{vault_identifier}/secrets")
+@router.get("/service/vaults/{vault_identifier}/secrets", response_model=Dict[str, Optional[str]])
+@roundtrip_budget(6)
 @limiter.limit("60/minute")
+@fair_share
+@route_class("crypto")
 def fetch_secrets_external(
     vault_identifier: str, 
     request: Request, 
+    background_tasks: BackgroundTasks,
     service_token: dict = Depends(get_valid_service_token)
 ):
     """
@@ -584,54 +1061,78 @@ def fetch_secrets_external(
     vault_identifier can be a Vault ID or partial Name (e.g. 'prod').
     Authentication is handled by get_valid_service_token dependency.
     """
-    if not supabase:
+    if not get_supabase():
         raise HTTPException(status_code=503, detail="DB unavailable")
     
     # Use Admin client to bypass RLS since Service Tokens are trusted machine access
-    client = supabase_admin if supabase_admin else supabase
+    primary = get_supabase_admin() or get_supabase()
+    # Reads go to a healthy read replica when one is configured (see replicas.py)
+    client = read_admin_client() or primary
+
+    # With bundles enabled the vault row comes back with its bundle embedded (same round trip)
+    vault_select = bundles.BUNDLE_SELECT if settings.VAULT_BUNDLES else "*"
+    team_id = service_token['team_id']
 
     # 2. Find Vault
-    # Try ID first
-    try:
-        vault_res = client.table("vaults").select("*").eq("id", vault_identifier).eq("team_id", service_token['team_id']).execute()
-    except:
-        vault_res = None
-        
-    if not vault_res or not vault_res.data:
-        # Try Name search
-        vault_res = client.table("vaults")\
-            .select("*")\
-            .eq("team_id", service_token['team_id'])\
-            .ilike("name", f"%{vault_identifier}%")\
-            .execute()
-            
-    if not vault_res.data:
-        raise HTTPException(status_code=404, detail=f"Vault '{vault_identifier}' not found in your team")
-    
-    target_vault = vault_res.data[0]
+    # Concurrent fetches of the same vault (e.g. a deploy starting many pods) are coalesced:
+    # one caller does the lookup, the reads and the decrypt, the others share its result.
+    target_vault, _ = _fetch_flights.do(
+        ("vault", team_id, vault_identifier, vault_select, client is primary),
+        lambda: _find_token_vault(client, vault_identifier, team_id, vault_select),
+    )
+    if client is not primary and replica_router.is_sticky(target_vault['id']):
+        # Written moments ago (e.g. a deploy right after an edit): the replica may not have it yet
+        client = primary
+        target_vault = _find_token_vault(client, target_vault['id'], team_id, vault_select)
+    token_usage.record_vault(service_token['id'], target_vault['id'])
+    version = target_vault.get('content_version')
     
     # 3. Check Token Scope
     # If scope is READ_ONLY or READ_WRITE or ADMIN, we allow read.
     # Future: IF scope is WRITE_ONLY, deny.
     
     # 4. Fetch & Decrypt
-    secrets_res = client.table("secrets").select("*").eq("vault_id", target_vault['id']).execute()
-    
-    out = {}
-    for row in secrets_res.data:
-        try:
-            val = decrypt_value(row['value_encrypted'], row.get('encrypted_key'))
-            out[row['key']] = val
-        except Exception as e:
-             out[row['key']] = f"ERROR: Decryption failed - {str(e)}"
+    if settings.VAULT_BUNDLES:
+        # content_version changes on every write to the vault, so it is the validator
+        etag = make_etag(target_vault['id'], version)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        def load():
+            out = bundles.read_bundle(target_vault)
+            if out is not None:
+                return out, False
+            out, all_ok = _fetch_and_decrypt(client, target_vault['id'])
+            return out, all_ok
+
+        (out, needs_store), leader = _fetch_flights.do(("bundle", team_id, target_vault['id'], version), load)
+        if needs_store and leader:
+            # Tagged with the version read before the rows; built after the response is sent
+            background_tasks.add_task(bundles.store_bundle, target_vault['id'], version, out)
+    else:
+        def load_rows():
+            rows = client.table("secrets").select("*").eq("vault_id", target_vault['id']).execute().data
+            etag = make_etag(target_vault['id'], *sorted(
+                f"{row['id']}:{row.get('version')}:{row.get('updated_at')}:{row['key']}" for row in rows
+            ))
+            return rows, etag
+
+        (rows, etag), _ = _fetch_flights.do(("rows", team_id, target_vault['id'], version), load_rows)
+
+        # Conditional fetch: agents/CI revalidate with If-None-Match. Nothing is decrypted or
+        # revealed on a match, so we skip the decrypt loop and the audit write.
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        (out, _), _ = _fetch_flights.do(("decrypt", etag), lambda: _decrypt_rows(rows))
             
     # Log Audit for Machine Access
+    # Every caller is still audited individually; rows are bulk inserted in the background
     try:
         log_audit_event(
-            client=client,
+            client=primary,
             action="REVEALED",
             description=f"Fetched secrets for vault {target_vault['name']} via Service Token",
-            team_id=service_token['team_id'],
+            team_id=team_id,
             resource_id=target_vault['id'],
             resource_type="vault",
             actor_id=None, # No user ID for tokens
@@ -639,9 +1140,360 @@ def fetch_secrets_external(
             actor_type="bot",
             ip_address=request.client.host,
             user_agent=request.headers.get("user-agent"),
-            metadata={"token_id": service_token['id']}
+            metadata={"token_id": service_token['id']},
+            batched=True
         )
     except Exception as e:
         print(f"Failed to log audit for bot: {e}")
 
-    return out
+    return FastJSONResponse(out, headers={"ETag": etag})
+
+_UUID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+MAX_MERGED_VAULTS = 10
+
+def _find_token_vaults(client, identifiers: List[str], team_id: str, select: str = "*") -> List[dict]:
+    """
+    Resolves several vault identifiers with one query, with the same rules as
+    _find_token_vault: exact ID first, else name (an exact name wins over a partial match).
+    """
+    def quoted(value: str) -> str:
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    ids = [i for i in identifiers if _UUID.match(i)]
+    conditions = [f"name.ilike.{quoted('*' + i + '*')}" for i in identifiers]
+    if ids:
+        conditions.append(f"id.in.({','.join(ids)})")
+    rows = client.table("vaults").select(select).eq("team_id", team_id).or_(",".join(conditions)).execute().data
+
+    resolved, missing = [], []
+    for identifier in identifiers:
+        lowered = identifier.lower()
+        match = next((r for r in rows if r['id'] == identifier), None) \
+            or next((r for r in rows if (r.get('name') or "").lower() == lowered), None) \
+            or next((r for r in sorted(rows, key=lambda r: r.get('name') or "") if lowered in (r.get('name') or "").lower()), None)
+        if match is None:
+            missing.append(identifier)
+        else:
+            resolved.append(match)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Vault(s) not found in your team: {', '.join(missing)}")
+    return resolved
+
+@router.get("/service/secrets")
+@roundtrip_budget(5)
+@limiter.limit("60/minute")
+@fair_share
+@route_class("crypto")
+def fetch_merged_secrets_external(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    vaults: str = Query(..., description="Comma separated vault IDs or names, lowest precedence first"),
+    service_token: dict = Depends(get_valid_service_token)
+):
+    """
+    Fetch and merge the secrets of several vaults with one Service Token call, e.g.
+    `?vaults=shared,api,prod`. A key defined in several vaults takes the value from the one
+    listed last. `sources` names the vault each key came from.
+    """
+    if not get_supabase():
+        raise HTTPException(status_code=503, detail="DB unavailable")
+
+    identifiers = list(dict.fromkeys(v.strip() for v in vaults.split(",") if v.strip()))
+    if not identifiers:
+        raise HTTPException(status_code=400, detail="No vaults given")
+    if len(identifiers) > MAX_MERGED_VAULTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_MERGED_VAULTS} vaults per request")
+
+    primary = get_supabase_admin() or get_supabase()
+    client = read_admin_client() or primary
+    vault_select = bundles.BUNDLE_SELECT if settings.VAULT_BUNDLES else "*"
+    team_id = service_token['team_id']
+
+    targets, _ = _fetch_flights.do(
+        ("vaults", team_id, tuple(identifiers), vault_select, client is primary),
+        lambda: _find_token_vaults(client, identifiers, team_id, vault_select),
+    )
+    if client is not primary and any(replica_router.is_sticky(v['id']) for v in targets):
+        client = primary
+        targets = _find_token_vaults(client, [v['id'] for v in targets], team_id, vault_select)
+    # The same vault named twice (by ID and by name) only counts once, at its last position
+    targets = list({v['id']: v for v in reversed(targets)}.values())[::-1]
+    for vault in targets:
+        token_usage.record_vault(service_token['id'], vault['id'])
+    versions = tuple((v['id'], v.get('content_version')) for v in targets)
+
+    def merged_etag(validators):
+        # Order matters: the same vaults in another order merge differently
+        return make_etag("merged", *(f"{vid}:{validators[vid]}" for vid, _ in versions))
+
+    if settings.VAULT_BUNDLES:
+        # content_version changes on every write, so it validates each vault before any read
+        etag = merged_etag(dict(versions))
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    def load():
+        """Per-vault value maps, row-based validators (without bundles) and bundles to build."""
+        values, validators, needs_store, to_read = {}, {}, [], []
+        for vault in targets:
+            out = bundles.read_bundle(vault) if settings.VAULT_BUNDLES else None
+            if out is not None:
+                values[vault['id']] = out
+            else:
+                to_read.append(vault['id'])
+        if to_read:
+            # Every vault without a fresh bundle in one read, decrypted in one pass
+            rows = client.table("secrets").select("*").in_("vault_id", to_read).execute().data
+            by_vault = {vid: [] for vid in to_read}
+            for row in rows:
+                by_vault[row['vault_id']].append(row)
+            for vid, vault_rows in by_vault.items():
+                out, all_ok = _decrypt_rows(vault_rows)
+                values[vid] = out
+                if settings.VAULT_BUNDLES:
+                    if all_ok:
+                        needs_store.append(vid)
+                else:
+                    validators[vid] = make_etag(vid, *sorted(
+                        f"{row['id']}:{row.get('version')}:{row.get('updated_at')}:{row['key']}" for row in vault_rows
+                    ))
+        return values, validators, needs_store
+
+    (values, validators, needs_store), leader = _fetch_flights.do(
+        ("merged", team_id, versions, client is primary), load
+    )
+    if needs_store and leader:
+        by_id = {v['id']: v for v in targets}
+        for vid in needs_store:
+            background_tasks.add_task(bundles.store_bundle, vid, by_id[vid].get('content_version'), values[vid])
+
+    if not settings.VAULT_BUNDLES:
+        etag = merged_etag(validators)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+    merged, sources = {}, {}
+    for vault in targets:
+        for key, value in values[vault['id']].items():
+            merged[key] = value
+            sources[key] = vault['name']
+
+    for vault in targets:
+        try:
+            log_audit_event(
+                client=primary,
+                action="REVEALED",
+                description=f"Fetched secrets for vault {vault['name']} via Service Token (merged fetch)",
+                team_id=team_id,
+                resource_id=vault['id'],
+                resource_type="vault",
+                actor_id=None,
+                actor_name=service_token['name'],
+                actor_type="bot",
+                ip_address=request.client.host,
+                user_agent=request.headers.get("user-agent"),
+                metadata={"token_id": service_token['id']},
+                batched=True
+            )
+        except Exception as e:
+            print(f"Failed to log audit for bot: {e}")
+
+    return FastJSONResponse({
+        "secrets": merged,
+        "sources": sources,
+        "vaults": [{"id": v['id'], "name": v['name']} for v in targets],
+    }, headers={"ETag": etag})
+
+
+# --- File secrets --------------------------------------------------------------------------
+# Large values (TLS bundles, kubeconfigs, service-account JSON) are uploaded as a raw request
+# body and stored as independently encrypted chunks (see chunks.py), so neither direction
+# ever holds the whole value in memory. File secrets appear as null in JSON secret fetches.
+
+def _require_file_secrets():
+    if not settings.FILE_SECRETS:
+        raise HTTPException(status_code=404, detail="File secrets are not enabled")
+
+def _file_etag(secret: dict) -> str:
+    # blob_id changes on every upload, so it identifies the content
+    return make_etag(secret['id'], secret['blob_id'])
+
+def _stream_file(secret: dict, etag: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks.iter_plaintext(secret),
+        media_type="application/octet-stream",
+        headers={
+            "ETag": etag,
+            "Content-Length": str(secret['size_bytes']),
+            "Content-Disposition": f'attachment; filename="{secret["key"]}"',
+        },
+    )
+
+_FILE_COLUMNS = "id, vault_id, key, version, encrypted_key, storage, blob_id, size_bytes, chunk_count, compression"
+
+@router.put("/vaults/{vault_id}/files/{key}")
+@roundtrip_budget(6 + chunks.max_batches())
+async def upload_file_secret(
+    vault_id: str,
+    key: str,
+    request: Request,
+    compression: str = "zlib",
+    user = Depends(get_current_user),
+    client = Depends(get_scoped_client)
+):
+    """
+    Creates or replaces a file secret from the raw request body (streamed).
+    Use compression=none for content that is already compressed.
+    """
+    _require_file_secrets()
+    if not client:
+         raise HTTPException(status_code=503, detail="DB unavailable")
+    if compression not in chunks.COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"compression must be one of {', '.join(chunks.COMPRESSIONS)}")
+
+    def lookup():
+        # RLS: user must at least see the vault before we accept a body
+        vault_res = client.table("vaults").select("id, team_id, name").eq("id", vault_id).execute()
+        if not vault_res.data:
+            raise HTTPException(status_code=404, detail="Vault not found")
+        existing = client.table("secrets").select("id, version").eq("vault_id", vault_id).eq("key", key).execute()
+        return vault_res.data[0], (existing.data[0] if existing.data else None)
+
+    vault_info, existing = await run_in_threadpool(lookup)
+
+    writer = chunks.ChunkWriter(compression)
+    try:
+        columns = await chunks.write_stream(writer, request.stream())
+    except chunks.FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Upload failed: {e}")
+
+    def save():
+        # The row write goes through the scoped client, so RLS decides whether the user may
+        # write to this vault; a rejected write discards the uploaded chunks.
+        if existing:
+            res = client.table("secrets").update({**columns, "version": existing['version'] + 1}).eq("id", existing['id']).execute()
+        else:
+            res = client.table("secrets").insert({**columns, "vault_id": vault_id, "key": key, "created_by": user.id}).execute()
+        if not res.data:
+            writer.abort()
+            raise HTTPException(status_code=403, detail="Upload failed: permission denied")
+        return res.data[0]
+
+    try:
+        saved = await run_in_threadpool(save)
+    except HTTPException:
+        raise
+    except Exception as e:
+        await run_in_threadpool(writer.abort)
+        raise api_error(e)
+
+    bundles.schedule_rebuild(vault_id)
+    bus.publish("vault", vault_id)
+    await run_in_threadpool(
+        log_audit_event,
+        client=client,
+        action="UPDATED" if existing else "CREATED",
+        description=f"{'Replaced' if existing else 'Uploaded'} file secret {key} ({columns['size_bytes']} bytes) in vault {vault_info['name']}",
+        team_id=vault_info['team_id'],
+        resource_id=saved['id'],
+        resource_type="secret",
+        actor_id=user.id,
+        actor_name=user.email.split('@')[0],
+        actor_type="user",
+        ip_address=request.client.host,
+        user_agent=request.headers.get("user-agent")
+    )
+    return {
+        "id": saved['id'],
+        "key": saved['key'],
+        "version": saved['version'],
+        "size_bytes": columns['size_bytes'],
+        "chunk_count": columns['chunk_count'],
+    }
+
+@router.get("/secrets/{secret_id}/file")
+@roundtrip_budget(4 + chunks.max_batches())
+@limiter.limit("10/minute")
+def download_file_secret(secret_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+    _require_file_secrets()
+    if not client:
+         raise HTTPException(status_code=503, detail="DB unavailable")
+    try:
+        # RLS: "Members can view secrets"
+        response = client.table("secrets").select(_FILE_COLUMNS).eq("id", secret_id).execute()
+    except Exception as e:
+        raise api_error(e)
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Secret not found")
+    secret = response.data[0]
+    if secret.get('storage') != 'chunked':
+        raise HTTPException(status_code=400, detail="Not a file secret; use /reveal")
+
+    etag = _file_etag(secret)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    vault_res = client.table("vaults").select("team_id, name").eq("id", secret['vault_id']).execute()
+    if vault_res.data:
+        vault_info = vault_res.data[0]
+        log_audit_event(
+            client=client,
+            action="REVEALED",
+            description=f"Downloaded file secret {secret['key']}",
+            team_id=vault_info['team_id'],
+            resource_id=secret_id,
+            resource_type="secret",
+            actor_id=user.id,
+            actor_name=user.email.split('@')[0],
+            actor_type="user",
+            ip_address=request.client.host,
+            user_agent=request.headers.get("user-agent")
+        )
+    return _stream_file(secret, etag)
+
+@router.get("/service/vaults/{vault_identifier}/files/{key}")
+@roundtrip_budget(5 + chunks.max_batches())
+@limiter.limit("60/minute")
+def fetch_file_external(
+    vault_identifier: str,
+    key: str,
+    request: Request,
+    service_token: dict = Depends(get_valid_service_token)
+):
+    """Streams one file secret using a Service Token (e.g. to write a kubeconfig in CI)."""
+    _require_file_secrets()
+    if not get_supabase():
+        raise HTTPException(status_code=503, detail="DB unavailable")
+    client = get_supabase_admin() or get_supabase()
+
+    target_vault = _find_token_vault(client, vault_identifier, service_token['team_id'])
+    token_usage.record_vault(service_token['id'], target_vault['id'])
+    secret_res = client.table("secrets").select(_FILE_COLUMNS).eq("vault_id", target_vault['id']).eq("key", key).execute()
+    if not secret_res.data or secret_res.data[0].get('storage') != 'chunked':
+        raise HTTPException(status_code=404, detail=f"File secret '{key}' not found in vault")
+    secret = secret_res.data[0]
+
+    etag = _file_etag(secret)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        log_audit_event(
+            client=client,
+            action="REVEALED",
+            description=f"Fetched file secret {key} from vault {target_vault['name']} via Service Token",
+            team_id=service_token['team_id'],
+            resource_id=secret['id'],
+            resource_type="secret",
+            actor_id=None,
+            actor_name=service_token['name'],
+            actor_type="bot",
+            ip_address=request.client.host,
+            user_agent=request.headers.get("user-agent"),
+            metadata={"token_id": service_token['id']}
+        )
+    except Exception as e:
+        print(f"Failed to log audit for bot: {e}")
+    return _stream_file(secret, etag)
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
 import secrets
+from datetime import datetime, timedelta, timezone
 from typing import List
-from ..dependencies import get_current_user, get_scoped_client
+from ..config import settings
+from ..dependencies import get_current_user, get_scoped_client, get_supabase, get_supabase_admin
 from ..crypto import hash_token
 from ..utils import log_audit_event
+from ..roundtrips import roundtrip_budget
+from ..resilience import api_error
+from ..token_usage import token_usage
+from ..invalidation import bus
+from ..idempotency import idempotent
+from ..conditional import conditional
 
 router = APIRouter()
 
@@ -14,6 +22,8 @@ class TokenCreate(BaseModel):
     team_id: str
 
 @router.post("/tokens")
+@roundtrip_budget(5)  # +2 for a shared Idempotency-Key claim and record
+@idempotent
 def create_service_token(token_req: TokenCreate, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # 1. Generate Raw Token (env_live_...)
@@ -64,10 +74,12 @@ def create_service_token(token_req: TokenCreate, request: Request, user = Depend
             "raw_token": raw_token # The only time user sees this
         }
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
 
 @router.get("/tokens")
-def list_tokens(team_id: str, user = Depends(get_current_user), client = Depends(get_scoped_client)):
+@roundtrip_budget(3)
+@conditional("tokens", "team_id")
+def list_tokens(team_id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # RLS "Members can view service tokens" should work.
         # But we need to filter by team_id?
@@ -76,11 +88,54 @@ def list_tokens(team_id: str, user = Depends(get_current_user), client = Depends
         # Usually frontend asks "Give me tokens for Team X".
         
         response = client.table("service_tokens").select("*").eq("team_id", team_id).eq("is_active", True).execute()
-        return response.data
+        # request_count / last_used_at / last_used_ip (migration 007) plus what this
+        # process hasn't flushed yet
+        return token_usage.overlay(response.data)
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
+
+@router.get("/tokens/{id}/usage")
+@roundtrip_budget(3)
+def get_token_usage(
+    id: str,
+    days: int = Query(30, ge=1, le=366),
+    user = Depends(get_current_user),
+    client = Depends(get_scoped_client)
+):
+    """Daily request counts, client IPs and vaults read for one service token."""
+    if not settings.TOKEN_USAGE:
+        raise HTTPException(status_code=404, detail="Token usage tracking is not enabled")
+    try:
+        # The user's own client decides whether they may see this token at all
+        token_res = client.table("service_tokens").select("*").eq("id", id).limit(1).execute()
+        if not token_res.data:
+            raise HTTPException(status_code=404, detail="Token not found")
+        token = token_usage.overlay(token_res.data)[0]
+
+        # service_token_usage has no RLS policies; it is read with the admin client after the check above
+        admin = get_supabase_admin() or get_supabase()
+        since = (datetime.now(timezone.utc).date() - timedelta(days=days - 1)).isoformat()
+        history = admin.table("service_token_usage")\
+            .select("day, requests, last_used_at, last_ip, vault_ids")\
+            .eq("token_id", id)\
+            .gte("day", since)\
+            .order("day", desc=True)\
+            .execute()
+
+        return {
+            "token_id": token['id'],
+            "name": token['name'],
+            "is_active": token.get('is_active'),
+            "request_count": token.get('request_count') or 0,
+            "last_used_at": token.get('last_used_at'),
+            "last_used_ip": token.get('last_used_ip'),
+            "days": history.data,
+        }
+    except Exception as e:
+        raise api_error(e)
 
 @router.delete("/tokens/{id}")
+@roundtrip_budget(3)
 def revoke_token(id: str, request: Request, user = Depends(get_current_user), client = Depends(get_scoped_client)):
     try:
         # RLS should prevent non-admins from deleting/updating if policy is set correctly.
@@ -92,6 +147,8 @@ def revoke_token(id: str, request: Request, user = Depends(get_current_user), cl
         # Let's lookup.
         if response.data:
             token_data = response.data[0]
+            # Other workers may still have this token cached as active
+            bus.publish("service_token", token_data.get('token_hash'))
             log_audit_event(
                 client=client,
                 action="REVOKED",
@@ -108,4 +165,4 @@ def revoke_token(id: str, request: Request, user = Depends(get_current_user), cl
 
         return {"status": "revoked"}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise api_error(e)
@@ -1,11 +1,20 @@
 from typing import Optional
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from ..dependencies import supabase, supabase_admin
+from ..config import settings
+from ..dependencies import get_supabase, get_supabase_admin
 from ..limiter import limiter
+from ..metrics import waitlist_signups_total
+from ..resilience import UpstreamUnavailable, is_upstream_error
+from ..roundtrips import roundtrip_budget
+from ..waitlist_intake import known_emails, normalize_email, waitlist_queue, write_entries
 
 router = APIRouter()
 
+ALREADY_JOINED = {"message": "You are already on the waitlist!"}
+JOINED = {"message": "Successfully joined the waitlist!", "status": "success"}
+
 class WaitlistEntry(BaseModel):
     email: EmailStr
     team_size: Optional[str] = None
@@ -13,39 +22,66 @@ class WaitlistEntry(BaseModel):
     current_tool_other: Optional[str] = None
     referral_source: Optional[str] = None
 
+def _join(client, row: dict) -> bool:
+    """Writes one signup; True if it was new."""
+    if not settings.WAITLIST_UPSERT:
+        # Without the unique index the check has to be a separate read
+        existing = client.table("waitlist").select("id").eq("email", row["email"]).execute()
+        if existing.data:
+            return False
+        if not write_entries(client, [row]):
+            raise HTTPException(status_code=500, detail="Failed to join waitlist")
+        return True
+    # Duplicates come back empty from the upsert
+    return bool(write_entries(client, [row]))
+
 @router.post("/waitlist")
+@roundtrip_budget(2)
 @limiter.limit("5/minute")
 async def join_waitlist(entry: WaitlistEntry, request: Request):
-    # Use admin client to bypass any RLS on insert if necessary, 
+    # Use admin client to bypass any RLS on insert if necessary,
     # but strictly speaking anon key should be able to insert if RLS allows it.
-    # To be safe and avoid opening public insert to anon, we'll use admin here 
+    # To be safe and avoid opening public insert to anon, we'll use admin here
     # and not enable RLS public insert policy, effectively making it a backend-only operation.
-    
-    client = supabase_admin if supabase_admin else supabase
+
+    email = normalize_email(entry.email)
+    if email in known_emails:
+        waitlist_signups_total.inc("known")
+        return ALREADY_JOINED
+
+    row = {
+        "email": email,
+        "team_size": entry.team_size,
+        "current_tool": entry.current_tool,
+        "current_tool_other": entry.current_tool_other,
+        "referral_source": entry.referral_source
+    }
+
+    if settings.WAITLIST_QUEUE_SIZE > 0 and settings.WAITLIST_UPSERT:
+        if not waitlist_queue.offer(row):
+            waitlist_signups_total.inc("rejected")
+            raise HTTPException(
+                status_code=503, detail="Too many signups right now, please retry shortly",
+                headers={"Retry-After": str(max(1, int(settings.WAITLIST_BATCH_INTERVAL * 4)))})
+        known_emails.add(email)
+        waitlist_signups_total.inc("queued")
+        return JOINED
+
+    client = get_supabase_admin() or get_supabase()
     if not client:
         raise HTTPException(status_code=503, detail="Database Service Unavailable")
 
     try:
-        # Check if email already exists
-        existing = client.table("waitlist").select("id").eq("email", entry.email).execute()
-        if existing.data:
-            return {"message": "You are already on the waitlist!"}
-
-        # Insert
-        response = client.table("waitlist").insert({
-            "email": entry.email,
-            "team_size": entry.team_size,
-            "current_tool": entry.current_tool,
-            "current_tool_other": entry.current_tool_other,
-            "referral_source": entry.referral_source
-        }).execute()
-        
-        if not response.data:
-            raise HTTPException(status_code=500, detail="Failed to join waitlist")
-            
-        return {"message": "Successfully joined the waitlist!", "status": "success"}
-
+        created = await run_in_threadpool(_join, client, row)
+    except HTTPException:
+        raise
     except Exception as e:
         # Log the error internally
         print(f"Waitlist error: {str(e)}")
+        if is_upstream_error(e):
+            raise UpstreamUnavailable()
         raise HTTPException(status_code=400, detail="Could not process request")
+
+    known_emails.add(email)
+    waitlist_signups_total.inc("created" if created else "duplicate")
+    return JOINED if created else ALREADY_JOINED
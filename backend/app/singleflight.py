@@ -0,0 +1,63 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+from .config import settings
+from .metrics import singleflight_requests_total
+
+# Request coalescing for identical concurrent reads.
+# When a deploy starts many pods with the same service token, they all ask for the same
+# vault at once. The first caller for a key (the leader) runs the work; callers arriving
+# while it is in flight wait and receive the same result (or exception) instead of
+# repeating the lookups and decrypt loop. Nothing is cached: once the leader finishes the
+# key is released, so a waiter's data is at most one in-flight call older than its request.
+#
+# Sync routes run in the threadpool, so waiting is a plain threading.Event. A waiter gives
+# up after SINGLE_FLIGHT_WAIT seconds and runs the work itself, so a hung leader doesn't
+# pin every waiter's thread.
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Runs fn once per key among concurrent callers. Returns (result, is_leader)."""
+        if not settings.SINGLE_FLIGHT:
+            return fn(), True
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(settings.SINGLE_FLIGHT_WAIT):
+                singleflight_requests_total.inc(self.name, "timeout")
+                return fn(), True
+            singleflight_requests_total.inc(self.name, "waiter")
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        singleflight_requests_total.inc(self.name, "leader")
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, True
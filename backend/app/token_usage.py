@@ -0,0 +1,111 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from .config import settings
+
+# Service-token usage tracking (requires migrations/007_service_token_usage.sql).
+#
+# get_valid_service_token records every authenticated call here and the service routes add
+# the vault they read. Counts are kept in memory per process and written every
+# TOKEN_USAGE_FLUSH_INTERVAL seconds with a single RPC that adds them to service_tokens
+# (request_count, last_used_at, last_used_ip) and to the daily rows in service_token_usage,
+# so a fetch never pays for an extra write. Workers flush independently; the RPC adds
+# rather than overwrites, so their counts sum up. Counts not yet flushed when a process is
+# killed are lost; shutdown flushes.
+
+
+class _Usage:
+    __slots__ = ("requests", "last_used_at", "last_ip", "vault_ids")
+
+    def __init__(self):
+        self.requests = 0
+        self.last_used_at: Optional[datetime] = None
+        self.last_ip: Optional[str] = None
+        self.vault_ids = set()
+
+
+class TokenUsage:
+    def __init__(self):
+        self._pending: Dict[str, _Usage] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, token_id: str, ip: Optional[str] = None):
+        if not settings.TOKEN_USAGE:
+            return
+        with self._lock:
+            usage = self._pending.get(token_id)
+            if usage is None:
+                usage = self._pending[token_id] = _Usage()
+            usage.requests += 1
+            usage.last_used_at = datetime.now(timezone.utc)
+            if ip:
+                usage.last_ip = ip
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-usage", daemon=True)
+                self._thread.start()
+
+    def record_vault(self, token_id: str, vault_id: str):
+        if not settings.TOKEN_USAGE:
+            return
+        with self._lock:
+            usage = self._pending.get(token_id)
+            if usage is not None:
+                usage.vault_ids.add(vault_id)
+
+    def overlay(self, tokens: List[dict]) -> List[dict]:
+        """Adds this process's unflushed counts to token rows read from the DB."""
+        with self._lock:
+            for token in tokens:
+                usage = self._pending.get(token.get("id"))
+                if usage is None:
+                    continue
+                token["request_count"] = (token.get("request_count") or 0) + usage.requests
+                token["last_used_at"] = usage.last_used_at.isoformat()
+                token["last_used_ip"] = usage.last_ip or token.get("last_used_ip")
+        return tokens
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        payload = [
+            {
+                "token_id": token_id,
+                "requests": usage.requests,
+                "last_used_at": usage.last_used_at.isoformat(),
+                "last_ip": usage.last_ip,
+                "vault_ids": sorted(usage.vault_ids),
+            }
+            for token_id, usage in pending.items()
+        ]
+        # Imported here: dependencies records into this module
+        from .dependencies import get_supabase, get_supabase_admin
+        client = get_supabase_admin() or get_supabase()
+        try:
+            client.rpc("record_service_token_usage", {"p_usage": payload}).execute()
+        except Exception as e:
+            print(f"Failed to write usage for {len(pending)} service tokens, keeping it for the next flush: {e}")
+            self._restore(pending)
+
+    def _restore(self, pending: Dict[str, _Usage]):
+        with self._lock:
+            for token_id, old in pending.items():
+                usage = self._pending.get(token_id)
+                if usage is None:
+                    self._pending[token_id] = old
+                    continue
+                usage.requests += old.requests
+                usage.vault_ids |= old.vault_ids
+                usage.last_ip = usage.last_ip or old.last_ip
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.TOKEN_USAGE_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+
+token_usage = TokenUsage()
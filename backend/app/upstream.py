@@ -0,0 +1,76 @@
+import time
+import httpx
+from .metrics import upstream_requests_total, upstream_request_duration
+from .resilience import ResilientTransport
+from . import roundtrips
+
+# Shared HTTP layer for every Supabase client we create.
+# All PostgREST / GoTrue traffic goes through one pooled httpx.Client whose transport
+# records per-table, per-operation call counts and latency of each logical call; retries,
+# hedging and the circuit breaker sit underneath it (see resilience.py).
+
+_OPERATIONS = {
+    "GET": "select",
+    "HEAD": "select",
+    "POST": "insert",
+    "PATCH": "update",
+    "PUT": "upsert",
+    "DELETE": "delete",
+}
+
+
+def classify_request(request: httpx.Request):
+    """
+    Maps a Supabase HTTP request to (service, table, operation).
+    e.g. GET /rest/v1/vaults -> ("postgrest", "vaults", "select")
+         POST /rest/v1/rpc/fn -> ("postgrest", "fn", "rpc")
+         GET /auth/v1/user -> ("auth", "user", "get")
+    """
+    parts = request.url.path.strip("/").split("/")
+    method = request.method
+
+    if len(parts) >= 3 and parts[0] == "rest":
+        if parts[2] == "rpc" and len(parts) >= 4:
+            return "postgrest", parts[3], "rpc"
+        operation = _OPERATIONS.get(method, method.lower())
+        if method == "POST" and "resolution=" in request.headers.get("prefer", ""):
+            operation = "upsert"
+        return "postgrest", parts[2], operation
+
+    if len(parts) >= 3 and parts[0] == "auth":
+        return "auth", "/".join(parts[2:4]) if parts[2] == "admin" else parts[2], method.lower()
+
+    return parts[0] if parts and parts[0] else "other", "", method.lower()
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """Wraps the real transport and records every Supabase round trip."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        service, table, operation = classify_request(request)
+        roundtrips.record(service, table, operation)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self._transport.handle_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            upstream_request_duration.observe(service, table, operation, value=time.perf_counter() - start)
+            upstream_requests_total.inc(service, table, operation, status)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def build_http_client() -> httpx.Client:
+    """
+    One pooled client shared by the anon, admin and per-request scoped Supabase clients.
+    Base URL and headers are supplied per request by postgrest/gotrue, so sharing is safe.
+    Per-call timeouts are set by ResilientTransport; the client default only covers the rest.
+    """
+    transport = InstrumentedTransport(ResilientTransport(httpx.HTTPTransport(http2=True)))
+    return httpx.Client(transport=transport, follow_redirects=True, timeout=120)
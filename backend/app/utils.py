@@ -1,6 +1,11 @@
-from typing import Optional, Dict, Any
+import time
+import hashlib
+import threading
+from typing import Optional, Dict, Any, List
 from fastapi import Request
-from .dependencies import supabase, supabase_admin
+from .config import settings
+from .dependencies import get_supabase, get_supabase_admin
+from .metrics import audit_write_duration, audit_batch_size
 
 # This helper function uses the provided client, OR prefers the supabase_admin client 
 # if available to ensure logs are written regardless of RLS policies for the user.
@@ -17,34 +22,109 @@ def log_audit_event(
     actor_type: str = "user", 
     ip_address: str = None,
     user_agent: str = None,
-    metadata: Dict[str, Any] = {}
+    metadata: Dict[str, Any] = {},
+    batched: bool = False
 ):
+    """
+    batched=True queues the event for the next bulk insert (see AuditBatcher) instead of
+    writing it inline; used on hot machine paths where one row per request adds up.
+    """
+    # Construct the detailed metadata blob
+    # We store the "snapshot" of actor details here because the core table 
+    # only has foreign keys which might change or be deleted.
+    enriched_metadata = {
+        **metadata,
+        "actor_name": actor_name,
+        "actor_type": actor_type,
+        "description": description,
+        "ip_address": ip_address,
+        "user_agent": user_agent
+    }
+
+    data = {
+        "team_id": team_id,
+        "actor_id": actor_id,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "metadata": enriched_metadata
+    }
+
+    if batched and settings.AUDIT_BATCH_INTERVAL > 0:
+        audit_batcher.add(data)
+        return
+
     # Prefer admin client to bypass RLS for audit logs
-    target_client = supabase_admin if supabase_admin else client
+    _write_audit_rows(get_supabase_admin() or client, data)
+
 
+def _write_audit_rows(target_client, rows) -> bool:
+    start = time.perf_counter()
+    outcome = "error"
     try:
-        # Construct the detailed metadata blob
-        # We store the "snapshot" of actor details here because the core table 
-        # only has foreign keys which might change or be deleted.
-        enriched_metadata = {
-            **metadata,
-            "actor_name": actor_name,
-            "actor_type": actor_type,
-            "description": description,
-            "ip_address": ip_address,
-            "user_agent": user_agent
-        }
-
-        data = {
-            "team_id": team_id,
-            "actor_id": actor_id,
-            "action": action,
-            "resource_type": resource_type,
-            "resource_id": resource_id,
-            "metadata": enriched_metadata
-        }
-        
-        target_client.table("audit_logs").insert(data).execute()
+        target_client.table("audit_logs").insert(rows).execute()
+        outcome = "ok"
     except Exception as e:
         print(f"FAILED TO LOG AUDIT EVENT: {e}")
+    finally:
+        audit_write_duration.observe(outcome, value=time.perf_counter() - start)
+    return outcome == "ok"
+
+
+class AuditBatcher:
+    """
+    Buffers audit rows and writes them with one bulk insert every AUDIT_BATCH_INTERVAL
+    seconds (or as soon as AUDIT_BATCH_MAX rows are waiting). The flusher thread starts on
+    first use; flush() is also called on shutdown so queued events are not lost.
+    """
+
+    def __init__(self):
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, row: dict):
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= settings.AUDIT_BATCH_MAX
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-batcher", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return
+        audit_batch_size.observe(value=len(rows))
+        client = get_supabase_admin() or get_supabase()
+        if client is None or not _write_audit_rows(client, rows):
+            print(f"Dropped {len(rows)} batched audit events")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.AUDIT_BATCH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+
+audit_batcher = AuditBatcher()
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given validator parts (ids, versions, timestamps...)."""
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:32]
+    return f'W/"{digest}"'
 
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header covers this ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    # Weak comparison: W/"x" and "x" are equivalent for If-None-Match
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return "*" in candidates or any((c[2:] if c.startswith("W/") else c) == bare for c in candidates)
@@ -0,0 +1,173 @@
+import time
+import queue
+import hashlib
+import threading
+from typing import List, Optional
+from .config import settings
+from .dependencies import get_supabase, get_supabase_admin
+from .metrics import waitlist_signups_total, waitlist_batch_size
+
+# Waitlist ingestion for launch-day bursts.
+#
+#   - known_emails: digests of every email already on the waitlist, loaded in the background
+#     at startup. A repeat signup is answered from memory without touching the database.
+#     The set is per process, so a signup taken by another worker is not in it; that case
+#     falls through to the upsert, which ignores the duplicate.
+#   - WAITLIST_UPSERT: one `INSERT ... ON CONFLICT (email) DO NOTHING` instead of a select
+#     followed by an insert (needs the unique index from migrations/006_waitlist_unique_email.sql).
+#   - WAITLIST_QUEUE_SIZE > 0 (with WAITLIST_UPSERT): signups are accepted into a bounded
+#     queue and bulk upserted by a background thread every WAITLIST_BATCH_INTERVAL seconds.
+#     When the queue is full the route answers 503 with Retry-After instead of piling more
+#     load on the database.
+#     Shutdown flushes the queue; signups still queued when a process is killed are lost.
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+def _admin_client():
+    return get_supabase_admin() or get_supabase()
+
+
+class KnownEmails:
+    """
+    Set of 8-byte BLAKE2b digests of known emails (~70 bytes each instead of the full string).
+    64-bit digests can collide: with n known emails a new address is taken for a known one
+    with probability about n / 2**64 (~5e-14 at a million), and gets "already on the
+    waitlist" without being stored.
+    """
+
+    def __init__(self):
+        self._digests = set()
+        self.loaded = False
+
+    @staticmethod
+    def _digest(email: str) -> bytes:
+        return hashlib.blake2b(email.encode("utf-8"), digest_size=8).digest()
+
+    def __contains__(self, email: str) -> bool:
+        return self._digest(email) in self._digests
+
+    def add(self, email: str):
+        if len(self._digests) < settings.WAITLIST_KNOWN_MAX:
+            self._digests.add(self._digest(email))
+
+    def discard(self, email: str):
+        self._digests.discard(self._digest(email))
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def load(self, client=None, page_size: int = 1000):
+        """Pages through the waitlist by id; stops early at WAITLIST_KNOWN_MAX."""
+        client = client or _admin_client()
+        if client is None:
+            return
+        last_id = None
+        try:
+            while len(self._digests) < settings.WAITLIST_KNOWN_MAX:
+                query = client.table("waitlist").select("id, email").order("id").limit(page_size)
+                if last_id is not None:
+                    query = query.gt("id", last_id)
+                rows = query.execute().data
+                for row in rows:
+                    if row.get("email"):
+                        self.add(normalize_email(row["email"]))
+                if len(rows) < page_size:
+                    break
+                last_id = rows[-1]["id"]
+            self.loaded = True
+            print(f"Loaded {len(self._digests)} known waitlist emails")
+        except Exception as e:
+            print(f"Warning: could not load known waitlist emails: {e}")
+
+    def load_in_background(self):
+        threading.Thread(target=self.load, name="waitlist-preload", daemon=True).start()
+
+
+known_emails = KnownEmails()
+
+
+def write_entries(client, rows: List[dict]) -> List[dict]:
+    """Writes waitlist rows; returns the ones that were new (duplicates are skipped under WAITLIST_UPSERT)."""
+    if settings.WAITLIST_UPSERT:
+        return client.table("waitlist").upsert(rows, on_conflict="email", ignore_duplicates=True).execute().data
+    return client.table("waitlist").insert(rows).execute().data
+
+
+class WaitlistQueue:
+    """
+    Bounded buffer of signups drained by a background thread in bulk upserts. The thread
+    starts on first use; flush() is called on shutdown.
+    """
+
+    RETRIES = 3
+
+    def __init__(self):
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max(1, settings.WAITLIST_QUEUE_SIZE))
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def offer(self, row: dict) -> bool:
+        """Queues a signup; False if the queue is full."""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            return False
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="waitlist-writer", daemon=True)
+                    self._thread.start()
+        return True
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _take(self, first: Optional[dict] = None) -> List[dict]:
+        rows = [first] if first else []
+        while len(rows) < settings.WAITLIST_BATCH_MAX:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def flush(self):
+        with self._write_lock:
+            while True:
+                rows = self._take()
+                if not rows:
+                    return
+                self._write(rows)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            # Holding the lock while the burst accumulates makes a concurrent flush() wait
+            # for this batch instead of returning while it is still in hand
+            with self._write_lock:
+                time.sleep(settings.WAITLIST_BATCH_INTERVAL)
+                self._write(self._take(first))
+
+    def _write(self, rows: List[dict]):
+        waitlist_batch_size.observe(value=len(rows))
+        client = _admin_client()
+        for attempt in range(self.RETRIES):
+            try:
+                # Safe to retry: duplicates are ignored by the upsert
+                write_entries(client, rows)
+                return
+            except Exception as e:
+                error = e
+                time.sleep(0.2 * (2 ** attempt))
+        print(f"Dropped {len(rows)} queued waitlist signups: {error}")
+        waitlist_signups_total.inc("dropped", amount=len(rows))
+        # Let these people sign up again instead of being told they are already on the list
+        for row in rows:
+            known_emails.discard(row["email"])
+
+
+waitlist_queue = WaitlistQueue()
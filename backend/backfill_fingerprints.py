@@ -0,0 +1,80 @@
+import argparse
+import time
+from app.config import settings
+from app.crypto import decrypt_value, new_fingerprint, format_fingerprint, fingerprint_value, get_master_key, key_id
+from app.dependencies import get_supabase, get_supabase_admin
+from app import chunks
+
+# Fills in secrets.value_fingerprint for rows written before fingerprints were enabled
+# (or under a previous master key). Requires migrations/004_value_fingerprints.sql and the
+# service role key.
+#
+# Unlike the diff itself this has to decrypt each value once. Updates are conditional on
+# the row's version, so a value edited while the job runs is left to the API's own write.
+#
+#   python backfill_fingerprints.py --dry-run
+#   python backfill_fingerprints.py --batch-size 200
+
+_COLUMNS = "id, version, value_encrypted, encrypted_key, value_fingerprint"
+
+
+def _fingerprint(row) -> str:
+    if row.get("storage") == "chunked":
+        h = new_fingerprint()
+        for data in chunks.iter_plaintext(row):
+            h.update(data)
+        return format_fingerprint(h)
+    return fingerprint_value(decrypt_value(row["value_encrypted"], row.get("encrypted_key")))
+
+
+def backfill(batch_size: int, dry_run: bool, pause: float):
+    client = get_supabase_admin() or get_supabase()
+    current_prefix = key_id(get_master_key()).hex() + ":"
+    columns = _COLUMNS + (", storage, blob_id, chunk_count, compression" if settings.FILE_SECRETS else "")
+    last_id = None
+    scanned = filled = skipped = failed = 0
+
+    while True:
+        query = client.table("secrets").select(columns).order("id").limit(batch_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+
+        for row in rows:
+            scanned += 1
+            if (row.get("value_fingerprint") or "").startswith(current_prefix):
+                continue
+            try:
+                fingerprint = _fingerprint(row)
+            except Exception as e:
+                failed += 1
+                print(f"Cannot fingerprint secret {row['id']}: {e}")
+                continue
+            if dry_run:
+                filled += 1
+                continue
+            res = client.table("secrets").update({"value_fingerprint": fingerprint})\
+                .eq("id", row["id"]).eq("version", row["version"]).execute()
+            if res.data:
+                filled += 1
+            else:
+                skipped += 1
+
+        print(f"... scanned {scanned}, filled {filled}, skipped {skipped}, failed {failed}")
+        if pause:
+            time.sleep(pause)
+
+    action = "Would fill" if dry_run else "Filled"
+    print(f"{action} {filled} of {scanned} fingerprints ({skipped} changed concurrently, {failed} failed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill secret value fingerprints")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+    backfill(args.batch_size, args.dry_run, args.pause)
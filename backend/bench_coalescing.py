@@ -0,0 +1,69 @@
+"""
+Request coalescing check for service-token fetches.
+
+Fires N concurrent GET /api/service/vaults/{vault}/secrets requests at the in-process app
+(against the Supabase project in .env) with SINGLE_FLIGHT on and off, and prints the
+Supabase calls made per table. With coalescing the vault/secrets reads should stay close
+to one per wave instead of one per request; audit rows are one bulk insert per flush.
+
+Usage: SERVICE_TOKEN=evt_... python bench_coalescing.py <vault id or name> [concurrency]
+"""
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.main import app
+from app.metrics import upstream_requests_total, singleflight_requests_total
+from app.utils import audit_batcher
+
+
+def upstream_calls():
+    counts = Counter()
+    for (service, table, operation, status), value in upstream_requests_total.snapshot().items():
+        counts[f"{operation} {table}"] += int(value)
+    return counts
+
+
+def wave(client, vault, token, concurrency):
+    barrier = threading.Barrier(concurrency)
+    statuses = Counter()
+
+    def worker():
+        barrier.wait()
+        r = client.get(f"/api/service/vaults/{vault}/secrets", headers={"Authorization": f"Bearer {token}"})
+        statuses[r.status_code] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    before = upstream_calls()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    audit_batcher.flush()
+    return upstream_calls() - before, statuses, elapsed
+
+
+def main():
+    token = os.getenv("SERVICE_TOKEN")
+    if len(sys.argv) < 2 or not token:
+        sys.exit(__doc__)
+    vault = sys.argv[1]
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with TestClient(app) as client:
+        for enabled in (False, True):
+            settings.SINGLE_FLIGHT = enabled
+            calls, statuses, elapsed = wave(client, vault, token, concurrency)
+            print(f"\nSINGLE_FLIGHT={enabled}: {concurrency} requests in {elapsed:.2f}s, statuses {dict(statuses)}")
+            for name, count in sorted(calls.items()):
+                print(f"  {name:<32}{count:>6}")
+        print("\n" + "\n".join(line for line in singleflight_requests_total.collect() if not line.startswith("#")))
+
+
+if __name__ == "__main__":
+    main()
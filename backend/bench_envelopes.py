@@ -0,0 +1,46 @@
+"""
+Envelope format benchmark: legacy two-column rows (v1) vs the compact v2 envelope.
+
+Reports stored bytes per secret (both text columns, as PostgREST transfers them) and
+encode/decode throughput at several plaintext sizes.
+
+Usage: MASTER_ENCRYPTION_KEY=... python bench_envelopes.py
+"""
+import os
+import base64
+import time
+from app.config import settings
+from app import crypto
+
+
+def _bench(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(version, plaintext, iterations):
+    settings.ENVELOPE_VERSION = version
+    enc = crypto.encrypt_value(plaintext)
+    stored = len(enc["value"]) + len(enc["key"] or "")
+    encode_us = _bench(lambda: crypto.encrypt_value(plaintext), iterations)
+    decode_us = _bench(lambda: crypto.decrypt_value(enc["value"], enc["key"]), iterations)
+    return stored, encode_us, decode_us
+
+
+def main():
+    if not settings.MASTER_ENCRYPTION_KEY:
+        settings.MASTER_ENCRYPTION_KEY = base64.b64encode(os.urandom(32)).decode()
+
+    print(f"{'size':>8} {'fmt':>4} {'stored B':>9} {'overhead':>9} {'encode us':>10} {'decode us':>10}")
+    for size in (16, 64, 256, 4096, 65536):
+        plaintext = "x" * size
+        iterations = 2000 if size <= 4096 else 200
+        for version in (1, 2):
+            stored, enc_us, dec_us = run(version, plaintext, iterations)
+            print(f"{size:>8} {'v' + str(version):>4} {stored:>9} {stored - size:>9} {enc_us:>10.1f} {dec_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
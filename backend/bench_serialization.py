@@ -0,0 +1,80 @@
+"""
+Serialization / compression benchmark for the large API payloads.
+
+Compares FastAPI's default path (jsonable_encoder + stdlib json, uncompressed) with
+FastJSONResponse (orjson) plus gzip/brotli compression, on synthetic audit-log pages,
+vault lists and service-token secret bundles.
+
+Usage: python bench_serialization.py
+"""
+import json
+import time
+import uuid
+import random
+import string
+from fastapi.encoders import jsonable_encoder
+from app.responses import FastJSONResponse, orjson
+from app.compression import compress, brotli
+
+
+def _rand(n):
+    return "".join(random.choices(string.ascii_letters + string.digits, k=n))
+
+
+def audit_page(n=1000):
+    logs = []
+    for i in range(n):
+        meta = {
+            "actor_name": _rand(8), "actor_type": "user", "description": f"Revealed secret {_rand(12).upper()}",
+            "ip_address": "10.0.%d.%d" % (i % 255, i % 200), "user_agent": "Mozilla/5.0 (X11; Linux x86_64) Chrome/120.0",
+        }
+        logs.append({
+            "id": str(uuid.uuid4()), "created_at": "2025-01-01T00:00:%02d.000000+00:00" % (i % 60), "action": "REVEALED",
+            "team_id": str(uuid.uuid4()), "actor_id": str(uuid.uuid4()), **meta, "metadata": meta,
+        })
+    return logs
+
+
+def vault_list(n=500):
+    return [{
+        "id": str(uuid.uuid4()), "team_id": str(uuid.uuid4()), "name": f"vault-{i}", "description": _rand(40),
+        "color": "#7c3aed", "icon": "lock", "created_at": "2025-01-01T00:00:00+00:00", "secrets_count": i % 40,
+    } for i in range(n)]
+
+
+def secret_bundle(n=300):
+    return {f"{_rand(6).upper()}_{i}": _rand(64) for i in range(n)}
+
+
+def default_render(payload):
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_render(payload):
+    return FastJSONResponse(payload).body
+
+
+def bench(fn, payload, rounds=50):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        out = fn(payload)
+    return (time.perf_counter() - start) / rounds * 1000, out
+
+
+def main():
+    print(f"orjson: {'yes' if orjson else 'no (stdlib fallback)'}, brotli: {'yes' if brotli else 'no'}\n")
+    print(f"{'payload':<16}{'default ms':>12}{'fast ms':>10}{'raw bytes':>12}{'gzip':>10}{'gzip ms':>9}{'br':>10}{'br ms':>8}")
+    for name, payload in (("audit page", audit_page()), ("vault list", vault_list()), ("secret bundle", secret_bundle())):
+        default_ms, raw = bench(default_render, payload)
+        fast_ms, fast_raw = bench(fast_render, payload)
+        gzip_ms, gz = bench(lambda b: compress(b, "gzip"), fast_raw, rounds=20)
+        if brotli is not None:
+            br_ms, br = bench(lambda b: compress(b, "br"), fast_raw, rounds=20)
+            br_cols = f"{len(br):>10}{br_ms:>8.2f}"
+        else:
+            br_cols = f"{'-':>10}{'-':>8}"
+        print(f"{name:<16}{default_ms:>12.2f}{fast_ms:>10.2f}{len(raw):>12}{len(gz):>10}{gzip_ms:>9.2f}{br_cols}")
+
+
+if __name__ == "__main__":
+    main()
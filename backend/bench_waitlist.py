@@ -0,0 +1,93 @@
+"""
+Waitlist signup load test.
+
+Sends N signups with unique addresses (bench-<run>-<i>@example.com) from C concurrent
+clients to the in-process app, then the same addresses again, and prints signups per
+second, response statuses and Supabase calls for both waves. Runs against the Supabase
+project in .env with the rate limiter disabled, using the WAITLIST_* settings from the
+environment, e.g. compare:
+
+    python bench_waitlist.py 2000 50
+    WAITLIST_UPSERT=true WAITLIST_QUEUE_SIZE=5000 python bench_waitlist.py 2000 50
+
+The benchmark rows are deleted at the end unless --keep is given.
+
+Usage: python bench_waitlist.py [signups] [concurrency] [--keep]
+"""
+import sys
+import time
+import uuid
+import threading
+from collections import Counter
+from fastapi.testclient import TestClient
+from app.config import settings
+from app.dependencies import get_supabase, get_supabase_admin
+from app.limiter import limiter
+from app.main import app
+from app.metrics import upstream_requests_total, waitlist_signups_total
+from app.waitlist_intake import waitlist_queue
+
+
+def upstream_calls():
+    counts = Counter()
+    for (service, table, operation, status), value in upstream_requests_total.snapshot().items():
+        counts[f"{operation} {table}"] += int(value)
+    return counts
+
+
+def wave(client, emails, concurrency):
+    pending = list(emails)
+    lock = threading.Lock()
+    statuses = Counter()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                email = pending.pop()
+            r = client.post("/api/waitlist", json={"email": email, "referral_source": "bench"})
+            with lock:
+                statuses[r.status_code] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    before = upstream_calls()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    # Queued signups count once they are written
+    waitlist_queue.flush()
+    drained = time.perf_counter() - start
+    return statuses, elapsed, drained, upstream_calls() - before
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    signups = int(args[0]) if args else 1000
+    concurrency = int(args[1]) if len(args) > 1 else 50
+    run = uuid.uuid4().hex[:8]
+    emails = [f"bench-{run}-{i}@example.com" for i in range(signups)]
+    limiter.enabled = False
+
+    print(f"WAITLIST_UPSERT={settings.WAITLIST_UPSERT} WAITLIST_QUEUE_SIZE={settings.WAITLIST_QUEUE_SIZE} "
+          f"WAITLIST_BATCH_MAX={settings.WAITLIST_BATCH_MAX}")
+    with TestClient(app) as client:
+        for name in ("new", "repeat"):
+            statuses, elapsed, drained, calls = wave(client, emails, concurrency)
+            print(f"\n{name}: {signups} signups, {concurrency} clients: {signups / elapsed:,.0f}/s answered, "
+                  f"{signups / drained:,.0f}/s written ({drained:.2f}s), statuses {dict(statuses)}")
+            for op, count in sorted(calls.items()):
+                print(f"  {op:<32}{count:>6}")
+        print("\n" + "\n".join(line for line in waitlist_signups_total.collect() if not line.startswith("#")))
+
+        if "--keep" not in sys.argv:
+            db = get_supabase_admin() or get_supabase()
+            db.table("waitlist").delete().like("email", f"bench-{run}-%").execute()
+            print(f"\nDeleted bench-{run}-* rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,700 @@
 import os
+import re
+import ast
+import sys
+import argparse
+from collections import Counter
+from typing import Dict, List, Optional, Set
 from dotenv import load_dotenv
-from supabase import create_client
+
+# Schema and index advisor.
+#
+# Reads every Supabase query the code builds (client.table(...).eq(...).order(...) chains in
+# app/, including queries assembled over several statements), reduces each to its shape -
+# equality filters, range filter, sort - and checks the schema for an index that serves it.
+# Also checks the natural keys the code relies on being unique (UNIQUE_KEYS), upsert
+# on_conflict targets, and foreign keys without an index on the referencing side.
+#
+# The schema comes from a live database (DATABASE_URL, needs psycopg) or from SQL files:
+# a `pg_dump --schema-only` dump, optionally followed by the migrations that are not in it.
+# Missing indexes are written out as migration SQL.
+#
+#   python check_schema.py --shapes                          # what the code queries
+#   python check_schema.py --sql schema.sql migrations/*.sql  # check a dump
+#   python check_schema.py --output migrations/009_query_indexes.sql
+#   python check_schema.py --verify                          # try the SQL on a local database
+#
+# --verify applies the generated SQL inside a transaction on DATABASE_URL (use a local copy
+# of the schema), EXPLAINs each query shape as a generic plan with sequential scans
+# disabled to show which index it would use, and rolls everything back.
 
 load_dotenv()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+SCHEMA = "public"
+
+# Columns the code treats as unique (it looks a row up by them, or checks for an existing
+# row before inserting) without relying on the database to enforce it.
+UNIQUE_KEYS = {
+    "service_tokens": [("token_hash",)],
+    "vault_access": [("vault_id", "user_id")],
+    "team_members": [("team_id", "user_id")],
+    "vaults": [("team_id", "name")],
+    "secrets": [("vault_id", "key")],
+    "waitlist": [("email",)],
+}
+
+_EQ = {"eq", "in_", "is_", "contains"}
+_RANGE = {"gt", "gte", "lt", "lte"}
+_OTHER = {"neq", "like", "ilike", "not_", "filter", "or_", "text_search", "overlaps"}
+_WRITES = {"update", "delete", "upsert", "insert"}
+
+
+class Shape:
+    """One query shape: which columns of a table a query filters and sorts on."""
+
+    def __init__(self, table: str):
+        self.table = table
+        self.eq: List[str] = []
+        self.range: Optional[str] = None
+        self.order: List[str] = []
+        self.other: List[str] = []
+        self.op = "select"
+        self.conflict: Optional[List[str]] = None
+        self.sites: List[str] = []
+        self.variants: List["Shape"] = []
+
+    def copy(self) -> "Shape":
+        shape = Shape(self.table)
+        shape.eq, shape.order, shape.other = list(self.eq), list(self.order), list(self.other)
+        shape.range, shape.op, shape.conflict = self.range, self.op, self.conflict
+        return shape
+
+    @property
+    def sort(self) -> Optional[str]:
+        return self.range or (self.order[0] if self.order else None)
+
+    def key(self):
+        return (self.table, frozenset(self.eq), self.sort, frozenset(self.other), self.conflict and tuple(sorted(self.conflict)))
+
+    def describe(self) -> str:
+        if self.conflict:
+            return f"{self.table} upsert on ({', '.join(self.conflict)})"
+        parts = [f"{c} =" for c in self.eq]
+        if self.range:
+            parts.append(f"{self.range} range")
+        if self.order and self.order[0] != self.range:
+            parts.append(f"order by {self.order[0]}")
+        parts += [f"{c} (not indexable)" for c in self.other]
+        return f"{self.table}: {', '.join(parts) or 'full scan'}"
+
+
+# --- Query shapes from the code ---------------------------------------------------------------
+
+def _const(node) -> Optional[str]:
+    return node.value if isinstance(node, ast.Constant) and isinstance(node.value, str) else None
+
+
+def _chain(node):
+    """Unwraps client.table(..).a(..).b(..) into (root, [(method, call), ...]) innermost first."""
+    # ...execute().data[0]
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    calls = []
+    while isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        calls.append((node.func.attr, node))
+        node = node.func.value
+    return node, list(reversed(calls))
+
+
+def _embeds(select: str):
+    """Embedded resources in a PostgREST select: [(alias, table, inner)]."""
+    return re.findall(r"(?:(\w+):)?(\w+)(!inner)?\s*\(", select)
+
+
+class QueryScanner(ast.NodeVisitor):
+    def __init__(self, path: str):
+        self.path = path
+        self.shapes: List[Shape] = []
+        self._vars: Dict[str, Shape] = {}
+        self._depth: Dict[str, int] = {}
+        self._cond = 0
+
+    def _site(self, node) -> str:
+        return f"{self.path}:{node.lineno}"
 
-if not SUPABASE_KEY:
-    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+    def _apply(self, shape: Shape, calls, aliases: Dict[str, str]) -> bool:
+        executed = False
+        for method, call in calls:
+            arg = _const(call.args[0]) if call.args else None
+            if method == "select" and arg:
+                for alias, table, inner in _embeds(arg):
+                    aliases[alias or table] = table
+                    embedded = Shape(table)
+                    if alias and alias == table.rstrip("s"):
+                        # Many-to-one (team:teams): joined on this table's <alias>_id
+                        if inner:
+                            embedded = Shape(shape.table)
+                            embedded.eq = [f"{alias}_id"]
+                        else:
+                            continue
+                    else:
+                        # One-to-many (secrets(count) on vaults): the child's <parent>_id
+                        embedded.eq = [f"{shape.table.rstrip('s')}_id"]
+                    embedded.sites.append(self._site(call))
+                    self.shapes.append(embedded)
+            elif method in _WRITES:
+                shape.op = method
+                if method == "upsert":
+                    conflict = next((_const(k.value) for k in call.keywords if k.arg == "on_conflict"), None)
+                    if conflict:
+                        shape.conflict = [c.strip() for c in conflict.split(",")]
+            elif method == "match" and call.args and isinstance(call.args[0], ast.Dict):
+                shape.eq += [k for k in map(_const, call.args[0].keys) if k]
+            elif arg and (method in _EQ or method in _RANGE or method in _OTHER or method == "order"):
+                target = shape
+                if "." in arg:
+                    # Filter on an embedded resource (vault.team_id)
+                    alias, arg = arg.split(".", 1)
+                    target = Shape(aliases.get(alias, alias))
+                    target.sites.append(self._site(call))
+                    self.shapes.append(target)
+                if method in _EQ:
+                    target.eq.append(arg)
+                elif method in _RANGE:
+                    target.range = target.range or arg
+                elif method == "order":
+                    target.order.append(arg)
+                else:
+                    target.other.append(arg)
+            elif method == "execute":
+                executed = True
+        return executed
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    def _query(self, node):
+        """Returns (shapes, root variable, executed) if node builds a query, else None."""
+        root, calls = _chain(node)
+        methods = [m for m, _ in calls]
+        bases = None
+        if "table" in methods:
+            i = methods.index("table")
+            table = _const(calls[i][1].args[0]) if calls[i][1].args else None
+            if table is None:
+                return None
+            bases, calls, var = [Shape(table)], calls[i + 1:], None
+        elif isinstance(root, ast.Name) and root.id in self._vars and calls:
+            base = self._vars[root.id]
+            bases, var = [base] + base.variants, root.id
+        if bases is None:
+            return None
+        shapes = []
+        for base in bases:
+            shape = base.copy()
+            executed = self._apply(shape, calls, {})
+            if executed:
+                shape.sites.append(self._site(node))
+                if shape.eq or shape.sort or shape.other or shape.conflict:
+                    self.shapes.append(shape)
+            shapes.append(shape)
+        return shapes, var, executed
 
-def check_structure():
-    print("--- Checking Vaults Structure ---")
-    try:
-        res = supabase.table("vaults").select("*").limit(1).execute()
-        if res.data:
-            print("Vault Columns:", res.data[0].keys())
+    def visit_FunctionDef(self, node):
+        saved = self._vars, self._depth
+        self._vars, self._depth = {}, {}
+        self.generic_visit(node)
+        self._vars, self._depth = saved
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _conditional(self, node):
+        self._cond += 1
+        self.generic_visit(node)
+        self._cond -= 1
+
+    visit_If = visit_For = visit_While = _conditional
+
+    def visit_Assign(self, node):
+        result = self._query(node.value)
+        if result is None:
+            return self.generic_visit(node)
+        shapes, var, executed = result
+        target = node.targets[0]
+        if executed or len(node.targets) != 1 or not isinstance(target, ast.Name):
+            return
+        if var == target.id and self._cond > self._depth.get(var, 0):
+            # query = query.eq(...) inside an if: an optional filter, kept as a variant
+            self._vars[var].variants.append(shapes[0])
         else:
-            print("No vaults found, can't check columns easily without metadata query.")
-    except Exception as e:
-        print(f"Error checking vaults: {e}")
-
-    print("\n--- Checking Team Members Structure ---")
-    try:
-        res = supabase.table("team_members").select("*").limit(1).execute()
-        if res.data:
-            print("Team Member Columns:", res.data[0].keys())
-    except Exception as e:
-         print(f"Error checking members: {e}")
-
-    print("\n--- Checking Vault Access Structure ---")
-    try:
-        res = supabase.table("vault_access").select("*").limit(1).execute()
-        if res.data:
-            print("Vault Access Columns:", res.data[0].keys())
+            self._vars[target.id] = shapes[0]
+            self._depth[target.id] = self._cond
+
+    def visit_Call(self, node):
+        if self._query(node) is None:
+            self.generic_visit(node)
+
+
+def scan_code(paths: List[str]) -> List[Shape]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names) if n.endswith(".py")]
         else:
-            print("Vault Access table exists but is empty.")
-    except Exception as e:
-         print(f"Error checking vault_access: {e}")
+            files.append(path)
+    merged: Dict[tuple, Shape] = {}
+    for path in sorted(files):
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        scanner = QueryScanner(os.path.relpath(path))
+        scanner.visit(tree)
+        for shape in scanner.shapes:
+            existing = merged.get(shape.key())
+            if existing is None:
+                merged[shape.key()] = shape
+            else:
+                existing.sites += [s for s in shape.sites if s not in existing.sites]
+                existing.other += [c for c in shape.other if c not in existing.other]
+    return sorted(merged.values(), key=lambda s: (s.table, s.describe()))
+
+
+# --- Schema ------------------------------------------------------------------------------------
+
+class Index:
+    def __init__(self, table: str, columns: List[str], unique: bool = False, name: str = "",
+                 partial: bool = False, method: str = "btree", planned: bool = False):
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.name = name or f"{table}_{'_'.join(columns)}_idx"
+        self.partial = partial
+        self.method = method
+        self.planned = planned
+
+    def describe(self) -> str:
+        kind = "unique " if self.unique else ""
+        return f"{kind}{self.name} ({', '.join(self.columns)})"
+
+
+class Schema:
+    def __init__(self):
+        self.columns: Dict[str, Set[str]] = {}
+        self.indexes: List[Index] = []
+        self.foreign_keys: List[tuple] = []
+
+    def add_index(self, index: Index):
+        self.indexes = [i for i in self.indexes if i.name != index.name]
+        self.indexes.append(index)
+
+    def table_indexes(self, table: str) -> List[Index]:
+        return [i for i in self.indexes if i.table == table and not i.partial and i.method == "btree"]
+
+
+def _ident(name: str) -> str:
+    name = name.strip().strip('"')
+    if "." in name:
+        schema, _, name = name.partition(".")
+        name = name.strip('"')
+        if schema.strip('"') != SCHEMA:
+            return f"{schema.strip(chr(34))}.{name}"
+    return name
+
+
+def _split_top(body: str) -> List[str]:
+    items, depth, start = [], 0, 0
+    for i, c in enumerate(body):
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            items.append(body[start:i].strip())
+            start = i + 1
+    items.append(body[start:].strip())
+    return [i for i in items if i]
+
+
+def _paren(text: str, start: int) -> str:
+    """Body of the parenthesis opening at text[start]."""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i]
+    return text[start + 1:]
+
+
+def _columns(body: str) -> List[str]:
+    """Index key columns, up to the first expression."""
+    columns = []
+    for item in _split_top(body):
+        match = re.match(r'^("[^"]+"|\w+)(\s+\w+)*$', item)
+        if not match:
+            break
+        columns.append(_ident(match.group(1)))
+    return columns
+
+
+def split_statements(sql: str) -> List[str]:
+    statements, buf, i = [], [], 0
+    dollar = re.compile(r"\$(\w*)\$")
+    while i < len(sql):
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            i = len(sql) if end < 0 else end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = len(sql) if end < 0 else end + 2
+        elif sql[i] == "'":
+            end = i + 1
+            while end < len(sql) and (sql[end] != "'" or sql.startswith("''", end)):
+                end += 2 if sql.startswith("''", end) else 1
+            buf.append(sql[i:end + 1])
+            i = end + 1
+        elif sql[i] == "$" and dollar.match(sql, i):
+            tag = dollar.match(sql, i).group(0)
+            end = sql.find(tag, i + len(tag))
+            end = len(sql) if end < 0 else end + len(tag)
+            buf.append(sql[i:end])
+            i = end
+        elif sql[i] == ";":
+            statements.append(" ".join("".join(buf).split()))
+            buf, i = [], i + 1
+        else:
+            buf.append(sql[i])
+            i += 1
+    statements.append(" ".join("".join(buf).split()))
+    return [s for s in statements if s]
+
+
+_NAME = r'((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)'
+_CREATE_TABLE = re.compile(r"^CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?" + _NAME + r"\s*\(", re.I)
+_CREATE_INDEX = re.compile(
+    r"^CREATE\s+(UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(?!ON\s)(\S+\s+)?ON\s+(?:ONLY\s+)?"
+    + _NAME + r"\s*(?:USING\s+(\w+)\s*)?\(", re.I)
+_ALTER_TABLE = re.compile(r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?" + _NAME + r"\s+(.*)$", re.I)
+_DROP_INDEX = re.compile(r"^DROP\s+INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+EXISTS\s+)?" + _NAME, re.I)
+_CONSTRAINT = re.compile(
+    r"^(?:CONSTRAINT\s+(\S+)\s+)?(PRIMARY\s+KEY|UNIQUE|FOREIGN\s+KEY)\s*\(([^)]*)\)(?:.*?REFERENCES\s+" + _NAME + r")?", re.I)
+
+
+def _table_item(schema: Schema, table: str, item: str):
+    constraint = _CONSTRAINT.match(item)
+    if constraint:
+        name, kind, cols, ref = constraint.groups()
+        columns = [_ident(c) for c in cols.split(",")]
+        if kind.upper().startswith("FOREIGN"):
+            schema.foreign_keys.append((table, columns, _ident(ref or "")))
+        else:
+            suffix = "pkey" if kind.upper().startswith("PRIMARY") else f"{'_'.join(columns)}_key"
+            schema.add_index(Index(table, columns, unique=True, name=_ident(name or f"{table}_{suffix}")))
+        return
+    if re.match(r"^(CONSTRAINT|CHECK|EXCLUDE|LIKE)\b", item, re.I):
+        return
+    match = re.match(r'^(?:COLUMN\s+)?(?:IF\s+NOT\s+EXISTS\s+)?("[^"]+"|\w+)\s*(.*)$', item, re.I | re.S)
+    if not match:
+        return
+    column, rest = _ident(match.group(1)), match.group(2)
+    schema.columns.setdefault(table, set()).add(column)
+    if re.search(r"\bPRIMARY\s+KEY\b", rest, re.I):
+        schema.add_index(Index(table, [column], unique=True, name=f"{table}_pkey"))
+    elif re.search(r"\bUNIQUE\b", rest, re.I):
+        schema.add_index(Index(table, [column], unique=True, name=f"{table}_{column}_key"))
+    ref = re.search(r"\bREFERENCES\s+" + _NAME, rest, re.I)
+    if ref:
+        schema.foreign_keys.append((table, [column], _ident(ref.group(1))))
+
+
+def load_sql(paths: List[str]) -> Schema:
+    schema = Schema()
+    for path in paths:
+        with open(path) as f:
+            statements = split_statements(f.read())
+        for stmt in statements:
+            match = _CREATE_TABLE.match(stmt)
+            if match:
+                table = _ident(match.group(1))
+                schema.columns.setdefault(table, set())
+                for item in _split_top(_paren(stmt, match.end() - 1)):
+                    _table_item(schema, table, item)
+                continue
+            match = _CREATE_INDEX.match(stmt)
+            if match:
+                unique, name, table, method = match.groups()
+                body = _paren(stmt, match.end() - 1)
+                rest = stmt[match.end() + len(body):]
+                table = _ident(table)
+                schema.add_index(Index(
+                    table, _columns(body), unique=bool(unique), name=_ident(name or ""),
+                    partial=bool(re.search(r"\bWHERE\b", rest, re.I)), method=(method or "btree").lower(),
+                ))
+                continue
+            match = _ALTER_TABLE.match(stmt)
+            if match:
+                table = _ident(match.group(1))
+                for action in _split_top(match.group(2)):
+                    add = re.match(r"^ADD\s+(.*)$", action, re.I | re.S)
+                    if add:
+                        _table_item(schema, table, add.group(1))
+                    drop = re.match(r'^DROP\s+COLUMN\s+(?:IF\s+EXISTS\s+)?("[^"]+"|\w+)', action, re.I)
+                    if drop:
+                        schema.columns.get(table, set()).discard(_ident(drop.group(1)))
+                continue
+            match = _DROP_INDEX.match(stmt)
+            if match:
+                name = _ident(match.group(1))
+                schema.indexes = [i for i in schema.indexes if i.name != name]
+    return schema
+
+
+def load_database(dsn: str) -> Schema:
+    import psycopg  # optional dependency, only needed against a live database
+    schema = Schema()
+    with psycopg.connect(dsn) as conn:
+        for table, column in conn.execute(
+            "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = %s", (SCHEMA,)
+        ):
+            schema.columns.setdefault(table, set()).add(column)
+        for table, name, unique, partial, method, columns in conn.execute("""
+            SELECT t.relname, i.relname, ix.indisunique, ix.indpred IS NOT NULL, am.amname,
+                   ARRAY(SELECT a.attname FROM unnest(ix.indkey::int2[]) WITH ORDINALITY AS k(attnum, n)
+                         LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                         WHERE k.n <= ix.indnkeyatts ORDER BY k.n)
+            FROM pg_index ix
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            JOIN pg_namespace ns ON ns.oid = t.relnamespace
+            WHERE ns.nspname = %s
+        """, (SCHEMA,)):
+            # Expression columns come back as NULL; the index is usable up to the first one
+            columns = columns[:columns.index(None)] if None in columns else columns
+            schema.add_index(Index(table, columns, unique, name, partial, method))
+        for table, columns, ref in conn.execute("""
+            SELECT cl.relname,
+                   ARRAY(SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, n)
+                         JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum ORDER BY k.n),
+                   rt.relname
+            FROM pg_constraint c
+            JOIN pg_class cl ON cl.oid = c.conrelid
+            JOIN pg_class rt ON rt.oid = c.confrelid
+            JOIN pg_namespace ns ON ns.oid = cl.relnamespace
+            WHERE c.contype = 'f' AND ns.nspname = %s
+        """, (SCHEMA,)):
+            schema.foreign_keys.append((table, columns, ref))
+    return schema
+
+
+# --- Advice ------------------------------------------------------------------------------------
+
+def support(shape: Shape, indexes: List[Index]):
+    """('ok' | 'partial' | 'missing', best index, sort served)."""
+    eq = set(shape.eq)
+    best, best_len, best_sort = None, 0, False
+    for index in indexes:
+        cols = index.columns
+        if index.unique and cols and set(cols) <= eq:
+            return "ok", index, True  # at most one row
+        n = 0
+        while n < len(cols) and cols[n] in eq:
+            n += 1
+        sort = set(cols[:n]) == eq and n < len(cols) and cols[n] == shape.sort
+        if n + sort > best_len + best_sort:
+            best, best_len, best_sort = index, n, sort
+    if best is None:
+        return "missing", None, False
+    if set(best.columns[:best_len]) == eq and (best_sort or not shape.sort):
+        return "ok", best, best_sort
+    return "partial", best, best_sort
+
+
+def advise(shapes: List[Shape], schema: Schema):
+    """Returns (report lines, [(Index, reason, sites)] to create)."""
+    report, plans = [], []
+    unknown = set()
+
+    def exists(table, columns) -> bool:
+        if table not in schema.columns:
+            unknown.add(f"table {table}")
+            return False
+        missing = [c for c in columns if c not in schema.columns[table]]
+        for c in missing:
+            unknown.add(f"column {table}.{c}")
+        return not missing
+
+    # Uniqueness the code relies on, and upsert conflict targets (which Postgres requires)
+    wanted = [(t, list(k), "natural key", []) for t, keys in UNIQUE_KEYS.items() for k in keys]
+    wanted += [(s.table, s.conflict, "upsert on_conflict target", s.sites) for s in shapes if s.conflict]
+    seen = set()
+    for table, key, reason, sites in wanted:
+        if (table, frozenset(key)) in seen or not exists(table, key):
+            continue
+        seen.add((table, frozenset(key)))
+        match = next((i for i in schema.table_indexes(table) if i.unique and set(i.columns) == set(key)), None)
+        if match:
+            report.append(f"  ok       {table} unique ({', '.join(key)}): {match.describe()}")
+        else:
+            index = Index(table, key, unique=True, name=f"{table}_{'_'.join(key)}_key", planned=True)
+            plans.append((index, reason, sites))
+            report.append(f"  MISSING  {table} unique ({', '.join(key)}): {reason}")
+
+    # Foreign keys are looked up on the referencing side by cascades and by joins
+    fk_shapes = []
+    queried = {(s.table, frozenset(s.eq)) for s in shapes}
+    for table, columns, ref in schema.foreign_keys:
+        if (table, frozenset(columns)) in queried:
+            continue
+        shape = Shape(table)
+        shape.eq = list(columns)
+        shape.sites.append(f"foreign key to {ref}")
+        fk_shapes.append(shape)
+
+    # Most used columns first, so one index serves several shapes through its prefix
+    usage = Counter((s.table, c) for s in shapes for c in set(s.eq))
+    for shape in shapes + fk_shapes:
+        if shape.conflict or (not shape.eq and not shape.sort):
+            continue
+        if not exists(shape.table, shape.eq + ([shape.sort] if shape.sort else [])):
+            continue
+        indexes = schema.table_indexes(shape.table) + [p[0] for p in plans if p[0].table == shape.table]
+        status, index, _ = support(shape, indexes)
+        where = ", ".join(shape.sites[:3]) + (f" (+{len(shape.sites) - 3})" if len(shape.sites) > 3 else "")
+        via = f" via {index.describe()}" + (" (planned)" if index.planned else "") if index else ""
+        needs_sort = index is not None and set(index.columns[:len(shape.eq)]) == set(shape.eq)
+        if status == "ok":
+            report.append(f"  ok       {shape.describe()}{via}")
+            continue
+        if status == "partial" and not needs_sort:
+            report.append(f"  partial  {shape.describe()}{via}; the other filters are applied to its rows  [{where}]")
+            continue
+        columns = sorted(dict.fromkeys(shape.eq), key=lambda c: (-usage[(shape.table, c)], shape.eq.index(c)))
+        if shape.sort and shape.sort not in columns:
+            columns.append(shape.sort)
+        plans.append((Index(shape.table, columns, planned=True), shape.describe(), shape.sites))
+        report.append(f"  MISSING  {shape.describe()}{via}  [{where}]")
+
+    # Drop planned indexes that are a prefix of another planned one
+    kept = []
+    for index, reason, sites in plans:
+        covered = any(
+            other is not index and other.table == index.table and len(other.columns) > len(index.columns)
+            and other.columns[:len(index.columns)] == index.columns and (other.unique or not index.unique)
+            for other, _, _ in plans
+        )
+        if not covered:
+            kept.append((index, reason, sites))
+    for item in sorted(unknown):
+        report.append(f"  ?        {item} not in the schema (migration not applied?)")
+    return report, kept
+
+
+def migration_sql(plans, concurrently: bool = False) -> str:
+    lines = [
+        "-- Indexes for the query shapes in the code (generated by check_schema.py)",
+        "--",
+        "-- Built without blocking writes when run with --concurrently (outside a transaction).",
+        "",
+    ]
+    for index, reason, sites in plans:
+        cols = ", ".join(index.columns)
+        name = index.name[:63]
+        lines.append(f"-- {index.table}({cols}): {reason}")
+        if sites:
+            lines.append(f"--   {', '.join(sites[:4])}")
+        if index.unique:
+            lines.append("-- Fails if duplicates exist; find them with:")
+            lines.append(f"--   SELECT {cols}, count(*) FROM {SCHEMA}.{index.table} GROUP BY {cols} HAVING count(*) > 1;")
+        kind = "UNIQUE INDEX" if index.unique else "INDEX"
+        how = " CONCURRENTLY" if concurrently else ""
+        lines.append(f"CREATE {kind}{how} IF NOT EXISTS {name} ON {SCHEMA}.{index.table} ({cols});")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _plan_indexes(plan) -> List[str]:
+    names = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        names += _plan_indexes(child)
+    return names
+
+
+def verify(dsn: str, sql: str, shapes: List[Shape]):
+    """EXPLAINs every shape with the generated indexes in place, then rolls back."""
+    import psycopg
+    with psycopg.connect(dsn) as conn:
+        try:
+            with conn.transaction():
+                conn.execute(sql)
+                conn.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                conn.execute("SET LOCAL enable_seqscan = off")
+                for n, shape in enumerate(s for s in shapes if s.eq or s.sort):
+                    where = [f"{c} = ${i + 1}" for i, c in enumerate(shape.eq)]
+                    if shape.range:
+                        where.append(f"{shape.range} >= ${len(where) + 1}")
+                    query = f"SELECT 1 FROM {SCHEMA}.{shape.table}"
+                    if where:
+                        query += " WHERE " + " AND ".join(where)
+                    if shape.sort:
+                        query += f" ORDER BY {shape.sort} LIMIT 100"
+                    try:
+                        with conn.transaction():
+                            conn.execute(f"PREPARE advisor_{n} AS {query}")
+                            args = ", ".join(["NULL"] * len(where))
+                            plan = conn.execute(f"EXPLAIN (FORMAT JSON) EXECUTE advisor_{n}({args})").fetchone()[0]
+                            conn.execute(f"DEALLOCATE advisor_{n}")
+                        used = _plan_indexes(plan[0]["Plan"])
+                        print(f"  {shape.describe():60} {', '.join(used) or 'NO INDEX'}")
+                    except psycopg.Error as e:
+                        print(f"  {shape.describe():60} error: {str(e).strip()}")
+                raise psycopg.Rollback()
+        except psycopg.Error as e:
+            sys.exit(f"Could not apply the generated SQL: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the schema for the indexes the code's queries need")
+    parser.add_argument("--sql", nargs="+", metavar="FILE", help="schema dump and/or migrations instead of a live database")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="default: DATABASE_URL")
+    parser.add_argument("--code", nargs="+", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")])
+    parser.add_argument("--shapes", action="store_true", help="only list the query shapes found in the code")
+    parser.add_argument("--output", help="write the migration SQL to this file instead of stdout")
+    parser.add_argument("--concurrently", action="store_true", help="CREATE INDEX CONCURRENTLY")
+    parser.add_argument("--verify", action="store_true", help="apply the SQL on DATABASE_URL in a rolled-back transaction and EXPLAIN each shape")
+    args = parser.parse_args()
+
+    shapes = scan_code(args.code)
+    if args.shapes:
+        for shape in shapes:
+            print(f"{shape.describe():70} {', '.join(shape.sites)}")
+        return
+
+    if args.sql:
+        schema = load_sql(args.sql)
+    elif args.database_url:
+        schema = load_database(args.database_url)
+    else:
+        sys.exit("Pass --sql FILE... (e.g. a pg_dump --schema-only dump) or set DATABASE_URL")
+
+    report, plans = advise(shapes, schema)
+    print(f"{len(shapes)} query shapes in the code, {len(schema.indexes)} indexes in the schema", file=sys.stderr)
+    print("\n".join(report), file=sys.stderr)
+    if not plans:
+        print("Nothing to add.", file=sys.stderr)
+
+    sql = migration_sql(plans, args.concurrently and not args.verify)
+    if args.verify:
+        if not args.database_url:
+            sys.exit("--verify needs DATABASE_URL")
+        print("\nIndex used by each shape with the SQL applied:", file=sys.stderr)
+        verify(args.database_url, sql, shapes)
+    elif args.output:
+        with open(args.output, "w") as f:
+            f.write(sql)
+        print(f"Wrote {len(plans)} indexes to {args.output}", file=sys.stderr)
+    elif plans:
+        print(sql)
+
 
 if __name__ == "__main__":
-    check_structure()
+    main()
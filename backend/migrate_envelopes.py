@@ -0,0 +1,64 @@
+import argparse
+import time
+from app.crypto import envelope_version, rewrap_v1_to_v2
+from app.dependencies import get_supabase, get_supabase_admin
+
+# Converts legacy two-column secrets to envelope format v2 in batches.
+# Requires migrations/002_envelope_v2.sql and the service role key.
+#
+# Only the data key is unwrapped and re-wrapped; secret plaintexts are never decrypted.
+# Each update is conditional on the old value_encrypted, so a row edited concurrently
+# (already re-encrypted by the API) is skipped rather than overwritten.
+#
+#   python migrate_envelopes.py --dry-run
+#   python migrate_envelopes.py --batch-size 500
+
+
+def migrate(batch_size: int, dry_run: bool, pause: float):
+    client = get_supabase_admin() or get_supabase()
+    last_id = None
+    scanned = converted = skipped = 0
+    saved_bytes = 0
+
+    while True:
+        query = client.table("secrets").select("id, value_encrypted, encrypted_key").order("id").limit(batch_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+
+        for row in rows:
+            scanned += 1
+            if envelope_version(row["value_encrypted"], row.get("encrypted_key")) != 1:
+                continue
+            new_value = rewrap_v1_to_v2(row["value_encrypted"], row["encrypted_key"])
+            saved_bytes += len(row["value_encrypted"]) + len(row["encrypted_key"]) - len(new_value)
+            if dry_run:
+                converted += 1
+                continue
+            res = client.table("secrets").update({
+                "value_encrypted": new_value,
+                "encrypted_key": None,
+            }).eq("id", row["id"]).eq("value_encrypted", row["value_encrypted"]).execute()
+            if res.data:
+                converted += 1
+            else:
+                skipped += 1
+
+        print(f"... scanned {scanned}, converted {converted}, skipped {skipped}")
+        if pause:
+            time.sleep(pause)
+
+    action = "Would convert" if dry_run else "Converted"
+    print(f"{action} {converted} of {scanned} secrets ({skipped} changed concurrently), saving ~{saved_bytes} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate secrets to envelope format v2")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.dry_run, args.pause)
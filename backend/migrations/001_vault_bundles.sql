@@ -0,0 +1,41 @@
+-- Precomputed encrypted vault bundles (see app/bundles.py)
+--
+-- vaults.content_version is bumped by a trigger on every insert/update/delete in
+-- public.secrets, whatever code path made the write. A bundle is only served when its
+-- content_version equals the vault's current one, so a stale bundle is never returned.
+
+ALTER TABLE public.vaults
+    ADD COLUMN IF NOT EXISTS content_version bigint NOT NULL DEFAULT 1;
+
+CREATE TABLE IF NOT EXISTS public.vault_bundles (
+    vault_id uuid PRIMARY KEY REFERENCES public.vaults(id) ON DELETE CASCADE,
+    content_version bigint NOT NULL,
+    value_encrypted text NOT NULL,
+    encrypted_key text NOT NULL,
+    built_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Bundles contain every secret of a vault; only the backend (service role) may touch them.
+ALTER TABLE public.vault_bundles ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION public.bump_vault_content_version()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.vaults SET content_version = content_version + 1 WHERE id = OLD.vault_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.vault_id IS DISTINCT FROM OLD.vault_id) THEN
+        UPDATE public.vaults SET content_version = content_version + 1 WHERE id = NEW.vault_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS secrets_bump_vault_content_version ON public.secrets;
+CREATE TRIGGER secrets_bump_vault_content_version
+    AFTER INSERT OR UPDATE OR DELETE ON public.secrets
+    FOR EACH ROW EXECUTE FUNCTION public.bump_vault_content_version();
@@ -0,0 +1,8 @@
+-- Compact envelope format v2 (see app/crypto.py)
+--
+-- v2 rows keep the whole envelope (header, wrapped data key, nonce, ciphertext) in
+-- value_encrypted and leave encrypted_key NULL. Legacy rows are untouched and remain
+-- readable; run `python migrate_envelopes.py` to convert them in batches.
+
+ALTER TABLE public.secrets ALTER COLUMN encrypted_key DROP NOT NULL;
+ALTER TABLE public.vault_bundles ALTER COLUMN encrypted_key DROP NOT NULL;
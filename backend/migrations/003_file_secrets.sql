@@ -0,0 +1,69 @@
+-- Chunked file secrets (see app/chunks.py)
+--
+-- A chunked secret keeps value_encrypted NULL, its wrapped data key in encrypted_key and
+-- its encrypted chunks in secret_chunks under blob_id. Uploads write a fresh blob and then
+-- repoint the row, so the triggers below are what clean up replaced or deleted blobs.
+
+ALTER TABLE public.secrets ALTER COLUMN value_encrypted DROP NOT NULL;
+ALTER TABLE public.secrets
+    ADD COLUMN IF NOT EXISTS storage text NOT NULL DEFAULT 'inline',
+    ADD COLUMN IF NOT EXISTS blob_id uuid,
+    ADD COLUMN IF NOT EXISTS size_bytes bigint,
+    ADD COLUMN IF NOT EXISTS chunk_count integer,
+    ADD COLUMN IF NOT EXISTS compression text;
+
+CREATE TABLE IF NOT EXISTS public.secret_chunks (
+    blob_id uuid NOT NULL,
+    idx integer NOT NULL,
+    data text NOT NULL,
+    PRIMARY KEY (blob_id, idx)
+);
+
+-- Chunks are only read and written by the backend (service role), after it has checked
+-- access to the owning secret with the user's own client.
+ALTER TABLE public.secret_chunks ENABLE ROW LEVEL SECURITY;
+
+-- Writing an inline value to a chunked secret turns it back into an inline secret
+CREATE OR REPLACE FUNCTION public.secrets_reset_storage()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.value_encrypted IS NOT NULL AND NEW.value_encrypted IS DISTINCT FROM OLD.value_encrypted THEN
+        NEW.storage := 'inline';
+        NEW.blob_id := NULL;
+        NEW.size_bytes := NULL;
+        NEW.chunk_count := NULL;
+        NEW.compression := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS secrets_reset_storage ON public.secrets;
+CREATE TRIGGER secrets_reset_storage
+    BEFORE UPDATE ON public.secrets
+    FOR EACH ROW EXECUTE FUNCTION public.secrets_reset_storage();
+
+CREATE OR REPLACE FUNCTION public.secrets_drop_replaced_blob()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF OLD.blob_id IS NOT NULL AND (TG_OP = 'DELETE' OR NEW.blob_id IS DISTINCT FROM OLD.blob_id) THEN
+        DELETE FROM public.secret_chunks WHERE blob_id = OLD.blob_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS secrets_drop_replaced_blob ON public.secrets;
+CREATE TRIGGER secrets_drop_replaced_blob
+    AFTER UPDATE OR DELETE ON public.secrets
+    FOR EACH ROW EXECUTE FUNCTION public.secrets_drop_replaced_blob();
+
+-- Blobs left behind by a crashed upload (never referenced by a secret) can be found with:
+--   SELECT DISTINCT c.blob_id FROM public.secret_chunks c
+--   LEFT JOIN public.secrets s ON s.blob_id = c.blob_id WHERE s.id IS NULL;
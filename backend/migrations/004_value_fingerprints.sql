@@ -0,0 +1,8 @@
+-- Value fingerprints for zero-decrypt vault diffs (see crypto.fingerprint_value)
+--
+-- value_fingerprint is "<master key id>:<HMAC-SHA256 of the plaintext>", written by the API
+-- on every value write once VALUE_FINGERPRINTS=true (enable it on every instance, or writes
+-- from the others leave stale fingerprints). Fill in existing rows with
+-- `python backfill_fingerprints.py`.
+
+ALTER TABLE public.secrets ADD COLUMN IF NOT EXISTS value_fingerprint text;
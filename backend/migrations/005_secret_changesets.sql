@@ -0,0 +1,195 @@
+-- Transactional changesets: POST /api/vaults/{vault_id}/changes (requires 001-004)
+--
+-- apply_secret_changes() applies a list of set/rename/delete operations to one vault in a
+-- single transaction: either all of them land or none do, and readers never see a
+-- half-applied edit. Values arrive already encrypted (and fingerprinted) by the API; the
+-- database never sees plaintext. It runs as the calling user (SECURITY INVOKER), so the
+-- usual RLS policies on secrets decide what they may change.
+--
+-- The per-row content_version trigger from 001 is deferred for the transaction and the
+-- vault's version is bumped once at the end.
+
+CREATE OR REPLACE FUNCTION public.bump_vault_content_version()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF current_setting('envrypt.defer_content_version', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE public.vaults SET content_version = content_version + 1 WHERE id = OLD.vault_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.vault_id IS DISTINCT FROM OLD.vault_id) THEN
+        UPDATE public.vaults SET content_version = content_version + 1 WHERE id = NEW.vault_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- The two helpers below run as definer so writers without UPDATE rights on vaults can
+-- still lock and bump the vault. They check the caller's access themselves (team member
+-- with a vault_access row, as in 009), so they are no way around RLS for anyone calling
+-- them directly over PostgREST.
+CREATE OR REPLACE FUNCTION public.can_write_vault(p_vault_id uuid)
+RETURNS boolean
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT EXISTS (
+        SELECT 1
+        FROM public.vaults v
+        JOIN public.team_members m ON m.team_id = v.team_id AND m.user_id = auth.uid()
+        JOIN public.vault_access a ON a.vault_id = v.id AND a.user_id = auth.uid()
+        WHERE v.id = p_vault_id
+    );
+$$;
+
+CREATE OR REPLACE FUNCTION public.bump_vault_content_version_once(p_vault_id uuid)
+RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_version bigint;
+BEGIN
+    IF NOT public.can_write_vault(p_vault_id) THEN
+        RAISE EXCEPTION 'Permission denied for vault %', p_vault_id USING ERRCODE = '42501';
+    END IF;
+    UPDATE public.vaults SET content_version = content_version + 1 WHERE id = p_vault_id
+    RETURNING content_version INTO v_version;
+    RETURN v_version;
+END;
+$$;
+
+-- Row lock on the vault serializes concurrent changesets (and the expected-version check)
+CREATE OR REPLACE FUNCTION public.lock_vault_content_version(p_vault_id uuid)
+RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_version bigint;
+BEGIN
+    IF NOT public.can_write_vault(p_vault_id) THEN
+        RAISE EXCEPTION 'Permission denied for vault %', p_vault_id USING ERRCODE = '42501';
+    END IF;
+    SELECT content_version INTO v_version FROM public.vaults WHERE id = p_vault_id FOR UPDATE;
+    RETURN v_version;
+END;
+$$;
+
+-- apply_secret_changes runs as the caller, so signed-in users keep EXECUTE on the helpers
+-- (guarded by the checks above); nobody else gets it.
+REVOKE EXECUTE ON FUNCTION public.can_write_vault(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.bump_vault_content_version_once(uuid) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.lock_vault_content_version(uuid) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.bump_vault_content_version_once(uuid) TO authenticated;
+GRANT EXECUTE ON FUNCTION public.lock_vault_content_version(uuid) TO authenticated;
+
+-- p_changes: [{"op": "set", "key", "value_encrypted", "encrypted_key", "value_fingerprint"},
+--             {"op": "rename", "key", "new_key"}, {"op": "delete", "key"}]
+CREATE OR REPLACE FUNCTION public.apply_secret_changes(
+    p_vault_id uuid,
+    p_changes jsonb,
+    p_actor uuid,
+    p_expected_version bigint DEFAULT NULL
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY INVOKER
+SET search_path = public
+AS $$
+DECLARE
+    v_vault record;
+    v_change jsonb;
+    v_key text;
+    v_id uuid;
+    v_created text[] := '{}';
+    v_updated text[] := '{}';
+    v_renamed text[] := '{}';
+    v_deleted text[] := '{}';
+    v_version bigint;
+BEGIN
+    -- Plain select first: RLS decides whether the caller can see the vault at all
+    SELECT id, team_id, name INTO v_vault FROM public.vaults WHERE id = p_vault_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Vault not found' USING ERRCODE = 'P0002';
+    END IF;
+    v_version := public.lock_vault_content_version(p_vault_id);
+    IF p_expected_version IS NOT NULL AND v_version <> p_expected_version THEN
+        RAISE EXCEPTION 'Vault changed (version %, expected %)', v_version, p_expected_version
+            USING ERRCODE = '40001';
+    END IF;
+
+    PERFORM set_config('envrypt.defer_content_version', 'on', true);
+
+    FOR v_change IN SELECT * FROM jsonb_array_elements(p_changes) LOOP
+        v_key := v_change->>'key';
+        SELECT id INTO v_id FROM public.secrets WHERE vault_id = p_vault_id AND key = v_key;
+
+        CASE v_change->>'op'
+        WHEN 'set' THEN
+            IF v_id IS NULL THEN
+                INSERT INTO public.secrets (vault_id, key, value_encrypted, encrypted_key, value_fingerprint, created_by)
+                VALUES (p_vault_id, v_key, v_change->>'value_encrypted', v_change->>'encrypted_key',
+                        v_change->>'value_fingerprint', p_actor);
+                v_created := v_created || v_key;
+            ELSE
+                UPDATE public.secrets
+                SET value_encrypted = v_change->>'value_encrypted',
+                    encrypted_key = v_change->>'encrypted_key',
+                    value_fingerprint = v_change->>'value_fingerprint',
+                    version = version + 1
+                WHERE id = v_id;
+                IF NOT FOUND THEN
+                    RAISE EXCEPTION 'Permission denied for %', v_key USING ERRCODE = '42501';
+                END IF;
+                v_updated := v_updated || v_key;
+            END IF;
+        WHEN 'rename' THEN
+            IF v_id IS NULL THEN
+                RAISE EXCEPTION 'Cannot rename %: no such key', v_key USING ERRCODE = 'P0002';
+            END IF;
+            IF EXISTS (SELECT 1 FROM public.secrets WHERE vault_id = p_vault_id AND key = v_change->>'new_key') THEN
+                RAISE EXCEPTION 'Cannot rename % to %: key exists', v_key, v_change->>'new_key' USING ERRCODE = '23505';
+            END IF;
+            UPDATE public.secrets SET key = v_change->>'new_key', version = version + 1 WHERE id = v_id;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Permission denied for %', v_key USING ERRCODE = '42501';
+            END IF;
+            v_renamed := v_renamed || (v_key || ' -> ' || (v_change->>'new_key'));
+        WHEN 'delete' THEN
+            IF v_id IS NULL THEN
+                RAISE EXCEPTION 'Cannot delete %: no such key', v_key USING ERRCODE = 'P0002';
+            END IF;
+            DELETE FROM public.secrets WHERE id = v_id;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Permission denied for %', v_key USING ERRCODE = '42501';
+            END IF;
+            v_deleted := v_deleted || v_key;
+        ELSE
+            RAISE EXCEPTION 'Unknown operation %', v_change->>'op' USING ERRCODE = '22023';
+        END CASE;
+    END LOOP;
+
+    PERFORM set_config('envrypt.defer_content_version', 'off', true);
+    v_version := public.bump_vault_content_version_once(p_vault_id);
+
+    RETURN jsonb_build_object(
+        'team_id', v_vault.team_id,
+        'vault_name', v_vault.name,
+        'content_version', v_version,
+        'created', to_jsonb(v_created),
+        'updated', to_jsonb(v_updated),
+        'renamed', to_jsonb(v_renamed),
+        'deleted', to_jsonb(v_deleted)
+    );
+END;
+$$;
@@ -0,0 +1,18 @@
+-- One waitlist row per email, so a signup can be a single idempotent upsert
+-- (WAITLIST_UPSERT=true, see app/waitlist_intake.py).
+--
+-- The API now stores emails lower-cased. Existing rows are normalized first; where the same
+-- address signed up more than once (in any casing) only the earliest signup is kept
+-- (by created_at, then id, so the choice doesn't depend on where rows sit on disk).
+
+DELETE FROM public.waitlist w
+USING (
+    SELECT id, row_number() OVER (PARTITION BY lower(btrim(email)) ORDER BY created_at, id) AS rn
+    FROM public.waitlist
+) ranked
+WHERE w.id = ranked.id
+  AND ranked.rn > 1;
+
+UPDATE public.waitlist SET email = lower(btrim(email)) WHERE email <> lower(btrim(email));
+
+CREATE UNIQUE INDEX IF NOT EXISTS waitlist_email_key ON public.waitlist (email);
@@ -0,0 +1,62 @@
+-- Service-token usage (TOKEN_USAGE=true, see app/token_usage.py)
+--
+-- The API counts token calls in memory and adds them here in one RPC per flush interval:
+-- running totals on service_tokens, plus one row per token and UTC day in
+-- service_token_usage for GET /api/tokens/{id}/usage. Tokens with an old (or NULL)
+-- last_used_at are the idle ones that are safe to revoke.
+
+ALTER TABLE public.service_tokens
+    ADD COLUMN IF NOT EXISTS request_count bigint NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_used_at timestamptz,
+    ADD COLUMN IF NOT EXISTS last_used_ip text;
+
+CREATE TABLE IF NOT EXISTS public.service_token_usage (
+    token_id uuid NOT NULL REFERENCES public.service_tokens(id) ON DELETE CASCADE,
+    day date NOT NULL,
+    requests bigint NOT NULL DEFAULT 0,
+    last_used_at timestamptz,
+    last_ip text,
+    vault_ids uuid[] NOT NULL DEFAULT '{}',
+    PRIMARY KEY (token_id, day)
+);
+
+-- Written and read only by the backend (service role); the usage route checks that the
+-- user can see the token with their own client first.
+ALTER TABLE public.service_token_usage ENABLE ROW LEVEL SECURITY;
+
+-- p_usage: [{"token_id", "requests", "last_used_at", "last_ip", "vault_ids": [...]}]
+-- Adds to the stored counts, so flushes from several workers sum up.
+CREATE OR REPLACE FUNCTION public.record_service_token_usage(p_usage jsonb)
+RETURNS void
+LANGUAGE sql
+SECURITY INVOKER
+SET search_path = public
+AS $$
+    WITH usage AS (
+        SELECT * FROM jsonb_to_recordset(p_usage)
+            AS u(token_id uuid, requests bigint, last_used_at timestamptz, last_ip text, vault_ids uuid[])
+    ), tokens AS (
+        UPDATE public.service_tokens t SET
+            request_count = t.request_count + usage.requests,
+            last_used_at = greatest(t.last_used_at, usage.last_used_at),
+            last_used_ip = CASE WHEN t.last_used_at IS NULL OR usage.last_used_at >= t.last_used_at
+                                THEN coalesce(usage.last_ip, t.last_used_ip) ELSE t.last_used_ip END
+        FROM usage
+        WHERE t.id = usage.token_id
+        RETURNING t.id
+    )
+    -- Joined with the updated tokens so usage of a token deleted meanwhile is skipped
+    INSERT INTO public.service_token_usage AS h (token_id, day, requests, last_used_at, last_ip, vault_ids)
+    SELECT usage.token_id, (usage.last_used_at AT TIME ZONE 'UTC')::date, usage.requests,
+           usage.last_used_at, usage.last_ip, coalesce(usage.vault_ids, '{}')
+    FROM usage JOIN tokens ON tokens.id = usage.token_id
+    ON CONFLICT (token_id, day) DO UPDATE SET
+        requests = h.requests + excluded.requests,
+        last_used_at = greatest(h.last_used_at, excluded.last_used_at),
+        last_ip = CASE WHEN h.last_used_at IS NULL OR excluded.last_used_at >= h.last_used_at
+                       THEN coalesce(excluded.last_ip, h.last_ip) ELSE h.last_ip END,
+        vault_ids = ARRAY(SELECT DISTINCT v FROM unnest(h.vault_ids || excluded.vault_ids) AS v);
+$$;
+
+-- Only the backend may report usage
+REVOKE EXECUTE ON FUNCTION public.record_service_token_usage(jsonb) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,21 @@
+-- Replication lag probe for read-replica routing (see app/replicas.py)
+--
+-- Called by the API on each replica every REPLICA_HEALTH_INTERVAL seconds. Returns 0 on
+-- the primary and on a replica that has replayed everything it received (an idle primary
+-- leaves pg_last_xact_replay_timestamp() old, which is not lag).
+
+CREATE OR REPLACE FUNCTION public.replica_lag_seconds()
+RETURNS double precision
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::double precision;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.replica_lag_seconds() FROM PUBLIC, anon, authenticated;
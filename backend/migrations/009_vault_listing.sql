@@ -0,0 +1,68 @@
+-- Access-filtered vault listing: GET /api/vaults with VAULT_ACCESS_LISTING=true
+--
+-- list_accessible_vaults() returns one page of the vaults the caller can open (a member of
+-- the team with a vault_access row, the same rule as GET /api/vaults/{id}), newest first,
+-- each with its secret count and last update time. Counts are only computed for the rows
+-- of the page, so listing stays cheap for teams with thousands of vaults.
+--
+-- Keyset pagination: pass the (created_at, id) of the last row of the previous page.
+-- p_fields projects the returned JSON (NULL for every column). last_updated_at is the
+-- latest secret write or the vault's creation; deletions don't move it.
+--
+-- SECURITY DEFINER so the access joins don't pay for RLS on every row; the caller is
+-- identified by auth.uid() and nothing is returned for a caller without access.
+
+CREATE OR REPLACE FUNCTION public.list_accessible_vaults(
+    p_team_id uuid,
+    p_limit integer DEFAULT NULL,
+    p_after_created_at timestamptz DEFAULT NULL,
+    p_after_id uuid DEFAULT NULL,
+    p_fields text[] DEFAULT NULL
+)
+RETURNS TABLE (vault jsonb, cursor_created_at timestamptz, cursor_id uuid)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    WITH page AS (
+        SELECT v.*
+        FROM public.vaults v
+        WHERE v.team_id = p_team_id
+          AND EXISTS (
+              SELECT 1 FROM public.team_members m
+              WHERE m.team_id = v.team_id AND m.user_id = auth.uid()
+          )
+          AND EXISTS (
+              SELECT 1 FROM public.vault_access a
+              WHERE a.vault_id = v.id AND a.user_id = auth.uid()
+          )
+          AND (p_after_created_at IS NULL OR (v.created_at, v.id) < (p_after_created_at, p_after_id))
+        ORDER BY v.created_at DESC, v.id DESC
+        LIMIT p_limit
+    )
+    SELECT coalesce((
+               SELECT jsonb_object_agg(f.key, f.value)
+               FROM jsonb_each(to_jsonb(page) || jsonb_build_object(
+                   'secrets_count', coalesce(s.secrets_count, 0),
+                   'last_updated_at', greatest(page.created_at, s.last_updated_at)
+               )) f
+               WHERE p_fields IS NULL OR f.key = ANY(p_fields)
+           ), '{}'::jsonb),
+           page.created_at,
+           page.id
+    FROM page
+    LEFT JOIN LATERAL (
+        SELECT count(*) AS secrets_count, max(sc.updated_at) AS last_updated_at
+        FROM public.secrets sc
+        WHERE sc.vault_id = page.id
+    ) s ON true
+    ORDER BY page.created_at DESC, page.id DESC;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.list_accessible_vaults(uuid, integer, timestamptz, uuid, text[]) FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION public.list_accessible_vaults(uuid, integer, timestamptz, uuid, text[]) TO authenticated;
+
+-- Serves the page scan. The access checks look up team_members (team_id, user_id) and
+-- vault_access (vault_id, user_id); `python check_schema.py` reports if those keys are unindexed.
+CREATE INDEX IF NOT EXISTS vaults_team_id_created_at_id_idx ON public.vaults (team_id, created_at DESC, id DESC);
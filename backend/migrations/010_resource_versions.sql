@@ -0,0 +1,116 @@
+-- Validators for conditional GETs (CONDITIONAL_GETS=true, see app/conditional.py)
+--
+-- resource_versions holds one counter per dashboard resource, bumped by triggers on every
+-- write that changes what its GET returns, whichever path made the write:
+--
+--   kind       resource_id  bumped by writes to                      serves
+--   vaults     team         vaults, vault_access, secrets             GET /api/vaults?team_id=
+--   secrets    vault        secrets                                  GET /api/vaults/{id}/secrets
+--   members    team         team_members                             GET /api/auth/teams/{id}/members
+--   tokens     team         service_tokens (incl. usage flushes)     GET /api/tokens?team_id=
+--   audit      team         audit_logs                               GET /api/audit-logs?team_id=
+--
+-- The API reads the counter (one indexed row) before the list query and answers
+-- If-None-Match / If-Modified-Since with 304 when it hasn't moved. Triggers are per
+-- statement, so a bulk insert (batched audit events, a changeset) bumps each resource once.
+-- A resource without a row has no validator yet and is always served in full.
+
+CREATE TABLE IF NOT EXISTS public.resource_versions (
+    kind text NOT NULL,
+    resource_id uuid NOT NULL,
+    version bigint NOT NULL DEFAULT 1,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (kind, resource_id)
+);
+
+-- Readable by whoever can read the resource, so a version lookup with the user's client
+-- is also the access check; written only by the triggers below.
+ALTER TABLE public.resource_versions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Members can read resource versions" ON public.resource_versions;
+CREATE POLICY "Members can read resource versions" ON public.resource_versions
+    FOR SELECT TO authenticated
+    USING (
+        CASE WHEN kind = 'secrets' THEN EXISTS (
+            SELECT 1 FROM public.vault_access a
+            WHERE a.vault_id = resource_versions.resource_id AND a.user_id = auth.uid()
+        ) ELSE EXISTS (
+            SELECT 1 FROM public.team_members m
+            WHERE m.team_id = resource_versions.resource_id AND m.user_id = auth.uid()
+        ) END
+    );
+
+CREATE OR REPLACE FUNCTION public.bump_resource_versions(p_kind text, p_ids uuid[])
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    -- Sorted, so concurrent statements lock the rows in the same order
+    INSERT INTO public.resource_versions AS r (kind, resource_id)
+    SELECT DISTINCT p_kind, id FROM unnest(p_ids) AS id WHERE id IS NOT NULL ORDER BY 2
+    ON CONFLICT (kind, resource_id) DO UPDATE SET version = r.version + 1, updated_at = now();
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.bump_resource_versions(text, uuid[]) FROM PUBLIC, anon, authenticated;
+
+-- Every trigger names its transition table changed_rows (NEW TABLE for INSERT/UPDATE,
+-- OLD TABLE for DELETE)
+CREATE OR REPLACE FUNCTION public.bump_resource_versions_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    CASE TG_TABLE_NAME
+        WHEN 'vaults' THEN
+            PERFORM public.bump_resource_versions('vaults', ARRAY(SELECT team_id FROM changed_rows));
+        WHEN 'vault_access' THEN
+            PERFORM public.bump_resource_versions('vaults', ARRAY(
+                SELECT v.team_id FROM changed_rows c JOIN public.vaults v ON v.id = c.vault_id));
+        WHEN 'secrets' THEN
+            PERFORM public.bump_resource_versions('secrets', ARRAY(SELECT vault_id FROM changed_rows));
+            -- The vault list shows secret counts and last-updated times. Bumped here rather
+            -- than relying on 001's content_version trigger, so this doesn't require 001.
+            PERFORM public.bump_resource_versions('vaults', ARRAY(
+                SELECT v.team_id FROM changed_rows c JOIN public.vaults v ON v.id = c.vault_id));
+        WHEN 'team_members' THEN
+            PERFORM public.bump_resource_versions('members', ARRAY(SELECT team_id FROM changed_rows));
+        WHEN 'service_tokens' THEN
+            PERFORM public.bump_resource_versions('tokens', ARRAY(SELECT team_id FROM changed_rows));
+        WHEN 'audit_logs' THEN
+            PERFORM public.bump_resource_versions('audit', ARRAY(SELECT team_id::uuid FROM changed_rows));
+    END CASE;
+    RETURN NULL;
+END;
+$$;
+
+-- A trigger with a transition table may only handle one event, hence three per table
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['vaults', 'vault_access', 'secrets', 'team_members', 'service_tokens', 'audit_logs'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON public.%I', t || '_bump_versions_insert', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON public.%I', t || '_bump_versions_update', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON public.%I', t || '_bump_versions_delete', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON public.%I REFERENCING NEW TABLE AS changed_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.bump_resource_versions_trigger()',
+                       t || '_bump_versions_insert', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON public.%I REFERENCING NEW TABLE AS changed_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.bump_resource_versions_trigger()',
+                       t || '_bump_versions_update', t);
+        EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON public.%I REFERENCING OLD TABLE AS changed_rows '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.bump_resource_versions_trigger()',
+                       t || '_bump_versions_delete', t);
+    END LOOP;
+END;
+$$;
+
+-- Existing resources start at version 1
+INSERT INTO public.resource_versions (kind, resource_id)
+SELECT k.kind, t.id FROM public.teams t CROSS JOIN (VALUES ('vaults'), ('members'), ('tokens'), ('audit')) AS k(kind)
+UNION ALL
+SELECT 'secrets', v.id FROM public.vaults v
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,71 @@
+-- Shared Idempotency-Key records (IDEMPOTENCY_SHARED=true, see app/idempotency.py)
+--
+-- One row per (actor, key). The worker whose insert wins runs the request; a retry that
+-- lands on any other worker finds the row and replays the recorded response, or gets 409
+-- while the first request is still running. An in-flight row (status NULL) expires after
+-- IDEMPOTENCY_LEASE seconds, so a worker killed mid-request doesn't block the key; a
+-- finished one is kept for IDEMPOTENCY_TTL. Response bodies may contain a new secret or
+-- token, so they are stored encrypted with the master key, like secret values.
+
+CREATE TABLE IF NOT EXISTS public.idempotency_keys (
+    actor text NOT NULL,
+    key text NOT NULL,
+    fingerprint text NOT NULL,
+    status integer,
+    body_encrypted text,
+    body_key text,
+    media_type text,
+    expires_at timestamptz NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (actor, key)
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at_idx ON public.idempotency_keys (expires_at);
+
+-- Written and read only by the backend (service role)
+ALTER TABLE public.idempotency_keys ENABLE ROW LEVEL SECURITY;
+
+-- Returns {"owner": true} when the caller now holds the key, otherwise {"owner": false}
+-- plus the existing row.
+CREATE OR REPLACE FUNCTION public.claim_idempotency_key(
+    p_actor text,
+    p_key text,
+    p_fingerprint text,
+    p_lease_seconds double precision
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY INVOKER
+SET search_path = public
+AS $$
+DECLARE
+    v_row public.idempotency_keys;
+BEGIN
+    -- Expired rows are cleaned up here, a small batch per claim, so the table stays bounded
+    -- without a cron job; SKIP LOCKED keeps concurrent claims from waiting on each other.
+    DELETE FROM public.idempotency_keys k
+    USING (
+        SELECT actor, key FROM public.idempotency_keys
+        WHERE expires_at <= now()
+        ORDER BY expires_at
+        LIMIT 100
+        FOR UPDATE SKIP LOCKED
+    ) stale
+    WHERE k.actor = stale.actor AND k.key = stale.key;
+    DELETE FROM public.idempotency_keys
+    WHERE actor = p_actor AND key = p_key AND expires_at <= now();
+
+    INSERT INTO public.idempotency_keys (actor, key, fingerprint, expires_at)
+    VALUES (p_actor, p_key, p_fingerprint, now() + make_interval(secs => p_lease_seconds))
+    ON CONFLICT (actor, key) DO NOTHING;
+    IF FOUND THEN
+        RETURN jsonb_build_object('owner', true);
+    END IF;
+
+    SELECT * INTO v_row FROM public.idempotency_keys WHERE actor = p_actor AND key = p_key;
+    RETURN jsonb_build_object('owner', false) || coalesce(to_jsonb(v_row), '{}'::jsonb);
+END;
+$$;
+
+-- Only the backend may claim keys
+REVOKE EXECUTE ON FUNCTION public.claim_idempotency_key(text, text, text, double precision) FROM PUBLIC, anon, authenticated;
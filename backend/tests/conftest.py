@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import uuid
+import base64
+import threading
+from datetime import datetime, timezone
+
+# Settings are read at import, so the test configuration goes in before the app is imported
+os.environ.update({
+    "SUPABASE_URL": "http://supabase.test",
+    "SUPABASE_KEY": "anon-key",
+    "SUPABASE_SERVICE_ROLE_KEY": "service-role-key",
+    "MASTER_ENCRYPTION_KEY": base64.b64encode(os.urandom(32)).decode(),
+    "ROUNDTRIP_MODE": "raise",
+})
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from app import dependencies, upstream
+from app.resilience import ResilientTransport
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeSupabase(httpx.BaseTransport):
+    """
+    In-memory stand-in for the PostgREST and GoTrue endpoints the API calls. Supports the
+    filters and embeds the routes use, records every request in `calls` and sleeps
+    `latency[table]` seconds before answering, to widen concurrency windows in tests.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.users = {}
+        self.rpcs = {}
+        self.latency = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add_user(self, token: str, user_id: str, email: str):
+        self.users[token] = {"id": user_id, "email": email, "aud": "authenticated",
+                             "app_metadata": {}, "user_metadata": {}, "created_at": _now()}
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = {"id": str(uuid.uuid4()), "created_at": _now(), "updated_at": _now(), **row}
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def count(self, method: str, path: str) -> int:
+        return sum(1 for m, p in self.calls if m == method and p == path)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        path = request.url.path
+        with self._lock:
+            self.calls.append((request.method, path))
+        table = path.rsplit("/", 1)[-1]
+        if self.latency.get(table):
+            threading.Event().wait(self.latency[table])
+
+        if path == "/auth/v1/health":
+            return httpx.Response(200, json={"name": "GoTrue"})
+        if path == "/auth/v1/user":
+            user = self.users.get(request.headers.get("authorization", "").split(" ")[-1])
+            return httpx.Response(200, json=user) if user else httpx.Response(401, json={"msg": "invalid JWT"})
+        if path.startswith("/auth/v1/admin/users/"):
+            user_id = path.rsplit("/", 1)[-1]
+            user = next((u for u in self.users.values() if u["id"] == user_id), None)
+            return httpx.Response(200, json=user) if user else httpx.Response(404, json={"msg": "not found"})
+        if path.startswith("/rest/v1/rpc/"):
+            fn = self.rpcs.get(table)
+            if fn is None:
+                return httpx.Response(404, json={"code": "PGRST202", "message": f"function {table} not found"})
+            return httpx.Response(200, json=fn(json.loads(request.content or b"{}")))
+        if path.startswith("/rest/v1/"):
+            with self._lock:
+                return self._rest(request, table)
+        return httpx.Response(404)
+
+    def _rest(self, request: httpx.Request, table: str) -> httpx.Response:
+        rows = self.tables.setdefault(table, [])
+        params = request.url.params
+        filters = [(key, value) for key, value in params.multi_items()
+                   if key not in ("select", "order", "limit", "offset", "on_conflict", "columns", "or", "and")
+                   and "." not in key]
+        matching = [row for row in rows if all(_matches(row.get(key), value) for key, value in filters)]
+
+        if request.method in ("GET", "HEAD"):
+            result = [dict(row) for row in matching]
+            for order in reversed(params.get_list("order")):
+                column, _, direction = order.partition(".")
+                result.sort(key=lambda r: str(r.get(column) or ""), reverse=direction.startswith("desc"))
+            total = len(result)
+            if params.get("offset"):
+                result = result[int(params["offset"]):]
+            if params.get("limit"):
+                result = result[:int(params["limit"])]
+            if "secrets(count)" in params.get("select", ""):
+                for row in result:
+                    row["secrets"] = [{"count": sum(1 for s in self.tables.get("secrets", []) if s["vault_id"] == row["id"])}]
+            headers = {"content-range": f"0-{max(len(result) - 1, 0)}/{total}"}
+            return httpx.Response(200, headers=headers, json=None if request.method == "HEAD" else result)
+
+        if request.method == "POST":
+            body = json.loads(request.content)
+            created = []
+            for item in body if isinstance(body, list) else [body]:
+                conflict = params.get("on_conflict")
+                existing = [r for r in rows if conflict and all(str(r.get(c)) == str(item.get(c)) for c in conflict.split(","))]
+                if existing:
+                    if "ignore-duplicates" in request.headers.get("prefer", ""):
+                        continue
+                    existing[0].update(item)
+                    created.append(dict(existing[0]))
+                    continue
+                defaults = {"version": 1, "content_version": 1} if table in ("secrets", "vaults") else {}
+                created.append(dict(self.insert(table, {**defaults, **item})))
+            if table == "secrets":
+                self._bump_content_versions(created)
+            return httpx.Response(201, json=created)
+
+        if request.method == "PATCH":
+            body = json.loads(request.content)
+            for row in matching:
+                row.update(body, updated_at=_now())
+            if table == "secrets":
+                self._bump_content_versions(matching)
+            return httpx.Response(200, json=[dict(row) for row in matching])
+
+        if request.method == "DELETE":
+            rows[:] = [row for row in rows if row not in matching]
+            if table == "secrets":
+                self._bump_content_versions(matching)
+            return httpx.Response(200, json=[dict(row) for row in matching])
+        return httpx.Response(405)
+
+    def _bump_content_versions(self, secrets):
+        # What the trigger from migrations/001_vault_bundles.sql does
+        for vault_id in {s.get("vault_id") for s in secrets}:
+            for vault in self.tables.get("vaults", []):
+                if vault["id"] == vault_id:
+                    vault["content_version"] = vault.get("content_version", 1) + 1
+
+
+def _matches(value, condition: str) -> bool:
+    op, _, operand = condition.partition(".")
+    negate = op == "not"
+    if negate:
+        op, _, operand = operand.partition(".")
+    if op == "eq":
+        result = (str(value).lower() if isinstance(value, bool) else str(value)) == operand
+    elif op == "neq":
+        result = str(value) != operand
+    elif op == "in":
+        result = str(value) in [item.strip('"') for item in operand.strip("()").split(",")]
+    elif op == "is":
+        result = value is None if operand == "null" else str(value).lower() == operand
+    elif op in ("gt", "gte", "lt", "lte"):
+        left, right = (value, int(operand)) if isinstance(value, int) else (str(value or ""), operand)
+        result = {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]
+    elif op in ("like", "ilike"):
+        pattern = "^" + re.escape(operand).replace("%", ".*").replace("\\*", ".*") + "$"
+        result = value is not None and re.match(pattern, str(value), re.I if op == "ilike" else 0) is not None
+    else:
+        result = True
+    return result != negate
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    """A fresh FakeSupabase behind the app's real transport stack (instrumentation, retries)."""
+    fake = FakeSupabase()
+    monkeypatch.setattr(upstream, "build_http_client", lambda: httpx.Client(
+        transport=upstream.InstrumentedTransport(ResilientTransport(fake)), follow_redirects=True))
+    dependencies.close_clients()
+    yield fake
+    dependencies.close_clients()
+
+
+@pytest.fixture
+def client(supabase):
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def team(supabase):
+    """A team owned by a user; `headers` authenticate as that user."""
+    supabase.add_user("user-token", "11111111-1111-1111-1111-111111111111", "owner@example.com")
+    team = supabase.insert("teams", {"name": "Acme", "slug": "acme"})
+    supabase.insert("team_members", {"team_id": team["id"], "user_id": "11111111-1111-1111-1111-111111111111",
+                                     "role": "OWNER", "joined_at": _now()})
+    return {"id": team["id"], "headers": {"Authorization": "Bearer user-token"}}
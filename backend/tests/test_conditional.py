@@ -0,0 +1,35 @@
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import timedelta
+import pytest
+from app.config import settings
+
+
+@pytest.fixture
+def versioned(client, team, supabase, monkeypatch):
+    """The vault list of `team` with a resource_versions row, as migration 010 keeps it."""
+    monkeypatch.setattr(settings, "CONDITIONAL_GETS", True)
+    row = supabase.insert("resource_versions", {"kind": "vaults", "resource_id": team["id"], "version": 3,
+                                                "updated_at": "2026-01-05T10:00:00.250000+00:00"})
+
+    def get(**headers):
+        return client.get("/api/vaults", params={"team_id": team["id"]}, headers={**team["headers"], **headers})
+    return get, row
+
+
+def test_matching_etag_gets_304(versioned):
+    get, _ = versioned
+    first = get()
+    assert first.status_code == 200
+    assert get(**{"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+
+def test_if_modified_since_ignores_writes_in_the_same_second(versioned):
+    get, row = versioned
+    last_modified = get().headers["Last-Modified"]
+    # Stamped 10:00:00 for a change at 10:00:00.25, so the header's second doesn't prove anything
+    assert get(**{"If-Modified-Since": last_modified}).status_code == 200
+    later = format_datetime(parsedate_to_datetime(last_modified) + timedelta(seconds=1), usegmt=True)
+    assert get(**{"If-Modified-Since": later}).status_code == 304
+
+    row.update(version=4, updated_at="2026-01-05T10:00:00.900000+00:00")
+    assert get(**{"If-Modified-Since": last_modified}).status_code == 200
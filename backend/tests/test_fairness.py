@@ -0,0 +1,58 @@
+import asyncio
+from app.fairness import FairScheduler, tenant_of
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_uncontended_requests_leave_no_state():
+    async def scenario():
+        scheduler = FairScheduler(slots=2, tenant_cap=2, tenant_queue=8)
+        for i in range(100):
+            await scheduler.acquire(f"team-{i}")
+            scheduler.release(f"team-{i}")
+        return scheduler
+
+    scheduler = _run(scenario())
+    assert scheduler.tenants == {} and scheduler.virtual_time == 0
+
+
+def test_idle_history_does_not_starve_a_tenant():
+    async def scenario():
+        scheduler = FairScheduler(slots=1, tenant_cap=1, tenant_queue=64)
+        order = []
+
+        async def job(name):
+            await scheduler.acquire(name)
+            order.append(name)
+            await asyncio.sleep(0)
+            scheduler.release(name)
+
+        # "a" runs a long series of requests while nobody else is busy
+        for _ in range(20):
+            await job("a")
+        assert "a" not in scheduler.tenants
+
+        # Both come back under contention: they alternate rather than "a" paying for its idle-time history
+        await scheduler.acquire("blocker")
+        order.clear()
+        tasks = []
+        for _ in range(3):
+            tasks += [asyncio.create_task(job("a")), asyncio.create_task(job("b"))]
+        await asyncio.sleep(0)
+        scheduler.release("blocker")
+        await asyncio.gather(*tasks)
+        return scheduler, order
+
+    scheduler, order = _run(scenario())
+    assert order == ["a", "b"] * 3
+    assert scheduler.tenants == {}
+
+
+def test_user_routes_are_keyed_by_the_user_not_the_team_parameter():
+    class User:
+        id = "u1"
+
+    assert tenant_of({"team_id": "someone-elses-team", "user": User()}) == "user:u1"
+    assert tenant_of({"service_token": {"team_id": "t1"}}) == "t1"
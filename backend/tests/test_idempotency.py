@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.config import settings
+from app.idempotency import store
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    store._records.clear()
+    yield
+    store._records.clear()
+
+
+@pytest.fixture
+def shared_keys(supabase, monkeypatch):
+    """IDEMPOTENCY_SHARED with claim_idempotency_key from migrations/011 done on the fake's table."""
+    monkeypatch.setattr(settings, "IDEMPOTENCY_SHARED", True)
+    rows = supabase.tables.setdefault("idempotency_keys", [])
+
+    def claim(params):
+        now = datetime.now(timezone.utc)
+        rows[:] = [r for r in rows if datetime.fromisoformat(r["expires_at"]) > now]
+        row = next((r for r in rows if r["actor"] == params["p_actor"] and r["key"] == params["p_key"]), None)
+        if row is not None:
+            return {"owner": False, **row}
+        rows.append({"actor": params["p_actor"], "key": params["p_key"], "fingerprint": params["p_fingerprint"],
+                     "status": None, "body_encrypted": None, "body_key": None, "media_type": None,
+                     "expires_at": (now + timedelta(seconds=params["p_lease_seconds"])).isoformat()})
+        return {"owner": True}
+
+    supabase.rpcs["claim_idempotency_key"] = claim
+    return rows
+
+
+def _create_vault(client, team, key, name="prod"):
+    return client.post("/api/vaults", json={"team_id": team["id"], "name": name},
+                       headers={**team["headers"], "Idempotency-Key": key})
+
+
+def test_retry_is_replayed(client, team, supabase):
+    first = _create_vault(client, team, "k1")
+    again = _create_vault(client, team, "k1")
+    assert again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert len(supabase.tables["vaults"]) == 1
+
+
+def test_key_reused_for_another_body_is_refused(client, team):
+    assert _create_vault(client, team, "k1").status_code == 200
+    assert _create_vault(client, team, "k1", name="staging").status_code == 422
+
+
+def test_retry_on_another_worker_is_replayed_from_the_table(client, team, supabase, shared_keys):
+    first = _create_vault(client, team, "k1")
+    assert shared_keys[0]["status"] == 200 and first.json()["id"] not in str(shared_keys)  # stored encrypted
+    store._records.clear()  # as seen from a worker that didn't run it
+
+    again = _create_vault(client, team, "k1")
+    assert again.json() == first.json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert len(supabase.tables["vaults"]) == 1
+
+
+def test_key_in_flight_on_another_worker_gets_409(client, team, supabase, shared_keys):
+    assert _create_vault(client, team, "k1").status_code == 200
+    # Back to how the table looks while the first request is still running on another worker
+    shared_keys[0].update(status=None, body_encrypted=None, body_key=None)
+    store._records.clear()
+
+    response = _create_vault(client, team, "k1")
+    assert response.status_code == 409 and response.headers["Retry-After"] == "1"
+    assert len(supabase.tables["vaults"]) == 1
@@ -0,0 +1,27 @@
+import pytest
+from app.config import settings
+from app.invalidation import LocalCache, bus
+
+
+def test_cache_is_off_without_a_bus():
+    # INVALIDATION_BUS=off: other workers' revocations would never reach this cache
+    cache = LocalCache("test_off", ttl=60)
+    cache.set("token", {"is_active": True}, cache.generation)
+    assert not cache.enabled and cache.get("token") is None
+
+
+@pytest.fixture
+def local_bus(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INVALIDATION_BUS", "local")
+    monkeypatch.setattr(settings, "INVALIDATION_SOCKET_DIR", str(tmp_path))
+    bus.start()
+    yield bus
+    bus.stop()
+
+
+def test_cache_works_while_the_bus_runs(local_bus):
+    cache = LocalCache("test_local", ttl=60)
+    cache.set("token", {"is_active": True}, cache.generation)
+    assert cache.get("token") == {"is_active": True}
+    local_bus.publish("test_local", "token")
+    assert cache.get("token") is None
@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture
+def vaults(client, team):
+    headers = team["headers"]
+    created = {}
+    for name, value in (("prod", "from-prod"), ("shared", "from-shared")):
+        vault = client.post("/api/vaults", json={"team_id": team["id"], "name": name}, headers=headers).json()
+        client.post("/api/secrets", json={"vault_id": vault["id"], "key": "API_URL", "value": value}, headers=headers)
+        created[name] = vault
+    return created
+
+
+@pytest.fixture
+def service_headers(client, team):
+    token = client.post("/api/tokens", json={"name": "ci", "scope": "READ_ONLY", "team_id": team["id"]},
+                        headers=team["headers"])
+    return {"Authorization": f"Bearer {token.json()['raw_token']}"}
+
+
+def test_later_vault_wins(client, vaults, service_headers):
+    response = client.get("/api/service/secrets", params={"vaults": "shared,prod"}, headers=service_headers)
+    assert response.json()["secrets"] == {"API_URL": "from-prod"}
+
+
+def test_vault_named_twice_counts_at_its_last_position(client, vaults, service_headers):
+    # prod by name, then shared, then prod again by ID: prod is last, so it wins
+    params = {"vaults": f"prod,shared,{vaults['prod']['id']}"}
+    response = client.get("/api/service/secrets", params=params, headers=service_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["secrets"] == {"API_URL": "from-prod"}
+    assert response.json()["sources"] == {"API_URL": "prod"}
@@ -0,0 +1,26 @@
+from app.config import settings
+
+
+def _vault(client, team, name, secrets):
+    vault = client.post("/api/vaults", json={"team_id": team["id"], "name": name}, headers=team["headers"]).json()
+    for key, value in secrets.items():
+        client.post("/api/secrets", json={"vault_id": vault["id"], "key": key, "value": value}, headers=team["headers"])
+    return vault
+
+
+def test_promote_does_not_overwrite_a_chunked_target(client, team, supabase, monkeypatch):
+    monkeypatch.setattr(settings, "FILE_SECRETS", True)
+    staging = _vault(client, team, "staging", {"CERT": "inline-cert", "API_URL": "https://staging"})
+    prod = _vault(client, team, "prod", {"API_URL": "https://prod"})
+    cert = supabase.insert("secrets", {
+        "vault_id": prod["id"], "key": "CERT", "value_encrypted": None, "encrypted_key": "wrapped-key",
+        "storage": "chunked", "blob_id": "blob-1", "version": 1, "created_by": team["id"],
+    })
+
+    response = client.post(f"/api/vaults/{staging['id']}/promote/{prod['id']}", json={}, headers=team["headers"])
+
+    assert response.status_code == 200, response.text
+    plan = response.json()
+    assert plan["updated"] == ["API_URL"] and plan["skipped_files"] == ["CERT"]
+    stored = next(row for row in supabase.tables["secrets"] if row["id"] == cert["id"])
+    assert stored["value_encrypted"] is None and stored["blob_id"] == "blob-1" and stored["version"] == 1
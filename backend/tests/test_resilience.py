@@ -0,0 +1,67 @@
+import time
+import httpx
+import pytest
+from app.config import settings
+from app.resilience import CircuitBreaker, ResilientTransport
+
+
+class Scripted(httpx.BaseTransport):
+    """Answers each request with the next item of `outcomes`: a status code or an exception."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = 0
+
+    def handle_request(self, request):
+        self.sent += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_RETRIES", 2)
+    monkeypatch.setattr(settings, "UPSTREAM_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(settings, "UPSTREAM_HEDGE_AFTER", 0)
+
+
+def _get(transport):
+    return transport.handle_request(httpx.Request("GET", "http://supabase.test/rest/v1/vaults"))
+
+
+def test_retried_call_counts_as_one_failure():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    upstream = Scripted(503, httpx.ConnectError("refused"), 503)
+    assert _get(ResilientTransport(upstream, breaker)).status_code == 503
+    assert upstream.sent == 3
+    assert breaker.failures == 1 and breaker.state == breaker.CLOSED
+
+
+def test_success_after_retries_clears_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure("earlier")
+    assert _get(ResilientTransport(Scripted(502, 200), breaker)).status_code == 200
+    assert breaker.failures == 0
+
+
+def test_unexpected_error_releases_half_open_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure("down")
+    with pytest.raises(RuntimeError):
+        _get(ResilientTransport(Scripted(RuntimeError("bug")), breaker))
+    assert breaker.state == breaker.HALF_OPEN
+    # The next call gets the trial instead of a 503
+    assert _get(ResilientTransport(Scripted(200), breaker)).status_code == 200
+    assert breaker.state == breaker.CLOSED
+
+
+def test_open_circuit_does_not_fail_readiness(client, monkeypatch):
+    from app.resilience import breaker
+    monkeypatch.setattr(breaker, "state", breaker.OPEN)
+    monkeypatch.setattr(breaker, "opened_at", time.monotonic())
+    response = client.get("/ready")
+    checks = response.json()["checks"]
+    assert response.status_code == 200
+    assert not checks["upstream"]["ok"] and not checks["circuit"]["ok"]
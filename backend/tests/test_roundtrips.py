@@ -0,0 +1,66 @@
+import pytest
+from app.roundtrips import RoundtripBudgetExceeded, track_roundtrips
+
+# ROUNDTRIP_MODE=raise (set in conftest): a route that makes more Supabase calls than its
+# @roundtrip_budget fails the request, so these walk the dashboard and service flows.
+
+
+@pytest.fixture
+def vault(client, team):
+    response = client.post("/api/vaults", json={"team_id": team["id"], "name": "prod"}, headers=team["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def secret(client, team, vault):
+    response = client.post("/api/secrets", json={"vault_id": vault["id"], "key": "API_KEY", "value": "s3cret"},
+                           headers=team["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def service_headers(client, team):
+    response = client.post("/api/tokens", json={"name": "ci", "scope": "READ_ONLY", "team_id": team["id"]},
+                           headers=team["headers"])
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['raw_token']}"}
+
+
+def test_dashboard_routes_stay_within_budget(client, team, vault, secret):
+    headers = team["headers"]
+    assert client.get("/api/vaults", params={"team_id": team["id"]}, headers=headers).status_code == 200
+    assert client.get(f"/api/vaults/{vault['id']}", headers=headers).status_code == 200
+    assert client.get(f"/api/vaults/{vault['id']}/secrets", headers=headers).status_code == 200
+    assert client.get(f"/api/secrets/{secret['id']}/reveal", headers=headers).json()["value"] == "s3cret"
+    assert client.patch(f"/api/secrets/{secret['id']}", json={"value": "rotated"}, headers=headers).status_code == 200
+    assert client.get("/api/tokens", params={"team_id": team["id"]}, headers=headers).status_code == 200
+    assert client.get("/api/audit-logs", params={"team_id": team["id"]}, headers=headers).status_code == 200
+    assert client.get(f"/api/auth/teams/{team['id']}/stats", headers=headers).status_code == 200
+    assert client.delete(f"/api/secrets/{secret['id']}", headers=headers).status_code == 200
+
+
+def test_service_fetch_stays_within_budget(client, vault, secret, service_headers):
+    by_id = client.get(f"/api/service/vaults/{vault['id']}/secrets", headers=service_headers)
+    assert by_id.json() == {"API_KEY": "s3cret"}
+    by_name = client.get("/api/service/vaults/prod/secrets", headers=service_headers)
+    assert by_name.json() == {"API_KEY": "s3cret"}
+
+
+def test_route_over_budget_fails(client, team, monkeypatch):
+    route = next(r for r in client.app.routes if getattr(r, "path", None) == "/api/vaults" and "GET" in r.methods)
+    # Auth lookup + vault query is already two calls
+    monkeypatch.setattr(route.endpoint, "__roundtrip_budget__", 1)
+    with pytest.raises(RoundtripBudgetExceeded) as exc_info:
+        client.get("/api/vaults", params={"team_id": team["id"]}, headers=team["headers"])
+    assert "GET /api/vaults made 2 Supabase round trips (budget 1)" in str(exc_info.value)
+
+
+def test_track_roundtrips_counts_calls(client, team):
+    from app.dependencies import get_supabase_admin
+    with track_roundtrips(budget=1) as tracker:
+        get_supabase_admin().table("vaults").select("id").eq("team_id", team["id"]).execute()
+        get_supabase_admin().table("secrets").select("id").execute()
+    assert tracker.count == 2 and tracker.over_budget
+    assert [(table, operation) for _, table, operation, _ in tracker.calls] == [("vaults", "select"), ("secrets", "select")]
@@ -0,0 +1,103 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.config import settings
+from app.singleflight import SingleFlight
+
+
+def _run_concurrently(n, fn):
+    barrier = threading.Barrier(n)
+
+    def call():
+        barrier.wait()
+        return fn()
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return [f.result() for f in [pool.submit(call) for _ in range(n)]]
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "value"
+
+    threading.Timer(0.2, release.set).start()
+    results = _run_concurrently(10, lambda: flight.do("key", work))
+    assert len(calls) == 1
+    assert [value for value, _ in results] == ["value"] * 10
+    assert sum(leader for _, leader in results) == 1
+
+
+def test_waiters_get_the_leaders_error():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    threading.Timer(0.2, release.set).start()
+    outcomes = _run_concurrently(5, lambda: _outcome(lambda: flight.do("key", work)))
+    assert outcomes == ["ValueError"] * 5
+
+
+def test_waiter_stops_waiting_for_a_hung_leader(monkeypatch):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT_WAIT", 0.1)
+    flight = SingleFlight("test")
+    hung = threading.Event()
+    started = threading.Event()
+
+    def leader_work():
+        started.set()
+        hung.wait(5)
+        return "late"
+
+    leader = threading.Thread(target=flight.do, args=("key", leader_work))
+    leader.start()
+    started.wait(5)
+    try:
+        assert flight.do("key", lambda: "own") == ("own", True)
+    finally:
+        hung.set()
+        leader.join()
+
+
+def _outcome(fn):
+    try:
+        fn()
+        return "ok"
+    except Exception as e:
+        return type(e).__name__
+
+
+@pytest.fixture
+def service_vault(client, team, supabase, monkeypatch):
+    # All requests below come from one team; let them run side by side
+    monkeypatch.setattr(settings, "FAIR_SCHEDULING", False)
+    headers = team["headers"]
+    vault = client.post("/api/vaults", json={"team_id": team["id"], "name": "prod"}, headers=headers).json()
+    for key in ("A", "B", "C"):
+        client.post("/api/secrets", json={"vault_id": vault["id"], "key": key, "value": key.lower()}, headers=headers)
+    token = client.post("/api/tokens", json={"name": "ci", "scope": "READ_ONLY", "team_id": team["id"]}, headers=headers)
+    return vault, {"Authorization": f"Bearer {token.json()['raw_token']}"}
+
+
+@pytest.mark.parametrize("single_flight, expected_reads", [(True, 1), (False, 8)])
+def test_concurrent_service_fetches_collapse_upstream_reads(client, supabase, service_vault, monkeypatch,
+                                                            single_flight, expected_reads):
+    monkeypatch.setattr(settings, "SINGLE_FLIGHT", single_flight)
+    vault, headers = service_vault
+    # Slow upstream reads, so all the fetches overlap
+    supabase.latency["secrets"] = 0.3
+    before = supabase.count("GET", "/rest/v1/secrets")
+
+    responses = _run_concurrently(8, lambda: client.get(f"/api/service/vaults/{vault['id']}/secrets", headers=headers))
+
+    assert [r.status_code for r in responses] == [200] * 8
+    assert all(r.json() == {"A": "a", "B": "b", "C": "c"} for r in responses)
+    assert supabase.count("GET", "/rest/v1/secrets") - before == expected_reads